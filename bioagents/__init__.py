@@ -4,45 +4,223 @@ logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
 logger = logging.getLogger('Bioagents')
 
 
-from indra.assemblers.english import EnglishAssembler
+import time
+import threading
 from kqml import KQMLModule, KQMLPerformative, KQMLList
+from bioagents.executor import RequestExecutor, RequestDispatcher, \
+    SerialDispatcher
+from bioagents.stats import AgentStats, StatsWriter
+from bioagents.cache import LRUCache, SingleFlight, canonical_kqml
+from bioagents.provenance import ProvenanceQueue
+from bioagents.traffic import TrafficRecorder
+from bioagents.lazy import lazy_import
+from bioagents.logs import add_agent_log_file, set_log_agent
+from bioagents.http_cache import install_http_cache_from_env
+from bioagents.profiler import RequestProfiler
+from bioagents.memory import AllocationTracker, get_rss, \
+    get_loaded_resources, get_subsystem_report
+from bioagents.exceptions import BioagentException
+from bioagents.deadline import Deadline, DeadlineExceeded, deadline_scope, \
+    current_deadline, wait_for_event
+from bioagents.process_pool import start_process_pool
 
-
-class BioagentException(Exception):
-    pass
+english = lazy_import('indra.assemblers.english')
 
 
 class Bioagent(KQMLModule):
-    """Abstract class for bioagents."""
+    """Abstract class for bioagents.
+
+    A subclass lists the `tasks` it subscribes to and handles each of them
+    with a respond method, e.g. respond_find_treatment for FIND-TREATMENT.
+    The class attributes configure how requests are handled and can also be
+    passed to the constructor:
+
+    - `num_workers` and `task_workers`: pools of threads handling requests
+      concurrently (see bioagents.executor).
+    - `cacheable_tasks`, `coalesced_tasks`, `cache_size` and `cache_ttl`:
+      caching and coalescing of responses (see bioagents.cache).
+    - `task_timeouts`: default time budgets of requests (see
+      bioagents.deadline).
+    - `stats_interval`: how often task statistics are written to a file
+      (see bioagents.stats).
+    - `async_provenance`: whether provenance is sent after the reply (see
+      bioagents.provenance).
+    - `process_workers`: a pool of worker processes for CPU-bound work (see
+      bioagents.process_pool).
+    - `message_bus`: direct delivery of messages between agents in one
+      process (see bioagents.bus).
+    - `warmup`: handle canned requests before declaring the agent ready
+      (see bioagents.warmup).
+    - `traffic_file`: record requests and replies (see bioagents.traffic).
+
+    Besides the arguments KQMLModule reads from `argv` (e.g. -connect),
+    `process_workers`, `warmup` and `traffic_file` can be given on the
+    command line as -process-workers N, -warmup true and -traffic-file
+    path.
+
+    Every agent also has the built-in tasks AGENT-STATS, PROFILE (see
+    bioagents.profiler) and MEMORY-REPORT (see bioagents.memory). Since a
+    request for one of them can't say which agent it is for by its content,
+    they aren't subscribed to, and an agent only answers them when it is
+    named as the :receiver of the request.
+    """
     name = "Generic Bioagent (Should probably be overwritten)"
     tasks = []
+    builtin_tasks = ['AGENT-STATS', 'PROFILE', 'MEMORY-REPORT']
+    num_workers = 0
+    task_workers = {}
+    stats_interval = 60.0
+    cacheable_tasks = []
+    cache_size = 256
+    cache_ttl = 3600.0
+    coalesced_tasks = []
+    async_provenance = True
+    traffic_file = None
+    task_timeouts = {}
+    process_workers = 0
+    message_bus = None
+    warmup = False
 
     def __init__(self, **kwargs):
+        set_log_agent(self.name)
+        install_http_cache_from_env()
+        if kwargs.get('argv') is not None:
+            kwargs['argv'], argv_kwargs = _translate_argv(kwargs['argv'])
+            for key, value in argv_kwargs.items():
+                kwargs.setdefault(key, value)
+        self.num_workers = kwargs.pop('num_workers', self.num_workers)
+        self.task_workers = kwargs.pop('task_workers', self.task_workers)
+        traffic_file = kwargs.pop('traffic_file', self.traffic_file)
+        self.process_workers = kwargs.pop('process_workers',
+                                          self.process_workers)
+        self.message_bus = kwargs.pop('message_bus', self.message_bus)
+        self.warmup = kwargs.pop('warmup', self.warmup)
+        self.warmup_time = None
+        self._warming_up = False
+        self.traffic_recorder = TrafficRecorder(traffic_file) \
+            if traffic_file else None
+        self._send_lock = threading.RLock()
+        self._active_deadlines = set()
+        self._deadlines_lock = threading.Lock()
+        self.stats = AgentStats(self.name)
+        self.profiler = RequestProfiler()
+        self.allocation_tracker = AllocationTracker()
+        self.response_cache = LRUCache(self.cache_size, self.cache_ttl) \
+            if self.cacheable_tasks else None
+        self.in_flight = SingleFlight()
         super(Bioagent, self).__init__(name=self.name, **kwargs)
+        self.executor = self._make_executor()
+        if self.message_bus is not None:
+            self.message_bus.register(self)
+        if self.process_workers and not self.testing:
+            start_process_pool(self.process_workers)
+        self.provenance_queue = \
+            ProvenanceQueue(self._send_provenance_html) \
+            if self.async_provenance and not self.testing else None
         self.my_log_file = self._add_log_file()
         for task in self.tasks:
             self.subscribe_request(task)
+        if self.warmup:
+            self.warmup_time = self.warm_up()
+        self.stats_writer = self._start_stats_writer()
 
         self.ready()
         self.start()
         logger.info("%s has started and is ready." % self.name)
         return
 
+    def _make_executor(self):
+        """Set up worker pools for requests if any workers are configured."""
+        if not self.num_workers and not self.task_workers:
+            self.dispatcher = SerialDispatcher(self, self.inp, self.name)
+            return None
+        executor = RequestExecutor(self.num_workers, self.task_workers)
+        self.dispatcher = RequestDispatcher(self, self.inp, self.name,
+                                            executor)
+        logger.info('%s will handle requests with %d worker(s) and '
+                    'dedicated workers for %s.'
+                    % (self.name, executor.num_workers,
+                       sorted(executor.task_workers.keys())))
+        return executor
+
+    def _start_stats_writer(self):
+        """Start periodically writing task statistics to a file."""
+        if self.testing or not self.stats_interval:
+            return None
+        stats_file_name = '%s_stats.txt' % self.name
+        writer = StatsWriter(self.stats, stats_file_name, self.stats_interval)
+        writer.start()
+        return writer
+
     @classmethod
     def _add_log_file(cls):
-        log_file_name = '%s.log' % cls.name
-        handler = logging.FileHandler(log_file_name)
-        handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s: '
-                                      '%(name)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        return log_file_name
+        return add_agent_log_file(cls.name)
+
+    def get_warmup_requests(self):
+        """Return the contents of the requests handled to warm up.
+
+        Returns
+        -------
+        list[kqml.KQMLList]
+            Representative requests for the agent's tasks, which should not
+            depend on web services. By default, there are none.
+        """
+        return []
+
+    def warm_up(self):
+        """Handle the warm-up requests and return the time it took."""
+        start_time = time.time()
+        self._warming_up = True
+        try:
+            contents = self.get_warmup_requests()
+        except Exception as e:
+            logger.warning('%s could not make its warm-up requests.' %
+                           self.name)
+            logger.exception(e)
+            contents = []
+        try:
+            for content in contents:
+                task = content.head().upper()
+                try:
+                    reply_content = self._respond_to(task, content)
+                except Exception as e:
+                    logger.warning('%s could not warm up with %s: %s' %
+                                   (self.name, task, e))
+                    continue
+                if _is_failure(reply_content):
+                    logger.warning('%s got a failure warming up with %s: %s'
+                                   % (self.name, task,
+                                      reply_content.to_string()))
+        finally:
+            self._warming_up = False
+        self.end_warmup()
+        duration = time.time() - start_time
+        logger.info('%s warmed up with %d requests in %.2f seconds.' %
+                    (self.name, len(contents), duration))
+        return duration
+
+    def end_warmup(self):
+        """Forget the warm-up requests, as if they had never been handled."""
+        self.invalidate_cache()
+        self.stats = AgentStats(self.name)
 
     def receive_tell(self, msg, content):
         tell_content = content[0].to_string().upper()
         if tell_content == 'START-CONVERSATION':
             logger.info('%s resetting' % self.name)
+            self.invalidate_cache()
+            self.cancel_requests()
+
+    def cancel_requests(self):
+        """Cancel all the requests that are being handled."""
+        with self._deadlines_lock:
+            for deadline in self._active_deadlines:
+                deadline.cancel()
+
+    def invalidate_cache(self):
+        """Remove all responses from the response cache."""
+        if self.response_cache is not None:
+            self.response_cache.clear()
 
     def receive_request(self, msg, content):
         """Handle request messages and respond.
@@ -51,6 +229,7 @@ class Bioagent(KQMLModule):
         and call the appropriate function to prepare the response. A reply
         message is then sent back.
         """
+        set_log_agent(self.name)
         try:
             content = msg.get('content')
             task = content.head().upper()
@@ -61,7 +240,11 @@ class Bioagent(KQMLModule):
             reply_content = self.make_failure('INVALID_REQUEST')
             return self.reply_with_content(msg, reply_content)
 
-        if task in self.tasks:
+        if task in self.builtin_tasks and not self.is_addressed(msg):
+            logger.error('%s requests must name the agent as :receiver.' %
+                         task)
+            reply_content = self.make_failure('MISSING_RECEIVER')
+        elif task in self.tasks or task in self.builtin_tasks:
             reply_content = self._respond_to(task, content)
         else:
             logger.error('Could not perform task.')
@@ -71,6 +254,12 @@ class Bioagent(KQMLModule):
 
         return self.reply_with_content(msg, reply_content)
 
+    def is_addressed(self, msg):
+        """Return True if the message names this agent as its :receiver."""
+        receiver = msg.get('receiver')
+        return receiver is not None and \
+            receiver.string_value().upper() == self.name.upper()
+
     def _respond_to(self, task, content):
         """Get the method to responsd to the task indicated by task."""
         resp_name = "respond_" + task.replace('-', '_').lower()
@@ -82,23 +271,254 @@ class Bioagent(KQMLModule):
             logger.error("Tried to execute unimplemented task.")
             logger.error("Did not find response method %s." % resp_name)
             return self.make_failure('INVALID_TASK')
+        start_time = time.time()
+        deadline = self._get_deadline(task, content)
+        with self._deadlines_lock:
+            self._active_deadlines.add(deadline)
         try:
-            reply_content = resp(content)
-            return reply_content
+            with deadline_scope(deadline):
+                if task in self.builtin_tasks:
+                    reply_content = self._call_cached(task, resp, content)
+                else:
+                    reply_content = self.profiler.call(self._call_cached,
+                                                       task, resp, content)
+        except DeadlineExceeded as e:
+            logger.info('%s stopped performing %s: %s' %
+                        (self.name, task, e.reason))
+            reply_content = self.make_failure(e.reason)
         except BioagentException:
+            self.stats.record(task, 'handler', time.time() - start_time)
+            self.stats.record_failure(task)
             raise
         except Exception as e:
             logger.error('Could not perform response to %s' % task)
             logger.exception(e)
-            return self.make_failure('INTERNAL_FAILURE')
+            reply_content = self.make_failure('INTERNAL_FAILURE')
+        finally:
+            with self._deadlines_lock:
+                self._active_deadlines.discard(deadline)
+        if deadline.truncated and not _is_failure(reply_content):
+            reply_content = self.make_partial(reply_content, deadline.reason)
+        self.stats.record(task, 'handler', time.time() - start_time)
+        if _is_failure(reply_content):
+            self.stats.record_failure(task)
+        return reply_content
+
+    def _get_deadline(self, task, content):
+        """Return the deadline of a request from its content or the task."""
+        try:
+            deadline_str = content.gets('deadline')
+            if deadline_str is not None:
+                return Deadline.at(float(deadline_str))
+            timeout_str = content.gets('timeout')
+            if timeout_str is not None:
+                return Deadline(float(timeout_str))
+        except Exception as e:
+            logger.warning('Could not get the deadline of the request.')
+            logger.warning(e)
+        return Deadline(self.task_timeouts.get(task))
+
+    def _call_cached(self, task, resp, content):
+        """Call a respond method, reusing cached or in-flight responses."""
+        cacheable = self.response_cache is not None and \
+            task in self.cacheable_tasks
+        if not cacheable and task not in self.coalesced_tasks:
+            return resp(content)
+        # The time a request may take doesn't change its response
+        key = canonical_kqml(content, exclude=(':DEADLINE', ':TIMEOUT'))
+        if cacheable:
+            reply_content = self.response_cache.get(key)
+            if reply_content is not None:
+                logger.info('%s using cached response to %s.' %
+                            (self.name, task))
+                return reply_content
+        deadline = current_deadline()
+
+        def truncated():
+            return deadline is not None and deadline.truncated
+
+        def respond():
+            reply_content = resp(content)
+            # Partial responses are not cached
+            if cacheable and not _is_failure(reply_content) and \
+                    not truncated():
+                self.response_cache.put(key, reply_content)
+            return reply_content
+
+        # Partial responses are not shared either, since they depend on the
+        # deadline of the request they were made for.
+        return self.in_flight.do(key, respond,
+                                 share=lambda _: not truncated(),
+                                 wait=wait_for_event)
+
+    def respond_agent_stats(self, content):
+        """Return response content to agent-stats request."""
+        reply = KQMLList('SUCCESS')
+        reply.sets('agent', self.name)
+        reply.set('uptime', '%.1f' % (time.time() - self.stats.start_time))
+        if self.warmup_time is not None:
+            reply.set('warmup-time', '%.2f' % self.warmup_time)
+        tasks = KQMLList()
+        for task, task_stats in sorted(self.stats.get_summary().items()):
+            task_msg = KQMLList()
+            task_msg.set('task', task)
+            task_msg.set('count', str(task_stats['count']))
+            task_msg.set('failures', str(task_stats['failures']))
+            task_msg.set('throughput', '%.4f' % task_stats['throughput'])
+            for metric in ('queue-wait', 'handler', 'reply'):
+                metric_stats = task_stats[metric]
+                metric_msg = KQMLList()
+                for key in ('count', 'mean', 'p50', 'p95', 'p99', 'max'):
+                    if key in metric_stats:
+                        value = metric_stats[key]
+                        metric_msg.set(key, str(value) if key == 'count'
+                                       else '%.4f' % value)
+                task_msg.set(metric, metric_msg)
+            tasks.append(task_msg)
+        reply.set('tasks', tasks)
+        if self.response_cache is not None:
+            cache_msg = KQMLList()
+            cache_msg.set('size', str(len(self.response_cache)))
+            cache_msg.set('hits', str(self.response_cache.hits))
+            cache_msg.set('misses', str(self.response_cache.misses))
+            reply.set('cache', cache_msg)
+        if self.response_cache is not None or self.coalesced_tasks:
+            reply.set('coalesced', str(self.in_flight.coalesced))
+        return reply
+
+    def get_memory_subsystems(self):
+        """Return the objects whose memory use MEMORY-REPORT reports.
+
+        Returns
+        -------
+        dict
+            The objects keyed by the name of the subsystem they belong to.
+        """
+        subsystems = {'stats': self.stats}
+        if self.response_cache is not None:
+            subsystems['response_cache'] = self.response_cache
+        return subsystems
+
+    def respond_memory_report(self, content):
+        """Return response content to memory-report request.
+
+        The reply gives the resident memory of the process in kB and the
+        number of items and estimated size in bytes of each subsystem and,
+        unless :resources is FALSE, of each shared resource. With
+        :tracemalloc START, allocations are traced from then on, and with
+        :tracemalloc DIFF, the :top lines (10 by default) that allocated
+        the most memory since the last snapshot are reported.
+        :tracemalloc STOP stops tracing.
+        """
+        subsystems = self.get_memory_subsystems()
+        resources_arg = content.gets('resources')
+        if resources_arg is None or resources_arg.upper() != 'FALSE':
+            for name, resource in get_loaded_resources().items():
+                subsystems['resource:%s' % name] = resource
+        reply = KQMLList('SUCCESS')
+        reply.set('rss', str(get_rss()))
+        subsystems_msg = KQMLList()
+        for name, sub_report in \
+                sorted(get_subsystem_report(subsystems).items()):
+            sub_msg = KQMLList()
+            sub_msg.sets('name', name)
+            if sub_report['count'] is not None:
+                sub_msg.set('count', str(sub_report['count']))
+            sub_msg.set('size', str(sub_report['size']))
+            sub_msg.set('complete',
+                        'TRUE' if sub_report['complete'] else 'FALSE')
+            subsystems_msg.append(sub_msg)
+        reply.set('subsystems', subsystems_msg)
+
+        tracing = (content.gets('tracemalloc') or '').upper()
+        if tracing == 'START':
+            self.allocation_tracker.start()
+        elif tracing == 'STOP':
+            self.allocation_tracker.stop()
+        elif tracing == 'DIFF':
+            num_lines = int(content.gets('top') or 10)
+            allocations = KQMLList()
+            for diff in \
+                    self.allocation_tracker.get_top_differences(num_lines):
+                diff_msg = KQMLList()
+                diff_msg.sets('location', diff['location'])
+                diff_msg.set('size-diff', str(diff['size_diff']))
+                diff_msg.set('count-diff', str(diff['count_diff']))
+                allocations.append(diff_msg)
+            reply.set('allocations', allocations)
+        reply.set('tracing',
+                  'TRUE' if self.allocation_tracker.tracing else 'FALSE')
+        return reply
+
+    def respond_profile(self, content):
+        """Return response content to profile request.
+
+        With :requests or :duration, a profiling session is started, and
+        with :stop TRUE the running session is ended. The reply gives the
+        status of the session, the file the statistics were written to once
+        it has ended and the :top functions (10 by default) taking the most
+        time so far, sorted by :sort (tottime or cumtime).
+        """
+        num_requests = content.gets('requests')
+        duration = content.gets('duration')
+        if content.gets('stop'):
+            self.profiler.stop()
+        else:
+            self.profiler.check_expired()
+        if num_requests is not None or duration is not None:
+            fname = '%s_profile_%d.prof' % (self.name, int(time.time()))
+            self.profiler.start(
+                int(num_requests) if num_requests is not None else None,
+                float(duration) if duration is not None else None, fname)
+        num_functions = int(content.gets('top') or 10)
+        sort = (content.gets('sort') or 'tottime').lower()
+        reply = KQMLList('SUCCESS')
+        reply.sets('status', 'running' if self.profiler.active else 'stopped')
+        reply.set('requests', str(self.profiler.num_profiled))
+        if self.profiler.fname:
+            reply.sets('file', self.profiler.fname)
+        functions = KQMLList()
+        for func in self.profiler.get_top_functions(num_functions, sort):
+            func_msg = KQMLList()
+            func_msg.sets('function', func['function'])
+            func_msg.set('calls', str(func['calls']))
+            func_msg.set('tottime', '%.4f' % func['tottime'])
+            func_msg.set('cumtime', '%.4f' % func['cumtime'])
+            functions.append(func_msg)
+        reply.set('functions', functions)
+        return reply
 
     def reply_with_content(self, msg, reply_content):
         """A wrapper around the reply method from KQMLModule."""
+        start_time = time.time()
         reply_msg = KQMLPerformative('reply')
         reply_msg.set('content', reply_content)
         self.reply(msg, reply_msg)
+        self.flush_provenance()
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.record(msg.get('content'), reply_content)
+        try:
+            task = msg.get('content').head().upper()
+        except Exception:
+            return
+        self.stats.record(task, 'reply', time.time() - start_time)
         return
 
+    def send(self, msg):
+        """Send a message, making sure concurrent messages don't interleave.
+
+        Messages to agents on the same message bus are delivered over the
+        bus, all others over the connection to the Facilitator.
+        """
+        # Nothing the agent does while warming up is for anyone to see
+        if self._warming_up:
+            return
+        if self.message_bus is not None and \
+                self.message_bus.deliver(msg, self.name):
+            return
+        with self._send_lock:
+            return super(Bioagent, self).send(msg)
+
     def tell(self, content):
         """Send a tell message."""
         msg = KQMLPerformative('tell')
@@ -119,15 +539,23 @@ class Bioagent(KQMLModule):
             msg.sets('description', description)
         return msg
 
+    def make_partial(self, reply_content, reason='TIMEOUT'):
+        """Return a PARTIAL reply with the arguments of a SUCCESS reply."""
+        msg = KQMLList('PARTIAL')
+        msg.data += reply_content.data[1:]
+        msg.set('reason', reason)
+        return msg
+
     def send_null_provenance(self, stmt, for_what, reason=''):
         """Send out that no provenance could be found for a given Statement."""
         content_fmt = ('<h4>No supporting evidence found for {statement} from '
                        '{cause}{reason}.</h4>')
-        content = KQMLList('add-provenance')
-        stmt_txt = EnglishAssembler([stmt]).make_model()
-        content.sets('html', content_fmt.format(statement=stmt_txt,
-                                                cause=for_what, reason=reason))
-        return self.tell(content)
+
+        def render():
+            stmt_txt = english.EnglishAssembler([stmt]).make_model()
+            return content_fmt.format(statement=stmt_txt, cause=for_what,
+                                      reason=reason)
+        return self._add_provenance(render)
 
     def send_provenance_for_stmts(self, stmt_list, for_what, limit=5):
         """Send out a provenance tell for a list of INDRA Statements.
@@ -138,18 +566,91 @@ class Bioagent(KQMLModule):
                     % (len(stmt_list), for_what))
         content_fmt = ('<h4>Supporting evidence from the {bioagent} for '
                        '{conclusion}:</h4>\n{evidence}<hr>')
-        evidence_html = make_evidence_html(stmt_list, limit)
-        # Actually create the content.
+        stmt_list = list(stmt_list)
+
+        def render():
+            evidence_html = make_evidence_html(stmt_list, limit)
+            return content_fmt.format(conclusion=for_what,
+                                      evidence=evidence_html,
+                                      bioagent=self.name)
+        return self._add_provenance(render)
+
+    def _add_provenance(self, render):
+        """Send provenance HTML rendered by a function, possibly later."""
+        if self._warming_up:
+            return
+        if self.provenance_queue is None:
+            return self._send_provenance_html(render())
+        self.provenance_queue.add(render)
+
+    def flush_provenance(self):
+        """Queue the provenance added on this thread to be sent."""
+        if self.provenance_queue is not None:
+            self.provenance_queue.flush()
+
+    def _send_provenance_html(self, html):
         content = KQMLList('add-provenance')
-        content.sets('html',
-                     content_fmt.format(conclusion=for_what,
-                                        evidence=evidence_html,
-                                        bioagent=self.name))
+        content.sets('html', html)
         return self.tell(content)
 
 
+def _translate_argv(argv):
+    """Return the argv without the arguments of Bioagent, and their values.
+
+    KQMLModule doesn't accept arguments it doesn't know, so these are
+    removed from the argv it gets.
+    """
+    argv = list(argv)
+    kwargs = {}
+    for arg, key in (('-process-workers', 'process_workers'),
+                     ('-warmup', 'warmup'),
+                     ('-traffic-file', 'traffic_file')):
+        if arg not in argv:
+            continue
+        idx = argv.index(arg)
+        if idx + 1 >= len(argv):
+            raise BioagentException('Argument %s needs a value.' % arg)
+        value = argv[idx + 1]
+        del argv[idx:idx + 2]
+        if key == 'process_workers':
+            kwargs[key] = int(value)
+        elif key == 'warmup':
+            kwargs[key] = value.lower() in ('true', 't', 'yes')
+        else:
+            kwargs[key] = value
+    return argv, kwargs
+
+
+def _is_failure(reply_content):
+    """Return True if the given reply content is a FAILURE."""
+    try:
+        return reply_content.head().upper() == 'FAILURE'
+    except Exception:
+        return False
+
+
+_english_cache = LRUCache(max_size=4096)
+
+
+def _get_stmt_english(stmt):
+    """Return the English rendering of a Statement, memoized by its hash."""
+    key = stmt.matches_key()
+    txt = _english_cache.get(key)
+    if txt is None:
+        txt = english.EnglishAssembler([stmt]).make_model()
+        _english_cache.put(key, txt)
+    return txt
+
+
 def make_evidence_html(stmt_list, limit=5):
-    """Creates HTML content for evidences corresponding to INDRA Statements."""
+    """Creates HTML content for evidences corresponding to INDRA Statements.
+
+    Evidences with text are listed first, followed by database entries with
+    a source ID and finally database entries that are described by turning
+    their Statement into English. Within each of these groups, evidences are
+    taken in the order of the Statements and their evidence lists, and
+    rendering stops as soon as `limit` distinct entries have been made.
+    """
     # Create some formats
     url_base = 'https://www.ncbi.nlm.nih.gov/pubmed/'
     pmid_link_fmt = '<a href={url}{pmid} target="_blank">PMID{pmid}</a>'
@@ -164,28 +665,40 @@ def make_evidence_html(stmt_list, limit=5):
                 (ev.source_api, ev.source_id)
         # Otherwise turn it into English
         else:
-            txt = EnglishAssembler([stmt]).make_model()
+            txt = _get_stmt_english(stmt)
             entry = "Database entry in '%s' representing: %s" % \
                 (ev.source_api, txt)
         return entry
 
-    # Extract a list of the evidence then map pmids to lists of text
-    evidence_list = {(ev, get_ev_desc(ev, stmt)) for stmt in stmt_list
-                     for ev in stmt.evidence}
-    evidence_with_text = {(ev, txt) for ev, txt in evidence_list if ev.text}
-    evidence_from_db = {(ev, txt) for ev, txt in evidence_list if not ev.text
-                        and ev.source_id}
-    evidence_no_ids = {(ev, txt) for ev, txt in evidence_list if (ev not in
-                       evidence_with_text) and (ev not in evidence_from_db)}
-    evidence_list = evidence_with_text | evidence_from_db | evidence_no_ids
-    entries = set()
-    for i, (ev, entry) in enumerate(evidence_list):
-        if limit and i >= limit:
+    def get_rank(ev):
+        "Get the rank of the group the evidence belongs to."
+        if ev.text:
+            return 0
+        elif ev.source_id:
+            return 1
+        return 2
+
+    def iter_evidence():
+        "Iterate over (evidence, statement) tuples in order of rank."
+        for rank in range(3):
+            for stmt in stmt_list:
+                for ev in stmt.evidence:
+                    if get_rank(ev) == rank:
+                        yield ev, stmt
+
+    stmt_list = list(stmt_list)
+    entries = []
+    seen = set()
+    for ev, stmt in iter_evidence():
+        if limit and len(entries) >= limit:
             break
+        entry = get_ev_desc(ev, stmt)
         if ev.pmid:
             entry += ' (%s)' % (pmid_link_fmt.format(url=url_base,
                                                      pmid=ev.pmid))
-        entries.add(entry)
+        if entry not in seen:
+            seen.add(entry)
+            entries.append(entry)
 
     entries_list = ['<li>%s</li>' % entry for entry in entries]
     evidence_html = '<ul>%s</ul>' % ('\n'.join(entries_list))
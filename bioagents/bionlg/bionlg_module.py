@@ -2,6 +2,8 @@ import sys
 import json
 import logging
 from bioagents import Bioagent
+from bioagents.logs import set_log_agent
+from bioagents.warmup import stmts_kstring
 from indra.statements import stmts_from_json
 from indra.assemblers.english import EnglishAssembler
 from kqml import KQMLList, KQMLPerformative, KQMLString
@@ -15,6 +17,12 @@ logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
 class BioNLG_Module(Bioagent):
     name = 'BioNLG'
     tasks = ['INDRA-TO-NL']
+    cacheable_tasks = ['INDRA-TO-NL']
+
+    def get_warmup_requests(self):
+        content = KQMLList('INDRA-TO-NL')
+        content.set('statements', stmts_kstring('MEK phosphorylates ERK'))
+        return [content]
 
     def receive_request(self, msg, content):
         """Handle request messages and respond.
@@ -23,6 +31,7 @@ class BioNLG_Module(Bioagent):
         and call the appropriate function to prepare the response. A
         reply_content message is then sent back.
         """
+        set_log_agent(self.name)
         try:
             content = msg.get('content')
             task_str = content.head().upper()
@@ -32,8 +41,10 @@ class BioNLG_Module(Bioagent):
             logger.error(e)
             return self.error_reply(msg, 'Invalid task')
         try:
-            if task_str == 'INDRA-TO-NL':
-                reply_content = self.respond_indra_to_nl(content)
+            if task_str in self.builtin_tasks and not self.is_addressed(msg):
+                reply_content = self.make_failure('MISSING_RECEIVER')
+            elif task_str in self.tasks or task_str in self.builtin_tasks:
+                reply_content = self._respond_to(task_str, content)
             else:
                 return self.error_reply(msg, 'Unknown task ' + task_str)
         except Exception as e:
@@ -47,8 +58,13 @@ class BioNLG_Module(Bioagent):
     def respond_indra_to_nl(self, content):
         """Return response content to build-model request."""
         stmts_json_str = content.gets('statements')
-        stmts = decode_indra_stmts(stmts_json_str)
-        txts = assemble_english(stmts)
+        try:
+            stmts = decode_indra_stmts(stmts_json_str)
+            txts = assemble_english(stmts)
+        except Exception as e:
+            logger.error('Failed to perform task.')
+            logger.error(e)
+            return self.make_failure('NL_GENERATION_ERROR')
         txts_kqml = [KQMLString(txt) for txt in txts]
         txts_list = KQMLList(txts_kqml)
         reply = KQMLList('OK')
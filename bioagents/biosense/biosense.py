@@ -1,16 +1,17 @@
 import logging
 from indra import __path__ as _indra_path
-from indra.sources import trips
-from indra.sources.trips.processor import TripsProcessor
 from indra.databases import get_identifiers_url, uniprot_client
 from indra.util import read_unicode_csv
-from indra.tools import expand_families
-from indra.preassembler.hierarchy_manager import hierarchies
+from bioagents.lazy import lazy_import
+from bioagents.ekb import resolve_ekb
 
 
 logger = logging.getLogger('BioSense')
 _indra_path = _indra_path[0]
 
+expand_families = lazy_import('indra.tools.expand_families')
+hierarchy_manager = lazy_import('indra.preassembler.hierarchy_manager')
+
 
 class BioSense(object):
     """Python API for biosense agent"""
@@ -133,7 +134,7 @@ class BioSense(object):
         agent, ont_type, _ = list(agents.values())[0]
         if ont_type != 'ONT::PROTEIN-FAMILY':
             raise CollectionNotFamilyOrComplexError
-        return member_agent.isa(agent, hierarchies)
+        return member_agent.isa(agent, hierarchy_manager.hierarchies)
 
     def choose_sense_what_member(self, collection_ekb):
         """Get members of a collection.
@@ -199,11 +200,7 @@ class BioSense(object):
 
     @staticmethod
     def _get_agent(agent_ekb):
-        tp = TripsProcessor(agent_ekb)
-        terms = tp.tree.findall('TERM')
-        term_id = terms[0].attrib['id']
-        agent = tp._get_agent_by_id(term_id, None)
-        return agent
+        return resolve_ekb(agent_ekb).get_agent()
 
 
 def _get_urls(agent):
@@ -212,34 +209,21 @@ def _get_urls(agent):
     return urls
 
 
-def _get_agent_tuples(tp):
-    terms = tp.tree.findall('TERM')
+def _get_agent_tuples(ekb):
     all_agents = {}
-    for term in terms:
-        term_id = term.attrib['id']
-        _, ont_type, _ = trips.processor._get_db_refs(term)
-        agent = tp._get_agent_by_id(term_id, None)
+    for term_id in ekb.term_ids:
+        ont_type = ekb.get_ont_type(term_id)
+        agent = ekb.get_agent(term_id)
         urls = _get_urls(agent)
         all_agents[term_id] = (agent, ont_type, urls)
     return all_agents
 
 
-def _get_ambiguities(tp):
-    terms = tp.tree.findall('TERM')
-    all_ambiguities = {}
-    for term in terms:
-        term_id = term.attrib.get('id')
-        _, _, ambiguities = trips.processor._get_db_refs(term)
-        if ambiguities:
-            all_ambiguities[term_id] = ambiguities
-    return all_ambiguities
-
-
 def _get_members(agent):
     dbname, dbid = agent.get_grounding()
     if dbname not in ['FPLX', 'BE']:
         return None
-    eh = hierarchies['entity']
+    eh = hierarchy_manager.hierarchies['entity']
     uri = eh.get_uri(dbname, dbid)
     children_uris = sorted(eh.get_children(uri))
     children_agents = [expand_families._agent_from_uri(uri)
@@ -248,9 +232,9 @@ def _get_members(agent):
 
 
 def _process_ekb(ekb):
-    tp = trips.process_xml(ekb)
-    agents = _get_agent_tuples(tp)
-    ambiguities = _get_ambiguities(tp)
+    resolved = resolve_ekb(ekb)
+    agents = _get_agent_tuples(resolved)
+    ambiguities = resolved.get_ambiguities()
     return agents, ambiguities
 
 
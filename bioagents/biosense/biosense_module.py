@@ -5,6 +5,7 @@ from .biosense import BioSense, _get_urls
 from .biosense import InvalidAgentError, UnknownCategoryError
 from .biosense import InvalidCollectionError, CollectionNotFamilyOrComplexError
 from bioagents import Bioagent
+from bioagents.warmup import ekb_kstring
 from kqml import KQMLPerformative, KQMLList, KQMLString
 
 
@@ -26,6 +27,14 @@ class BioSense_Module(Bioagent):
     tasks = ['CHOOSE-SENSE', 'CHOOSE-SENSE-CATEGORY',
              'CHOOSE-SENSE-IS-MEMBER', 'CHOOSE-SENSE-WHAT-MEMBER',
              'GET-SYNONYMS']
+    # GET-SYNONYMS looks up synonyms in the UniProt web service
+    cacheable_tasks = ['CHOOSE-SENSE', 'CHOOSE-SENSE-CATEGORY',
+                       'CHOOSE-SENSE-IS-MEMBER', 'CHOOSE-SENSE-WHAT-MEMBER']
+
+    def get_warmup_requests(self):
+        content = KQMLList('CHOOSE-SENSE')
+        content.set('ekb-term', ekb_kstring('MAP2K1'))
+        return [content]
 
     def respond_choose_sense(self, content):
         """Return response content to choose-sense request."""
@@ -0,0 +1,99 @@
+"""Deliver KQML messages directly between agents running in one process.
+
+Normally every message an agent sends is written to its socket as a string,
+routed by the Facilitator and parsed again by the agent receiving it. When
+the sender and the receiver run in the same process, e.g. in an AgentHost,
+a MessageBus can instead hand the KQMLPerformative itself to the receiver
+over an in-memory queue, which saves serializing and parsing large contents
+such as models.
+
+A message goes over the bus if its :receiver is an agent registered with the
+bus; all other messages, including those without a receiver, are sent over
+the socket as before. The receiving agent handles a message from the bus
+like any other: requests are passed to receive_request, and replies are
+sent back over the bus to the sender, whose reply continuations are called.
+Messages from the bus are dispatched under the same lock as those from the
+connection, so they don't make an agent handle requests concurrently unless
+it has worker pools (see bioagents.executor).
+Messages aren't copied, so they shouldn't be changed once sent.
+"""
+import queue
+import logging
+import threading
+from kqml import KQMLPerformative, KQMLList
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class MessageBus(object):
+    """Queues delivering messages between agents in the same process."""
+    def __init__(self):
+        self._inboxes = {}
+        self._lock = threading.Lock()
+
+    def register(self, agent):
+        """Start delivering messages sent to the agent over the bus."""
+        name = agent.name.upper()
+        inbox = queue.Queue()
+        with self._lock:
+            self._inboxes[name] = inbox
+        thread = threading.Thread(target=self._dispatch, args=(agent, inbox),
+                                  name='%s-bus' % agent.name)
+        thread.daemon = True
+        thread.start()
+        logger.info('%s is receiving messages over the local bus.' %
+                    agent.name)
+
+    def unregister(self, agent_name):
+        """Stop delivering messages to the given agent over the bus."""
+        with self._lock:
+            inbox = self._inboxes.pop(agent_name.upper(), None)
+        if inbox is not None:
+            inbox.put(None)
+
+    def is_local(self, agent_name):
+        """Return True if the given agent is registered with the bus."""
+        return agent_name.upper() in self._inboxes
+
+    def deliver(self, msg, sender):
+        """Deliver a message if its receiver is registered with the bus.
+
+        Parameters
+        ----------
+        msg : kqml.KQMLPerformative
+            The message to deliver.
+        sender : str
+            The name of the agent sending the message, which the receiver
+            can reply to.
+
+        Returns
+        -------
+        bool
+            True if the message was delivered over the bus, False if it
+            has to be sent over the socket.
+        """
+        receiver = msg.get('receiver')
+        if receiver is None:
+            return False
+        inbox = self._inboxes.get(receiver.string_value().upper())
+        if inbox is None:
+            return False
+        # Like the Facilitator, we tell the receiver who sent the message,
+        # without changing the sender's copy of it.
+        delivered = KQMLPerformative(KQMLList(list(msg.data.data)))
+        delivered.set('sender', sender)
+        inbox.put(delivered)
+        return True
+
+    def _dispatch(self, agent, inbox):
+        while True:
+            msg = inbox.get()
+            if msg is None:
+                return
+            try:
+                agent.dispatcher.dispatch_message(msg)
+            except Exception as e:
+                logger.error('%s could not handle a message from the bus.' %
+                             agent.name)
+                logger.exception(e)
@@ -0,0 +1,172 @@
+"""A bounded cache for the responses of tasks that are pure functions.
+
+The tasks of a Bioagent whose response only depends on the content of the
+request can be listed in its `cacheable_tasks`. Their successful responses
+are then kept in an LRUCache of `cache_size` entries that expire after
+`cache_ttl` seconds, keyed by the canonical form of the request content
+(without its :deadline or :timeout). Any messages a respond method sends
+besides its reply are not repeated when a cached response is used. The
+cache is cleared when a new conversation starts.
+
+SingleFlight coalesces concurrent identical requests, so that only one of
+them is handled and the others share its response. This is done for the
+tasks in `cacheable_tasks` and in `coalesced_tasks`, which can list tasks
+that aren't pure functions but whose response can still be given to a
+duplicate request, e.g. a stochastic simulation. Responses cut short by a
+deadline are not shared, and a waiting request still times out on its own
+deadline.
+"""
+import time
+import threading
+from collections import OrderedDict
+from kqml import KQMLList, KQMLToken
+
+
+class LRUCache(object):
+    """A thread-safe least-recently-used cache whose entries can expire.
+
+    Parameters
+    ----------
+    max_size : int
+        The maximum number of entries kept in the cache.
+    ttl : Optional[float]
+        The number of seconds after which an entry expires. If None,
+        entries don't expire.
+    """
+    def __init__(self, max_size=128, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for the given key, or None if not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, timestamp = entry
+                if self.ttl is None or time.time() - timestamp <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.shared = False
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls with the same key into a single call.
+
+    While a call for a key is in progress, later calls with the same key
+    wait for it to finish and return its result instead of calling their
+    function. A result is only shared if the call returned and `share`
+    accepts it; otherwise the waiting calls go ahead and call their own
+    function, one at a time.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, share=None, wait=None):
+        """Call a function unless a call with the same key is in progress.
+
+        Parameters
+        ----------
+        key : str
+            The key identifying calls whose results are interchangeable.
+        func : callable
+            The function to call, without arguments.
+        share : Optional[callable]
+            A function taking the result and returning whether calls
+            waiting for it may use it. By default, all results are shared.
+        wait : Optional[callable]
+            A function taking a threading.Event and waiting for it to be
+            set, which can raise an exception to stop waiting early. By
+            default, calls wait as long as it takes.
+
+        Returns
+        -------
+        object
+            The result of the function, or of the call in progress.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    break
+            if wait is not None:
+                wait(call.done)
+            else:
+                call.done.wait()
+            if call.shared:
+                with self._lock:
+                    self.coalesced += 1
+                return call.result
+        try:
+            call.result = func()
+            call.shared = share is None or share(call.result)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def canonical_kqml(obj, exclude=()):
+    """Return a canonical string form of a KQML object.
+
+    Keyword arguments in a list are sorted and keywords upper-cased so that
+    contents that differ only in the order or case of their keywords have
+    the same canonical form. String values are kept as they are. Keywords
+    in exclude (e.g. ':TIMEOUT') are left out of the top-level list.
+    """
+    if not isinstance(obj, KQMLList):
+        return obj.to_string()
+    parts = []
+    pairs = []
+    idx = 0
+    while idx < len(obj):
+        elem = obj[idx]
+        elem_str = elem.to_string() if not isinstance(elem, KQMLList) \
+            else None
+        if elem_str is not None and elem_str.startswith(':') and \
+                idx + 1 < len(obj):
+            keyword = elem_str.upper()
+            if keyword not in exclude:
+                pairs.append((keyword, canonical_kqml(obj[idx + 1])))
+            idx += 2
+        else:
+            parts.append(canonical_kqml(elem))
+            idx += 1
+    if parts and isinstance(obj[0], KQMLToken):
+        parts[0] = parts[0].upper()
+    parts += ['%s %s' % pair for pair in sorted(pairs)]
+    return '(%s)' % ' '.join(parts)
@@ -0,0 +1,121 @@
+"""Time budgets and cooperative cancellation for the requests of bioagents.
+
+While a request is handled, the deadline of the request is available to the
+code handling it on the same thread. Long-running loops check it at points
+where they can stop safely: `check_deadline` raises DeadlineExceeded when the
+request is out of time or has been cancelled, while `deadline_reached` lets
+code that has useful results already stop early and return them. In the
+latter case, the reply to the request is marked as partial.
+
+A request to a Bioagent is given a time budget with a :timeout (in seconds)
+or :deadline (in seconds since the epoch) argument in its content, or with
+a default for its task in the agent's `task_timeouts`. A request that runs
+out of time gets a FAILURE reply with reason TIMEOUT, or, if it stopped
+early with results, a PARTIAL reply with the same arguments as a SUCCESS
+reply would have. Requests being handled when a new conversation starts
+are cancelled.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from bioagents.exceptions import BioagentException
+
+
+class DeadlineExceeded(BioagentException):
+    """Raised when a request runs out of time or is cancelled."""
+    def __init__(self, reason='TIMEOUT'):
+        super(DeadlineExceeded, self).__init__(reason)
+        self.reason = reason
+
+
+class Deadline(object):
+    """The time budget of a request.
+
+    Parameters
+    ----------
+    timeout : Optional[float]
+        The number of seconds the request may take. If None, the request
+        has no time limit but can still be cancelled.
+    """
+    def __init__(self, timeout=None):
+        self.expires_at = time.time() + timeout if timeout is not None \
+            else None
+        self.cancelled = False
+        self.truncated = False
+
+    @classmethod
+    def at(cls, expires_at):
+        """Return a Deadline expiring at the given time since the epoch."""
+        deadline = cls()
+        deadline.expires_at = expires_at
+        return deadline
+
+    def remaining(self):
+        """Return the number of seconds left, or None if there is no limit."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.time(), 0.0)
+
+    def expired(self):
+        if self.cancelled:
+            return True
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    @property
+    def reason(self):
+        return 'CANCELLED' if self.cancelled else 'TIMEOUT'
+
+    def cancel(self):
+        self.cancelled = True
+
+
+_local = threading.local()
+
+
+def current_deadline():
+    """Return the deadline of the request handled on this thread, if any."""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Make the given deadline the current one within a with block."""
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current request is out of time."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(deadline.reason)
+
+
+def wait_for_event(event, poll_interval=0.1):
+    """Wait for an event to be set within the current request's deadline.
+
+    Raises DeadlineExceeded if the request runs out of time or is cancelled
+    before the event is set.
+    """
+    if current_deadline() is None:
+        event.wait()
+        return
+    while not event.wait(poll_interval):
+        check_deadline()
+
+
+def deadline_reached():
+    """Return True if the current request should stop with partial results.
+
+    If this returns True, the reply to the request is marked as partial, so
+    callers should only use it where they have results to return.
+    """
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        deadline.truncated = True
+        return True
+    return False
@@ -11,11 +11,14 @@ import logging
 import sqlite3
 import operator
 from indra.statements import ActiveForm
-from indra.databases import cbio_client
 from bioagents import BioagentException
+from bioagents.lazy import lazy_import, lazy_resource, \
+    lazy_module_attributes
 
 logger = logging.getLogger('DTDA')
 
+cbio_client = lazy_import('indra.databases.cbio_client')
+
 _resource_dir = os.path.dirname(os.path.realpath(__file__)) + '/../resources/'
 
 
@@ -27,7 +30,8 @@ class DiseaseNotFoundException(BioagentException):
     pass
 
 
-def _make_cbio_efo_map():
+@lazy_resource
+def get_cbio_efo_map():
     lines = open(_resource_dir + 'cbio_efo_map.tsv', 'rt').readlines()
     cbio_efo_map = {}
     for lin in lines:
@@ -39,17 +43,18 @@ def _make_cbio_efo_map():
     return cbio_efo_map
 
 
-cbio_efo_map = _make_cbio_efo_map()
+@lazy_resource
+def get_sub_statements():
+    """Return the statements about the effect of amino acid substitutions."""
+    bel_corpus = _resource_dir + 'large_corpus_direct_subs.pkl'
+    with open(bel_corpus, 'rb') as fh:
+        sub_statements = pickle.load(fh)
+    logger.info('Loaded %d mutation effect statements' % len(sub_statements))
+    return sub_statements
 
 
 class DTDA(object):
     def __init__(self):
-        # Build an initial set of substitution statements
-        bel_corpus = _resource_dir + 'large_corpus_direct_subs.pkl'
-        with open(bel_corpus, 'rb') as fh:
-            self.sub_statements = pickle.load(fh)
-        logger.info('Loaded %d mutation effect statements' %
-                    len(self.sub_statements))
         # Load a database of drug targets
         drug_db_file = _resource_dir + 'drug_targets.db'
         if os.path.isfile(drug_db_file):
@@ -60,6 +65,10 @@ class DTDA(object):
             logger.error('DTDA could not load drug-target database.')
             self.drug_db = None
 
+    @property
+    def sub_statements(self):
+        return get_sub_statements()
+
     def __del__(self):
         if self.drug_db is not None:
             self.drug_db.close()
@@ -143,7 +152,7 @@ class DTDA(object):
 
     @staticmethod
     def _get_studies_from_disease_name(disease_name):
-        study_prefixes = cbio_efo_map.get(disease_name)
+        study_prefixes = get_cbio_efo_map().get(disease_name)
         if study_prefixes is None:
             return None
         study_ids = []
@@ -245,3 +254,7 @@ class Disease(object):
 
     def __str__(self):
         return self.__repr__()
+
+
+# The map used to be loaded on import as cbio_efo_map
+lazy_module_attributes(__name__, cbio_efo_map=get_cbio_efo_map)
@@ -1,12 +1,13 @@
 import sys
 import logging
 import xml.etree.ElementTree as ET
-from indra.sources.trips.processor import TripsProcessor
 from kqml import KQMLList
 from .dtda import DTDA, Disease, \
                   DrugNotFoundException, DiseaseNotFoundException
 from bioagents import Bioagent
+from bioagents.ekb import resolve_ekb
 from bioagents.resources.trips_ont_manager import trips_isa
+from bioagents.warmup import ekb_kstring
 
 
 logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
@@ -21,12 +22,20 @@ class DTDA_Module(Bioagent):
     name = "DTDA"
     tasks = ['IS-DRUG-TARGET', 'FIND-TARGET-DRUG', 'FIND-DRUG-TARGETS',
              'FIND-DISEASE-TARGETS', 'FIND-TREATMENT']
+    # The disease tasks read mutation data from cBioPortal, which changes
+    cacheable_tasks = ['IS-DRUG-TARGET', 'FIND-TARGET-DRUG',
+                       'FIND-DRUG-TARGETS']
 
     def __init__(self, **kwargs):
         # Instantiate a singleton DTDA agent
         self.dtda = DTDA()
         super(DTDA_Module, self).__init__(**kwargs)
 
+    def get_warmup_requests(self):
+        content = KQMLList('FIND-TARGET-DRUG')
+        content.set('target', ekb_kstring('BRAF'))
+        return [content]
+
     def respond_is_drug_target(self, content):
         """Response content to is-drug-target request."""
         try:
@@ -198,11 +207,7 @@ class DTDA_Module(Bioagent):
 
     @staticmethod
     def _get_agent(agent_ekb):
-        tp = TripsProcessor(agent_ekb)
-        terms = tp.tree.findall('TERM')
-        term_id = terms[0].attrib['id']
-        agent = tp._get_agent_by_id(term_id, None)
-        return agent
+        return resolve_ekb(agent_ekb).get_agent()
 
     @staticmethod
     def get_disease(disease_str):
@@ -0,0 +1,103 @@
+"""Shared, memoized processing of TRIPS EKBs into INDRA Agents.
+
+The EKBs describing entities often reach several agents, and the same EKB
+is often needed more than once while handling a request. `resolve_ekb`
+parses each EKB once with INDRA's TripsProcessor and keeps the result in an
+LRU cache keyed by a hash of the EKB, from which the Agents, ontology
+types, groundings and ambiguities of its terms can then be taken.
+"""
+import hashlib
+import threading
+from copy import deepcopy
+from bioagents.cache import LRUCache
+from bioagents.lazy import lazy_import
+
+
+trips_processor = lazy_import('indra.sources.trips.processor')
+
+
+class ResolvedEKB(object):
+    """The terms of an EKB and the Agents, types and groundings they have.
+
+    Agents are constructed when first requested and copies of them are
+    returned, so they can be changed by the caller.
+
+    Parameters
+    ----------
+    ekb : str
+        The EKB XML.
+    """
+    def __init__(self, ekb):
+        self.processor = trips_processor.TripsProcessor(ekb)
+        self.terms = self.processor.tree.findall('TERM')
+        self.term_ids = [term.attrib.get('id') for term in self.terms]
+        self._db_refs = {}
+        self._agents = {}
+        self._lock = threading.Lock()
+
+    def _get_term_id(self, term_id):
+        # Without a term ID, we use the first term of the EKB
+        return self.term_ids[0] if term_id is None else term_id
+
+    def get_agent(self, term_id=None):
+        """Return the Agent for a term, by default the first one."""
+        term_id = self._get_term_id(term_id)
+        with self._lock:
+            if term_id not in self._agents:
+                self._agents[term_id] = \
+                    self.processor._get_agent_by_id(term_id, None)
+            agent = self._agents[term_id]
+        return deepcopy(agent)
+
+    def _get_db_refs(self, term_id):
+        term_id = self._get_term_id(term_id)
+        with self._lock:
+            if term_id not in self._db_refs:
+                term = self.terms[self.term_ids.index(term_id)]
+                self._db_refs[term_id] = \
+                    trips_processor._get_db_refs(term)
+            return self._db_refs[term_id]
+
+    def get_groundings(self, term_id=None):
+        """Return the groundings of a term as a dict of db_refs."""
+        return dict(self._get_db_refs(term_id)[0])
+
+    def get_ont_type(self, term_id=None):
+        """Return the TRIPS ontology type of a term."""
+        return self._get_db_refs(term_id)[1]
+
+    def get_ambiguities(self):
+        """Return a dict of the ambiguities of each term that has some."""
+        ambiguities = {}
+        for term_id in self.term_ids:
+            term_ambiguities = self._get_db_refs(term_id)[2]
+            if term_ambiguities:
+                ambiguities[term_id] = term_ambiguities
+        return ambiguities
+
+    def get_complex_id(self):
+        """Return the ID of the first macromolecular complex term, if any."""
+        for term_id, term in zip(self.term_ids, self.terms):
+            term_type = term.find('type')
+            if term_type is not None and \
+                    term_type.text == 'ONT::MACROMOLECULAR-COMPLEX':
+                return term_id
+        return None
+
+
+_ekb_cache = LRUCache(max_size=512)
+
+
+def resolve_ekb(ekb):
+    """Return the ResolvedEKB for an EKB, parsing it only if not cached."""
+    if isinstance(ekb, bytes):
+        ekb_bytes = ekb
+        ekb = ekb.decode('utf-8')
+    else:
+        ekb_bytes = ekb.encode('utf-8')
+    key = hashlib.sha1(ekb_bytes).hexdigest()
+    resolved = _ekb_cache.get(key)
+    if resolved is None:
+        resolved = ResolvedEKB(ekb)
+        _ekb_cache.put(key, resolved)
+    return resolved
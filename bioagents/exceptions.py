@@ -0,0 +1,5 @@
+"""Exceptions shared by the bioagents."""
+
+
+class BioagentException(Exception):
+    pass
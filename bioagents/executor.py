@@ -0,0 +1,157 @@
+"""Worker pools that allow bioagents to handle requests concurrently.
+
+By default a Bioagent handles each request on the thread that reads messages
+from its KQML connection, which means that a single slow request holds up
+every other request sent to the agent. The classes here allow requests to be
+handed off to pools of worker threads instead, with optional dedicated pools
+for individual tasks so that the number of concurrently running instances of
+a given (typically expensive) task can be limited.
+
+A Bioagent hands requests off to a pool of `num_workers` threads if that is
+set. Tasks listed in its `task_workers` get a dedicated pool with the given
+number of workers, which keeps them from holding up other tasks. Since
+respond methods may then run concurrently, an agent should only enable
+workers if its respond methods are safe to run in parallel.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kqml import KQMLDispatcher
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class RequestExecutor(object):
+    """Run request handlers on worker pools, with optional per-task pools.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of worker threads in the default pool, which is shared by
+        all tasks that don't have a dedicated pool.
+    task_workers : Optional[dict]
+        A dict whose keys are task names (e.g. SATISFIES-PATTERN) and whose
+        values are the number of worker threads in a pool dedicated to that
+        task. This is the maximum number of requests for the given task
+        that are handled at the same time.
+    """
+    def __init__(self, num_workers=1, task_workers=None):
+        self.num_workers = max(num_workers, 1)
+        self.task_workers = {k.upper(): v for k, v in
+                             (task_workers or {}).items()}
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _get_pool(self, task):
+        """Return the pool for the given task, creating it if needed."""
+        key = task if task in self.task_workers else None
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                if key is None:
+                    max_workers = self.num_workers
+                else:
+                    max_workers = max(self.task_workers[key], 1)
+                pool = ThreadPoolExecutor(max_workers=max_workers)
+                self._pools[key] = pool
+        return pool
+
+    def submit(self, task, fn, *args, **kwargs):
+        """Submit a function to run on the pool for the given task.
+
+        Parameters
+        ----------
+        task : str or None
+            The name of the task, used to choose a pool. If None, or if the
+            task doesn't have a dedicated pool, the default pool is used.
+        fn : callable
+            The function to run.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            A future representing the result of the call.
+        """
+        if self._shutdown:
+            raise RuntimeError('Cannot submit to a RequestExecutor that has '
+                               'been shut down.')
+        task = task.upper() if task else None
+        return self._get_pool(task).submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Shut down all the worker pools."""
+        self._shutdown = True
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+
+class SerialDispatcher(KQMLDispatcher):
+    """A KQML dispatcher that dispatches one message at a time.
+
+    Messages can reach an agent both from its KQML connection and from a
+    message bus (see bioagents.bus), each read on its own thread. Dispatching
+    them under one lock keeps handlers running one at a time, as if all
+    messages came from the connection. Provenance added while handling a
+    message is flushed once it has been handled, however the handler ended.
+    """
+    def __init__(self, rec, inp, agent_name):
+        super(SerialDispatcher, self).__init__(rec, inp, agent_name)
+        self.dispatch_lock = threading.RLock()
+
+    def dispatch_message(self, msg):
+        with self.dispatch_lock:
+            try:
+                return super(SerialDispatcher, self).dispatch_message(msg)
+            finally:
+                self.receiver.flush_provenance()
+
+
+class RequestDispatcher(SerialDispatcher):
+    """A KQML dispatcher that hands requests to a RequestExecutor.
+
+    Requests are passed to the receiver's `receive_request` method on a
+    worker thread, so that any request handling a subclass of Bioagent does
+    (including exception handling in overridden `receive_request` methods)
+    is preserved. All other messages are dispatched one at a time on the
+    thread reading them, as usual.
+    """
+    def __init__(self, rec, inp, agent_name, executor):
+        super(RequestDispatcher, self).__init__(rec, inp, agent_name)
+        self.executor = executor
+
+    def dispatch_message(self, msg):
+        verb = msg.head()
+        content = msg.get('content')
+        if verb is None or verb.lower() != 'request' or content is None \
+                or msg.get('in-reply-to') is not None:
+            return super(RequestDispatcher, self).dispatch_message(msg)
+        try:
+            task = content.head().upper()
+        except Exception:
+            task = None
+        future = self.executor.submit(task, self._handle_request, msg,
+                                      content, task, time.time())
+        return future
+
+    def _handle_request(self, msg, content, task=None, received_at=None):
+        if task is not None and received_at is not None:
+            self.receiver.stats.record(task, 'queue-wait',
+                                       time.time() - received_at)
+        try:
+            self.receiver.receive_request(msg, content)
+        except Exception as e:
+            logger.error('Unhandled exception while handling request.')
+            logger.exception(e)
+            reply_content = self.receiver.make_failure('INTERNAL_FAILURE')
+            self.receiver.reply_with_content(msg, reply_content)
+        finally:
+            self.receiver.flush_provenance()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        super(RequestDispatcher, self).shutdown()
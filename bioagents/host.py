@@ -0,0 +1,201 @@
+"""Run several bioagents in a single process.
+
+Each agent has its own connection to the Facilitator and its own thread
+reading from it, but the modules they import and the resources they load
+(INDRA's hierarchies, the TRIPS ontology, resource files) are only loaded
+once and shared by all of them. These are not modified by the agents, so
+sharing them is safe, and the memory used by the agents together is much
+less than when each runs as a separate process.
+
+Example:
+
+    python -m bioagents.host --connect localhost:6200 MRA TRA DTDA
+"""
+import sys
+import logging
+import argparse
+import threading
+import importlib
+from bioagents import BioagentException
+from bioagents.bus import MessageBus
+from bioagents.http_cache import install_http_cache_from_env
+
+
+logger = logging.getLogger('Bioagents')
+
+
+# The class of each agent that can be hosted, as module.class
+AGENT_CLASSES = {
+    'MRA': 'bioagents.mra.mra_module.MRA_Module',
+    'TRA': 'bioagents.tra.tra_module.TRA_Module',
+    'DTDA': 'bioagents.dtda.dtda_module.DTDA_Module',
+    'BIOSENSE': 'bioagents.biosense.biosense_module.BioSense_Module',
+    'QCA': 'bioagents.qca.qca_module.QCA_Module',
+    'MSA': 'bioagents.msa.msa_module.MSA_Module',
+    'BIONLG': 'bioagents.bionlg.bionlg_module.BioNLG_Module',
+    }
+
+
+def get_agent_class(agent_name):
+    """Return the Bioagent subclass of the agent with the given name."""
+    class_path = AGENT_CLASSES.get(agent_name.upper())
+    if class_path is None:
+        raise BioagentException('Unknown agent: %s' % agent_name)
+    module_name, class_name = class_path.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+
+def preload_resources(agent_names):
+    """Load the resources shared by the given agents.
+
+    Resources are otherwise loaded when first needed. Loading them before the
+    agents start means the first requests don't have to wait for them, and
+    that they are not loaded by several agents at the same time.
+    """
+    agent_names = {name.upper() for name in agent_names}
+    install_http_cache_from_env()
+    from indra.preassembler.hierarchy_manager import hierarchies
+    # The hierarchies only build their transitive closures when initialized,
+    # which otherwise happens on the first request that uses them.
+    for hierarchy in hierarchies.values():
+        hierarchy.initialize()
+    logger.info('Loaded %d hierarchies.' % len(hierarchies))
+    if 'DTDA' in agent_names:
+        from bioagents.resources.trips_ont_manager import get_trips_ontology
+        from bioagents.dtda.dtda import get_cbio_efo_map, get_sub_statements
+        get_trips_ontology()
+        get_cbio_efo_map()
+        get_sub_statements()
+    if 'MRA' in agent_names:
+        from bioagents.mra.mra import get_ccle_map
+        from bioagents.mra import sbgn_colorizer
+        get_ccle_map()
+        sbgn_colorizer.get_expression_cache()
+        sbgn_colorizer.get_mutation_cache()
+
+
+class AgentHost(object):
+    """Run a set of bioagents, each on its own thread, in this process.
+
+    Parameters
+    ----------
+    agent_names : list[str]
+        The names of the agents to run, e.g. MRA or TRA.
+    preload : Optional[bool]
+        If True, the shared resources are loaded before the agents start.
+        Default: True
+    record_traffic : Optional[bool]
+        If True, the requests and replies of each agent are recorded in
+        a file called <name>_traffic.in (see bioagents.traffic).
+        Default: False
+    local_bus : Optional[bool]
+        If True, messages between the agents are delivered over a
+        MessageBus in this process instead of through the Facilitator.
+        Default: False
+    **kwargs
+        Keyword arguments passed to the constructor of every agent, e.g.
+        host and port.
+    """
+    def __init__(self, agent_names, preload=True, record_traffic=False,
+                 local_bus=False, **kwargs):
+        self.agent_classes = [get_agent_class(name) for name in agent_names]
+        self.preload = preload
+        self.record_traffic = record_traffic
+        self.agent_kwargs = kwargs
+        self.message_bus = MessageBus() if local_bus else None
+        self.agents = {}
+        self.threads = []
+        if preload:
+            preload_resources(agent_names)
+
+    def start(self):
+        """Start all the agents, each on a thread of its own."""
+        for agent_class in self.agent_classes:
+            thread = threading.Thread(target=self._run_agent,
+                                      args=(agent_class,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _run_agent(self, agent_class):
+        # A Bioagent only returns from its constructor once its connection
+        # is closed, so we keep a reference to it before it is constructed.
+        agent = agent_class.__new__(agent_class)
+        self.agents[agent_class.name] = agent
+        kwargs = dict(self.agent_kwargs)
+        if self.record_traffic:
+            kwargs['traffic_file'] = '%s_traffic.in' % agent_class.name
+        if self.message_bus is not None:
+            kwargs['message_bus'] = self.message_bus
+        try:
+            agent.__init__(**kwargs)
+        except SystemExit:
+            pass
+        except Exception as e:
+            logger.error('%s stopped with an error.' % agent_class.name)
+            logger.exception(e)
+        if self.message_bus is not None:
+            self.message_bus.unregister(agent_class.name)
+        logger.info('%s has stopped.' % agent_class.name)
+
+    def join(self):
+        """Wait until all the agents have stopped."""
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(1.0)
+
+    def stop(self):
+        """Close the connections of all the agents."""
+        for agent in self.agents.values():
+            if getattr(agent, 'dispatcher', None) is not None:
+                agent.dispatcher.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run several bioagents in a single process.')
+    parser.add_argument('agents', nargs='+',
+                        help='The agents to run, out of %s.' %
+                             ', '.join(sorted(AGENT_CLASSES)))
+    parser.add_argument('--connect', default='localhost:6200',
+                        help='The host and port of the Facilitator.')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='Load shared resources when first needed '
+                             'instead of before the agents start.')
+    parser.add_argument('--record', action='store_true',
+                        help='Record the requests and replies of each agent '
+                             'in <name>_traffic.in.')
+    parser.add_argument('--local-bus', action='store_true',
+                        help='Deliver messages between the agents in this '
+                             'process instead of through the Facilitator.')
+    parser.add_argument('--warmup', action='store_true',
+                        help='Have each agent handle canned requests before '
+                             'it is ready, to speed up the first requests.')
+    parser.add_argument('--process-workers', type=int, default=0,
+                        help='The number of worker processes for CPU-bound '
+                             'work, or 0 to do it in the agents\' own '
+                             'processes.')
+    args = parser.parse_args(argv)
+
+    host, _, port = args.connect.partition(':')
+    kwargs = {'host': host}
+    if port:
+        kwargs['port'] = int(port)
+    if args.warmup:
+        kwargs['warmup'] = True
+    if args.process_workers:
+        kwargs['process_workers'] = args.process_workers
+    agent_host = AgentHost(args.agents, preload=not args.no_preload,
+                           record_traffic=args.record,
+                           local_bus=args.local_bus, **kwargs)
+    agent_host.start()
+    try:
+        agent_host.join()
+    except KeyboardInterrupt:
+        logger.info('Keyboard interrupt received, stopping agents.')
+        agent_host.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
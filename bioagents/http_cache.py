@@ -0,0 +1,263 @@
+"""A shared, persistent cache for the HTTP requests made by the agents.
+
+The agents look things up in web services on the paths handling requests,
+mostly through INDRA's clients (cBioPortal, the context client, the INDRA
+DB REST API, UniProt) but also directly (the QCA's path and context
+services) and through the NDEx client. All of these use the requests
+library, so `install_http_cache` hooks into requests itself:
+
+- Requests made with requests.get, requests.post etc. go through one shared
+  Session, so connections to a service are pooled instead of being opened
+  for every request.
+- Responses to GET and POST requests are kept in a cache on disk (and in
+  memory), keyed by the method, the URL with its parameters, the headers
+  (including credentials and cookies) and the body of the request, and are
+  served from there until their time to live expires. Responses that are
+  not successful or are marked no-store aren't cached.
+- In offline mode, responses are only served from the cache, whatever their
+  age, and requests that have no recorded response fail with
+  OfflineCacheMiss (a requests.ConnectionError), as if there were no
+  network. Running the agents online once with a cache directory records
+  the responses that can then be replayed offline, e.g. for benchmarks.
+
+The cache can also be configured with environment variables, which agents
+read when they start: BIOAGENTS_HTTP_CACHE (the cache directory),
+BIOAGENTS_HTTP_TTL (the time to live in seconds) and BIOAGENTS_HTTP_OFFLINE.
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+import requests
+import requests.api
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlparse
+from bioagents.cache import LRUCache
+
+
+logger = logging.getLogger('Bioagents')
+
+
+_original_session_request = requests.Session.request
+_original_api_request = requests.api.request
+
+# Headers that requests adds to every request and that don't change the
+# response. They are left out of cache keys so that these don't depend on
+# the version of requests.
+_UNKEYED_HEADERS = {'user-agent', 'accept-encoding', 'connection',
+                    'content-length'}
+
+
+class OfflineCacheMiss(requests.ConnectionError):
+    """Raised in offline mode for requests without a recorded response."""
+    pass
+
+
+class HttpCache(object):
+    """A cache of HTTP responses on disk with a shared connection pool.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory in which responses are stored.
+    ttl : Optional[float]
+        The number of seconds for which a response is served from the cache.
+        Default: 86400 (one day)
+    host_ttls : Optional[dict]
+        Times to live for the responses of given hosts, overriding ttl.
+    offline : Optional[bool]
+        If True, responses are only served from the cache, regardless of
+        their age. Default: False
+    pool_size : Optional[int]
+        The number of connections kept open to each host. Default: 10
+    """
+    def __init__(self, cache_dir, ttl=86400, host_ttls=None, offline=False,
+                 pool_size=10):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.host_ttls = host_ttls if host_ttls else {}
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._entries = LRUCache(max_size=256)
+        self._lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, session, method, url, **kwargs):
+        """Return the response to a request, from the cache if possible."""
+        method = method.upper()
+        key = self._get_key(session, method, url, kwargs)
+        if key is None:
+            if self.offline:
+                raise OfflineCacheMiss('Cannot replay %s %s.' % (method, url))
+            return _original_session_request(session, method, url, **kwargs)
+        entry = self._load(key)
+        if entry is not None and \
+                (self.offline or entry['expires_at'] > time.time()):
+            with self._lock:
+                self.hits += 1
+            return _to_response(entry)
+        if self.offline:
+            raise OfflineCacheMiss('No recorded response to %s %s.' %
+                                   (method, url))
+        with self._lock:
+            self.misses += 1
+        response = _original_session_request(session, method, url, **kwargs)
+        ttl = self._get_ttl(url, response)
+        if response.status_code == 200 and ttl:
+            self._save(key, response, ttl)
+        return response
+
+    def _get_key(self, session, method, url, kwargs):
+        # Only simple GET and POST requests are cached
+        if method not in ('GET', 'POST') or kwargs.get('stream') or \
+                kwargs.get('files'):
+            return None
+        # The request is prepared as the session would, so that its headers
+        # include the session's and those set by authentication, and requests
+        # made with different credentials don't share responses.
+        prepared = session.prepare_request(
+            requests.Request(method, url, params=kwargs.get('params'),
+                             data=kwargs.get('data'), json=kwargs.get('json'),
+                             headers=kwargs.get('headers'),
+                             cookies=kwargs.get('cookies'),
+                             auth=kwargs.get('auth')))
+        body = prepared.body or b''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        key_hash = hashlib.sha1(('%s %s\n' % (method, prepared.url))
+                                .encode('utf-8'))
+        for name, value in sorted((name.lower(), value) for name, value
+                                  in prepared.headers.items()):
+            if name in _UNKEYED_HEADERS:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('latin-1')
+            key_hash.update(('%s: %s\n' % (name, value)).encode('utf-8'))
+        key_hash.update(body)
+        return key_hash.hexdigest()
+
+    def _get_ttl(self, url, response):
+        if 'no-store' in response.headers.get('Cache-Control', ''):
+            return 0
+        return self.host_ttls.get(urlparse(url).hostname, self.ttl)
+
+    def _get_fname(self, key):
+        return os.path.join(self.cache_dir, '%s.json' % key)
+
+    def _load(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._get_fname(key), 'r') as fh:
+                entry = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        self._entries.put(key, entry)
+        return entry
+
+    def _save(self, key, response, ttl):
+        entry = {'url': response.url,
+                 'status_code': response.status_code,
+                 'reason': response.reason,
+                 'headers': dict(response.headers),
+                 'encoding': response.encoding,
+                 'content': base64.b64encode(response.content).decode('ascii'),
+                 'expires_at': time.time() + ttl}
+        self._entries.put(key, entry)
+        fname = self._get_fname(key)
+        tmp_fname = '%s.%d.%d.tmp' % (fname, os.getpid(),
+                                      threading.current_thread().ident)
+        try:
+            with open(tmp_fname, 'w') as fh:
+                json.dump(entry, fh)
+            os.rename(tmp_fname, fname)
+        except (IOError, OSError) as e:
+            logger.warning('Could not cache the response from %s: %s' %
+                           (response.url, e))
+
+
+def _to_response(entry):
+    response = requests.Response()
+    response.url = entry['url']
+    response.status_code = entry['status_code']
+    response.reason = entry['reason']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.encoding = entry['encoding']
+    response._content = base64.b64decode(entry['content'])
+    # The content is all there, so iter_content and the like don't try to
+    # read it from a connection
+    response._content_consumed = True
+    return response
+
+
+_http_cache = None
+
+
+def _cached_session_request(session, method, url, **kwargs):
+    cache = _http_cache
+    if cache is None:
+        return _original_session_request(session, method, url, **kwargs)
+    return cache.request(session, method, url, **kwargs)
+
+
+def _shared_session_request(method, url, **kwargs):
+    cache = _http_cache
+    if cache is None:
+        return _original_api_request(method, url, **kwargs)
+    return cache.session.request(method=method, url=url, **kwargs)
+
+
+def install_http_cache(cache_dir, ttl=86400, host_ttls=None, offline=False):
+    """Make all HTTP requests made with requests go through a cache.
+
+    See HttpCache for the parameters.
+
+    Returns
+    -------
+    HttpCache
+        The installed cache.
+    """
+    global _http_cache
+    _http_cache = HttpCache(cache_dir, ttl=ttl, host_ttls=host_ttls,
+                            offline=offline)
+    requests.Session.request = _cached_session_request
+    requests.api.request = _shared_session_request
+    logger.info('Caching HTTP responses in %s%s.' %
+                (cache_dir, ' (offline)' if offline else ''))
+    return _http_cache
+
+
+def uninstall_http_cache():
+    """Make HTTP requests go to the network directly again."""
+    global _http_cache
+    requests.Session.request = _original_session_request
+    requests.api.request = _original_api_request
+    _http_cache = None
+
+
+def get_http_cache():
+    """Return the installed HTTP cache, or None if there is none."""
+    return _http_cache
+
+
+def install_http_cache_from_env():
+    """Install the HTTP cache configured in the environment, if any."""
+    cache_dir = os.environ.get('BIOAGENTS_HTTP_CACHE')
+    if not cache_dir or _http_cache is not None:
+        return _http_cache
+    ttl = float(os.environ.get('BIOAGENTS_HTTP_TTL', 86400))
+    offline = os.environ.get('BIOAGENTS_HTTP_OFFLINE', '').lower() in \
+        ('1', 'true', 'yes')
+    return install_http_cache(cache_dir, ttl=ttl, offline=offline)
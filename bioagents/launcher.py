@@ -0,0 +1,182 @@
+"""Start bioagent processes forked from a parent with preloaded resources.
+
+The launcher imports the agents' modules and loads the resources they share
+(INDRA's hierarchies, the TRIPS ontology, the DTDA's statements, the SBGN
+colorizer's caches) once, and then forks a process for each agent. Since
+the agents don't modify these resources, the memory pages holding them stay
+shared between the processes instead of being copied into each one.
+
+The launcher periodically reports how much of each agent's resident memory
+is unique to it, how much is shared with the others and how much memory
+sharing saves in total. This relies on /proc, so it only works on Linux, as
+does forking agents this way.
+
+Example:
+
+    python -m bioagents.launcher --connect localhost:6200 MRA TRA DTDA
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+import argparse
+from bioagents.host import AGENT_CLASSES, get_agent_class, preload_resources
+from bioagents.memory import get_memory_usage, get_rss
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class AgentLauncher(object):
+    """Fork a process for each agent after loading shared resources.
+
+    Parameters
+    ----------
+    agent_names : list[str]
+        The names of the agents to run, e.g. MRA or TRA.
+    **kwargs
+        Keyword arguments passed to the constructor of every agent, e.g.
+        host and port.
+    """
+    def __init__(self, agent_names, **kwargs):
+        self.agent_classes = [get_agent_class(name) for name in agent_names]
+        self.agent_kwargs = kwargs
+        self.pids = {}
+        # This includes building INDRA's hierarchies, which are the largest
+        # of the resources, so that the children share them too.
+        rss_before = get_rss()
+        preload_resources(agent_names)
+        self.preloaded_size = get_rss() - rss_before
+        logger.info('Preloaded resources take %.1f MB.' %
+                    (self.preloaded_size / 1024.0))
+        # Objects that exist now are left alone by the garbage collector so
+        # that it doesn't write to (and so copy) the pages they are on.
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def start(self):
+        """Fork a process for each agent."""
+        for agent_class in self.agent_classes:
+            pid = os.fork()
+            if pid == 0:
+                self._run_agent(agent_class)
+            self.pids[pid] = agent_class.name
+            logger.info('Started %s with PID %d.' % (agent_class.name, pid))
+
+    def _run_agent(self, agent_class):
+        status = 0
+        try:
+            agent_class(**self.agent_kwargs)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 0
+        except Exception as e:
+            logger.error('%s stopped with an error.' % agent_class.name)
+            logger.exception(e)
+            status = 1
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
+    def get_memory_report(self):
+        """Return a text report of the memory used by each agent."""
+        lines = ['%-10s %8s %10s %10s %10s %10s' %
+                 ('agent', 'pid', 'rss (MB)', 'unique', 'shared', 'pss')]
+        total_rss = total_unique = total_pss = 0
+        pids = [('launcher', os.getpid())] + \
+            [(name, pid) for pid, name in sorted(self.pids.items())]
+        for name, pid in pids:
+            try:
+                mem = get_memory_usage(pid)
+            except (IOError, OSError):
+                continue
+            total_rss += mem['rss']
+            total_unique += mem['unique']
+            total_pss += mem['pss']
+            lines.append('%-10s %8d %10.1f %10.1f %10.1f %10.1f' %
+                         (name, pid, mem['rss'] / 1024.0,
+                          mem['unique'] / 1024.0, mem['shared'] / 1024.0,
+                          mem['pss'] / 1024.0))
+        lines.append('Total unique: %.1f MB, total PSS: %.1f MB' %
+                     (total_unique / 1024.0, total_pss / 1024.0))
+        # Each process's RSS counts the pages it shares in full, while its
+        # PSS only counts its share of them, so the difference between the
+        # two totals is the memory saved by sharing pages.
+        lines.append('Saved by sharing: %.1f MB (preloaded resources: '
+                     '%.1f MB)' % ((total_rss - total_pss) / 1024.0,
+                                   self.preloaded_size / 1024.0))
+        return '\n'.join(lines)
+
+    def wait(self, report_interval=60.0):
+        """Wait for the agents to stop, reporting memory usage periodically.
+
+        Parameters
+        ----------
+        report_interval : Optional[float]
+            The number of seconds between memory reports. If 0, memory
+            usage is not reported. Default: 60
+        """
+        last_report = time.time()
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                name = self.pids.pop(pid, None)
+                logger.info('%s (PID %d) exited with status %d.' %
+                            (name, pid, status))
+                continue
+            if report_interval and \
+                    time.time() - last_report >= report_interval:
+                logger.info('Memory usage:\n%s' % self.get_memory_report())
+                last_report = time.time()
+            time.sleep(0.5)
+
+    def stop(self):
+        """Terminate all the agent processes."""
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Start bioagent processes that share preloaded '
+                    'resources.')
+    parser.add_argument('agents', nargs='+',
+                        help='The agents to run, out of %s.' %
+                             ', '.join(sorted(AGENT_CLASSES)))
+    parser.add_argument('--connect', default='localhost:6200',
+                        help='The host and port of the Facilitator.')
+    parser.add_argument('--report-interval', type=float, default=60.0,
+                        help='The number of seconds between reports of '
+                             'memory usage, or 0 to not report it.')
+    parser.add_argument('--warmup', action='store_true',
+                        help='Have each agent handle canned requests before '
+                             'it is ready, to speed up the first requests.')
+    parser.add_argument('--process-workers', type=int, default=0,
+                        help='The number of worker processes each agent '
+                             'runs CPU-bound work in, or 0 to run it in the '
+                             'agent\'s own process.')
+    args = parser.parse_args(argv)
+
+    host, _, port = args.connect.partition(':')
+    kwargs = {'host': host}
+    if port:
+        kwargs['port'] = int(port)
+    if args.warmup:
+        kwargs['warmup'] = True
+    if args.process_workers:
+        kwargs['process_workers'] = args.process_workers
+    launcher = AgentLauncher(args.agents, **kwargs)
+    launcher.start()
+    try:
+        launcher.wait(args.report_interval)
+    except KeyboardInterrupt:
+        logger.info('Keyboard interrupt received, stopping agents.')
+        launcher.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
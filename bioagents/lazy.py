@@ -0,0 +1,112 @@
+"""Deferred loading of heavy dependencies and resources.
+
+Many of the packages and resource files the bioagents depend on take a long
+time to import or load, while only some requests actually need them. The
+helpers here allow modules to refer to them as usual but to only load them
+when they are first used.
+"""
+import sys
+import threading
+import importlib
+import functools
+
+
+class LazyModule(object):
+    """A stand-in for a module that is imported when it is first used.
+
+    Parameters
+    ----------
+    name : str
+        The full name of the module, e.g. matplotlib.pyplot.
+    setup : Optional[callable]
+        A function to call right before importing the module.
+    """
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    if self._setup is not None:
+                        self._setup()
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<LazyModule %s (%s)>' % \
+            (self._name, 'loaded' if self.is_loaded else 'not loaded')
+
+
+def lazy_import(name, setup=None):
+    """Return a module that is only imported when an attribute is used."""
+    return LazyModule(name, setup)
+
+
+def lazy_resource(loader):
+    """Decorate a function without arguments so that it only runs once.
+
+    The first call of the decorated function loads and returns the resource
+    and all later calls return the same object.
+    """
+    lock = threading.Lock()
+    cache = []
+
+    @functools.wraps(loader)
+    def get_resource():
+        if not cache:
+            with lock:
+                if not cache:
+                    cache.append(loader())
+        return cache[0]
+    get_resource.is_loaded = lambda: bool(cache)
+    return get_resource
+
+
+def lazy_module_attributes(module_name, **resources):
+    """Make attributes of a module that load a resource when first used.
+
+    This keeps module attributes that used to be loaded at import time
+    available, e.g. lazy_module_attributes(__name__, ccle_map=get_ccle_map)
+    at the end of a module whose loader is get_ccle_map.
+
+    Parameters
+    ----------
+    module_name : str
+        The full name of the module, usually __name__.
+    **resources : callable
+        The loaders of the attributes, typically decorated with
+        lazy_resource, by attribute name.
+    """
+    module = sys.modules[module_name]
+    attrs = {name: property(lambda self, loader=loader: loader())
+             for name, loader in resources.items()}
+    module.__class__ = type('LazyAttributeModule', (type(module),), attrs)
+
+
+class lazy_property(object):
+    """Like property, but the value is computed once, when first accessed.
+
+    The value is stored in the instance's __dict__ under the same name,
+    which then takes precedence over this descriptor.
+    """
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self.func(obj)
+        obj.__dict__[self.func.__name__] = value
+        return value
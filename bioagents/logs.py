@@ -0,0 +1,252 @@
+"""Logging for bioagents that keeps disk I/O off the threads handling requests.
+
+`start_queue_logging` replaces the handlers of the root logger with a handler
+putting records on a queue, and moves the original handlers to a background
+thread that writes the records out. Each record is tagged with the agent
+whose thread logged it, so that when several agents run in one process, the
+log file of each agent only gets its own records. Records logged outside of
+any agent, e.g. by background threads, go to the files of all agents.
+
+Large objects such as models, diagrams and lists of statements should be
+logged wrapped in `LargePayload`, which only formats a bounded part of them.
+Records with such payloads are also rate-limited per message, so that
+requests arriving in quick succession don't format the same kind of payload
+over and over.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from itertools import islice
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s: %(name)s - %(message)s'
+
+
+_local = threading.local()
+
+
+def set_log_agent(agent_name):
+    """Tag the records logged on this thread with the name of an agent."""
+    _local.agent = agent_name
+
+
+def get_log_agent():
+    """Return the name of the agent records on this thread are tagged with."""
+    return getattr(_local, 'agent', None)
+
+
+@contextmanager
+def log_agent_scope(agent_name):
+    """Tag the records logged within a with block with an agent's name."""
+    previous = get_log_agent()
+    _local.agent = agent_name
+    try:
+        yield
+    finally:
+        _local.agent = previous
+
+
+def _make_record_factory(base_factory):
+    def record_factory(*args, **kwargs):
+        record = base_factory(*args, **kwargs)
+        record.agent = get_log_agent()
+        return record
+    return record_factory
+
+
+class AgentFilter(logging.Filter):
+    """Let through the records of one agent and those of no agent."""
+    def __init__(self, agent_name):
+        super(AgentFilter, self).__init__()
+        self.agent_name = agent_name
+
+    def filter(self, record):
+        agent = getattr(record, 'agent', None)
+        return agent is None or agent == self.agent_name
+
+
+class LargePayload(object):
+    """A log message argument formatting only part of a large object.
+
+    The object is only formatted if the record is emitted. For lists, sets,
+    tuples and dicts only the first few items are formatted, and the text
+    of each item and of the whole is truncated.
+
+    Parameters
+    ----------
+    obj : object
+        The object to log.
+    max_items : Optional[int]
+        The number of items of a collection to format. Default: 10
+    max_length : Optional[int]
+        The maximum length of the text of an item and of the whole.
+        Default: 1000
+    """
+    def __init__(self, obj, max_items=10, max_length=1000):
+        self.obj = obj
+        self.max_items = max_items
+        self.max_length = max_length
+
+    def _shorten(self, text):
+        if len(text) <= self.max_length:
+            return text
+        return '%s... (%d characters)' % (text[:self.max_length], len(text))
+
+    def __str__(self):
+        obj = self.obj
+        if isinstance(obj, dict):
+            items = ['%s: %s' % (key, self._shorten(str(value)))
+                     for key, value in islice(obj.items(), self.max_items)]
+            text = '{%s}' % ', '.join(items)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            items = [self._shorten(str(value))
+                     for value in islice(obj, self.max_items)]
+            text = '[%s]' % ', '.join(items)
+        else:
+            return self._shorten(str(obj))
+        if len(obj) > self.max_items:
+            text += ' ... (%d items)' % len(obj)
+        return self._shorten(text)
+
+
+def _has_payload(record):
+    if isinstance(record.msg, LargePayload):
+        return True
+    return isinstance(record.args, tuple) and \
+        any(isinstance(arg, LargePayload) for arg in record.args)
+
+
+class PayloadRateFilter(logging.Filter):
+    """Drop records with large payloads that are logged too often.
+
+    Of the records with a LargePayload that are logged with the same
+    message, at most one per interval is let through. Since the filter runs
+    before records are formatted, dropped payloads are never formatted.
+
+    Parameters
+    ----------
+    interval : Optional[float]
+        The minimum number of seconds between records with the same
+        message. Default: 1
+    """
+    def __init__(self, interval=1.0):
+        super(PayloadRateFilter, self).__init__()
+        self.interval = interval
+        self.dropped = 0
+        self._last_times = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not _has_payload(record):
+            return True
+        key = (record.name, str(record.msg) if not
+               isinstance(record.msg, LargePayload) else None)
+        now = time.time()
+        with self._lock:
+            last_time = self._last_times.get(key)
+            if last_time is not None and now - last_time < self.interval:
+                self.dropped += 1
+                return False
+            self._last_times[key] = now
+        return True
+
+
+_listener = None
+_queue_handler = None
+_factory_installed = False
+_agent_handlers = {}
+_lock = threading.Lock()
+
+
+def start_queue_logging():
+    """Move the handlers of the root logger to a background thread.
+
+    Calling this again once logging goes through the queue has no effect.
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        The listener writing out the records put on the queue.
+    """
+    global _listener, _queue_handler, _factory_installed
+    with _lock:
+        if _listener is not None:
+            return _listener
+        if not _factory_installed:
+            logging.setLogRecordFactory(
+                _make_record_factory(logging.getLogRecordFactory()))
+            atexit.register(stop_queue_logging)
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=_restart_in_child)
+            _factory_installed = True
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        for handler in handlers:
+            root.removeHandler(handler)
+        log_queue = queue.Queue()
+        _queue_handler = QueueHandler(log_queue)
+        _queue_handler.addFilter(PayloadRateFilter())
+        root.addHandler(_queue_handler)
+        _listener = QueueListener(log_queue, *handlers,
+                                  respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+
+def stop_queue_logging():
+    """Write out the queued records and log on the calling threads again."""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = None
+
+
+def _restart_in_child():
+    # The thread writing out records doesn't exist in a forked process, and
+    # the queue's lock may have been held by another thread when forking.
+    global _listener
+    if _listener is not None:
+        log_queue = queue.Queue()
+        _queue_handler.queue = log_queue
+        _listener = QueueListener(log_queue, *_listener.handlers,
+                                  respect_handler_level=True)
+        _listener.start()
+
+
+def add_agent_log_file(agent_name, fname=None):
+    """Write the records of an agent to a file of its own.
+
+    Parameters
+    ----------
+    agent_name : str
+        The name of the agent.
+    fname : Optional[str]
+        The path of the log file. Default: <agent_name>.log
+
+    Returns
+    -------
+    str
+        The path of the log file.
+    """
+    fname = fname if fname else '%s.log' % agent_name
+    listener = start_queue_logging()
+    with _lock:
+        if fname not in _agent_handlers:
+            handler = logging.FileHandler(fname)
+            handler.setLevel(logging.DEBUG)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            handler.addFilter(AgentFilter(agent_name))
+            _agent_handlers[fname] = handler
+            listener.handlers = listener.handlers + (handler,)
+    return fname
@@ -0,0 +1,243 @@
+"""Account for the memory used by a bioagent and what it is used by.
+
+The built-in MEMORY-REPORT task reports the resident memory of an agent's
+process, and the number of items in and approximate size of each of its
+subsystems: the data the agent keeps (e.g. the MRA's models), its caches
+and the shared resources loaded in the process. Sizes are estimated by
+following references from each subsystem, up to a limit on the number of
+objects visited, so objects shared between subsystems are counted in each.
+
+To find where memory is allocated, MEMORY-REPORT can also start tracemalloc
+and report the lines that allocated the most memory since the previous
+snapshot.
+
+Agents keeping data of their own should extend Bioagent's
+`get_memory_subsystems` to report it.
+"""
+import os
+import sys
+import logging
+import threading
+import tracemalloc
+from collections import deque
+
+
+logger = logging.getLogger('Bioagents')
+
+
+def get_memory_usage(pid):
+    """Return the memory usage of a process in kB.
+
+    Parameters
+    ----------
+    pid : int
+        The ID of the process.
+
+    Returns
+    -------
+    dict
+        The resident memory (rss), the part of it unique to the process
+        (unique), the part shared with other processes (shared) and the
+        proportional set size (pss), where shared pages are divided between
+        the processes sharing them.
+    """
+    fields = {}
+    fname = '/proc/%d/smaps_rollup' % pid
+    if not os.path.exists(fname):
+        fname = '/proc/%d/smaps' % pid
+    with open(fname, 'r') as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                key = parts[0].rstrip(':')
+                fields[key] = fields.get(key, 0) + int(parts[1])
+    return {'rss': fields.get('Rss', 0),
+            'pss': fields.get('Pss', 0),
+            'shared': fields.get('Shared_Clean', 0) +
+            fields.get('Shared_Dirty', 0),
+            'unique': fields.get('Private_Clean', 0) +
+            fields.get('Private_Dirty', 0)}
+
+
+def get_rss():
+    """Return the resident memory of this process in kB.
+
+    Where /proc isn't available, the peak resident memory is returned.
+    """
+    try:
+        return get_memory_usage(os.getpid())['rss']
+    except (IOError, OSError):
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # On macOS, the peak resident memory is in bytes
+        return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def get_deep_size(obj, max_objects=200000):
+    """Return an estimate of the memory used by an object in bytes.
+
+    The sizes of the object and of the objects reachable from it through
+    containers and instance attributes are added up. Classes, modules and
+    functions are not followed.
+
+    Parameters
+    ----------
+    obj : object
+        The object to measure.
+    max_objects : Optional[int]
+        The maximum number of objects visited. Default: 200000
+
+    Returns
+    -------
+    tuple(int, bool)
+        The size and whether it is complete, i.e. the limit wasn't reached.
+    """
+    seen = set()
+    queue = deque([obj])
+    size = 0
+    while queue:
+        if len(seen) >= max_objects:
+            return size, False
+        item = queue.popleft()
+        if id(item) in seen or isinstance(item, _NOT_FOLLOWED):
+            continue
+        seen.add(id(item))
+        try:
+            size += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if isinstance(item, dict):
+            queue.extend(item.keys())
+            queue.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            queue.extend(item)
+        if hasattr(item, '__dict__'):
+            queue.append(item.__dict__)
+        slots = getattr(type(item), '__slots__', ())
+        for slot in ([slots] if isinstance(slots, str) else slots):
+            if hasattr(item, slot):
+                queue.append(getattr(item, slot))
+    return size, True
+
+
+# Objects of these types are shared by everything and aren't counted
+_NOT_FOLLOWED = (type, type(sys), type(get_deep_size), type(len),
+                 threading.Thread)
+
+
+# The resources shared by the agents in a process, given by the module and
+# the function of the lazy_resource that loads them
+SHARED_RESOURCES = {
+    'trips_ontology': ('bioagents.resources.trips_ont_manager',
+                       'get_trips_ontology'),
+    'cbio_efo_map': ('bioagents.dtda.dtda', 'get_cbio_efo_map'),
+    'dtda_statements': ('bioagents.dtda.dtda', 'get_sub_statements'),
+    'ccle_map': ('bioagents.mra.mra', 'get_ccle_map'),
+    'expression_cache': ('bioagents.mra.sbgn_colorizer',
+                         'get_expression_cache'),
+    'mutation_cache': ('bioagents.mra.sbgn_colorizer', 'get_mutation_cache'),
+    'model_registry': ('bioagents.model_registry', 'get_model_registry'),
+}
+
+
+def get_loaded_resources():
+    """Return the shared resources that are loaded in this process.
+
+    Resources that haven't been loaded aren't loaded by this function.
+    """
+    resources = {}
+    for name, (module_name, func_name) in SHARED_RESOURCES.items():
+        module = sys.modules.get(module_name)
+        loader = getattr(module, func_name, None)
+        if loader is not None and loader.is_loaded():
+            resources[name] = loader()
+    ekb = sys.modules.get('bioagents.ekb')
+    if ekb is not None:
+        resources['ekb_cache'] = ekb._ekb_cache
+    http_cache = sys.modules.get('bioagents.http_cache')
+    if http_cache is not None and http_cache.get_http_cache() is not None:
+        resources['http_cache'] = http_cache.get_http_cache()._entries
+    hierarchy_manager = \
+        sys.modules.get('indra.preassembler.hierarchy_manager')
+    if hierarchy_manager is not None:
+        resources['hierarchies'] = hierarchy_manager.hierarchies
+    return resources
+
+
+def get_subsystem_report(subsystems, max_objects=200000):
+    """Return the number of items in and size of each subsystem.
+
+    Parameters
+    ----------
+    subsystems : dict
+        Objects keyed by the name of the subsystem they belong to.
+
+    Returns
+    -------
+    dict
+        For each subsystem, a dict with its number of items (count, if it
+        has a length), its estimated size in bytes (size) and whether the
+        estimate is complete (complete).
+    """
+    report = {}
+    for name, obj in subsystems.items():
+        size, complete = get_deep_size(obj, max_objects)
+        try:
+            count = len(obj)
+        except TypeError:
+            count = None
+        report[name] = {'count': count, 'size': size, 'complete': complete}
+    return report
+
+
+class AllocationTracker(object):
+    """Compare snapshots of memory allocations taken with tracemalloc."""
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, num_frames=1):
+        """Start tracing allocations and take a first snapshot."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(num_frames)
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        with self._lock:
+            self._snapshot = None
+            tracemalloc.stop()
+
+    def get_top_differences(self, num_lines=10):
+        """Return the lines that allocated the most since the last snapshot.
+
+        A new snapshot is taken, which the next call is compared to.
+
+        Returns
+        -------
+        list[dict]
+            The location (file:line), the change in size in bytes and the
+            change in number of blocks of each line, in decreasing order of
+            change in size. If tracing hasn't been started, the list is
+            empty.
+        """
+        with self._lock:
+            if self._snapshot is None or not tracemalloc.is_tracing():
+                return []
+            snapshot = tracemalloc.take_snapshot()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = snapshot.filter_traces(filters).compare_to(
+                self._snapshot.filter_traces(filters), 'lineno')
+            self._snapshot = snapshot
+        differences = []
+        for stat in stats[:num_lines]:
+            frame = stat.traceback[0]
+            differences.append({'location': '%s:%d' % (frame.filename,
+                                                       frame.lineno),
+                                'size_diff': stat.size_diff,
+                                'count_diff': stat.count_diff})
+        return differences
@@ -0,0 +1,190 @@
+"""A content-addressed store of models shared by the MRA and the TRA.
+
+Models are identified by the hash of their set of statements, which only
+depends on the content of the statements and not on their order or their
+evidence. For each model, the registry keeps the statements, their INDRA JSON
+and the models assembled from them, so that a model sent or referenced more
+than once is only serialized and assembled once.
+
+The MRA registers the models it builds and adds their hash to its replies as
+:model-hash, which the TRA accepts in place of the INDRA JSON of a model. If
+the BIOAGENTS_MODEL_DIR environment variable is set, the JSON of registered
+models is also written to that directory, so that agents running in separate
+processes on the same host can look up models registered by the others.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from copy import deepcopy
+from indra.statements import stmts_to_json, stmts_from_json
+from bioagents.cache import LRUCache
+from bioagents.lazy import lazy_resource
+
+
+logger = logging.getLogger('Bioagents')
+
+
+# Parts of the JSON of a statement that don't affect the models built from it
+_NON_CONTENT_KEYS = ('evidence', 'id', 'supports', 'supported_by', 'belief',
+                     'matches_hash')
+
+
+def get_model_hash(stmts, stmts_json=None):
+    """Return the hash of a set of statements.
+
+    Parameters
+    ----------
+    stmts : list[indra.statements.Statement]
+        The statements of a model.
+    stmts_json : Optional[list[dict]]
+        The INDRA JSON of the statements, if already at hand.
+
+    Returns
+    -------
+    str
+        A hash that is the same for any list containing statements with the
+        same content, regardless of their order and evidence.
+    """
+    if stmts_json is None:
+        stmts_json = stmts_to_json(stmts)
+    keys = set()
+    for stmt_json in stmts_json:
+        content = {k: v for k, v in stmt_json.items()
+                   if k not in _NON_CONTENT_KEYS}
+        keys.add(json.dumps(content, sort_keys=True))
+    return hashlib.sha1('\n'.join(sorted(keys)).encode('utf-8')).hexdigest()
+
+
+class _RegisteredModel(object):
+    def __init__(self, stmts, json_str=None):
+        self.stmts = stmts
+        self.json_str = json_str
+        self.assembled = {}
+        self.lock = threading.Lock()
+
+
+class ModelRegistry(object):
+    """Statements, JSON and assembled models, keyed by model hash.
+
+    Parameters
+    ----------
+    max_size : Optional[int]
+        The number of models kept in memory. Default: 32
+    store_dir : Optional[str]
+        A directory in which the JSON of registered models is stored and
+        looked up. If None, models are only kept in memory. Default: None
+    """
+    def __init__(self, max_size=32, store_dir=None):
+        self.store_dir = store_dir
+        self._models = LRUCache(max_size=max_size)
+        if store_dir and not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+
+    def register(self, stmts, stmts_json=None, json_str=None):
+        """Register the statements of a model and return its hash.
+
+        Parameters
+        ----------
+        stmts : list[indra.statements.Statement]
+            The statements of the model. The list is copied, so it can
+            still be changed, but the statements themselves shouldn't be
+            changed after being registered.
+        stmts_json : Optional[list[dict]]
+            The INDRA JSON of the statements, if already at hand.
+        json_str : Optional[str]
+            The INDRA JSON of the statements as a string, if at hand.
+        """
+        model_hash = get_model_hash(stmts, stmts_json)
+        if self._models.get(model_hash) is None:
+            self._models.put(model_hash,
+                             _RegisteredModel(list(stmts), json_str))
+            if self.store_dir:
+                self._store(model_hash)
+        return model_hash
+
+    def _get_model(self, model_hash):
+        model = self._models.get(model_hash)
+        if model is None and self.store_dir:
+            fname = os.path.join(self.store_dir, '%s.json' % model_hash)
+            if os.path.exists(fname):
+                with open(fname, 'r') as fh:
+                    json_str = fh.read()
+                model = _RegisteredModel(stmts_from_json(json.loads(json_str)),
+                                         json_str)
+                self._models.put(model_hash, model)
+        return model
+
+    def _store(self, model_hash):
+        fname = os.path.join(self.store_dir, '%s.json' % model_hash)
+        if os.path.exists(fname):
+            return
+        # Write to a temporary file first so that readers never see a
+        # partially written model
+        tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+        try:
+            with open(tmp_fname, 'w') as fh:
+                fh.write(self.get_json(model_hash))
+            os.rename(tmp_fname, fname)
+        except (IOError, OSError) as e:
+            logger.warning('Could not store model %s: %s' % (model_hash, e))
+
+    def has_model(self, model_hash):
+        return self._get_model(model_hash) is not None
+
+    def get_statements(self, model_hash):
+        """Return the statements of a model, or None if it is unknown.
+
+        The statements are shared with other users of the registry, so they
+        shouldn't be changed.
+        """
+        model = self._get_model(model_hash)
+        return model.stmts if model is not None else None
+
+    def get_json(self, model_hash):
+        """Return the INDRA JSON of a model, or None if it is unknown."""
+        model = self._get_model(model_hash)
+        if model is None:
+            return None
+        with model.lock:
+            if model.json_str is None:
+                model.json_str = json.dumps(stmts_to_json(model.stmts))
+            return model.json_str
+
+    def get_assembled(self, model_hash, assembler_name, assemble):
+        """Return a copy of a model assembled from the statements of a model.
+
+        Parameters
+        ----------
+        model_hash : str
+            The hash of the model.
+        assembler_name : str
+            A name for the way the model is assembled, since different
+            agents assemble the same statements differently.
+        assemble : callable
+            A function taking the statements and returning the assembled
+            model, called if the model hasn't been assembled this way yet.
+
+        Returns
+        -------
+        object
+            A deep copy of the assembled model, which the caller may change,
+            or None if the model is unknown.
+        """
+        model = self._get_model(model_hash)
+        if model is None:
+            return None
+        with model.lock:
+            assembled = model.assembled.get(assembler_name)
+        if assembled is None:
+            assembled = assemble(model.stmts)
+            with model.lock:
+                model.assembled[assembler_name] = assembled
+        return deepcopy(assembled)
+
+
+@lazy_resource
+def get_model_registry():
+    """Return the model registry shared by the agents in this process."""
+    return ModelRegistry(store_dir=os.environ.get('BIOAGENTS_MODEL_DIR'))
@@ -9,11 +9,40 @@ from indra.sources.indra_db_rest import get_statements
 from indra.explanation.model_checker import ModelChecker, stmts_for_path, \
                                             _stmt_from_rule
 from indra.assemblers.pysb.assembler import grounded_monomer_patterns
+from bioagents.deadline import deadline_reached
+from bioagents.logs import LargePayload
 
 
 logger = logging.getLogger('model_diagnoser')
 
 
+def diagnose_model(statements, model=None, explain=None):
+    """Return what a ModelDiagnoser finds about a model, in one dict.
+
+    This builds a single ModelDiagnoser, so that it can be run in a worker
+    process with run_in_pool. If explain is given, the result has the keys
+    of ModelDiagnoser.check_explanation and, if a connection is proposed,
+    the suggested statements as stmt_suggestions. Any missing activities
+    are given as stmt_corrections.
+    """
+    md = ModelDiagnoser(statements, model, explain)
+    result = {}
+    if explain is not None:
+        result.update(md.check_explanation())
+        # If we got a proposal for a statement, get a specific
+        # recommendation
+        connect_stmts = result.get('connect_stmts')
+        if connect_stmts:
+            u_stmt, v_stmt = connect_stmts
+            stmt_suggestions = md.suggest_statements(u_stmt, v_stmt)
+            if stmt_suggestions:
+                result['stmt_suggestions'] = stmt_suggestions
+    acts = md.get_missing_activities()
+    if acts:
+        result['stmt_corrections'] = acts
+    return result
+
+
 class ModelDiagnoser(object):
     def __init__(self, statements, model=None, explain=None):
         self.statements = statements
@@ -91,6 +120,10 @@ class ModelDiagnoser(object):
                 # the path between source and target:
                 best_edge = (None, 0)
                 for u, v in itertools.permutations(im.nodes(), 2):
+                    # If the request is out of time, we go on with the best
+                    # edge found so far
+                    if deadline_reached():
+                        break
                     # Add the edge to the graph
                     im.add_edge(u, v)
                     # Find longest path between source and target
@@ -109,7 +142,8 @@ class ModelDiagnoser(object):
                                              self.statements)
                     if u_stmt and v_stmt:
                         result['connect_stmts'] = (u_stmt, v_stmt)
-                        logger.info("Model statements: %s" % str(self.statements))
+                        logger.info("Model statements: %s",
+                                    LargePayload(self.statements))
                         logger.info("To explain %s, try connecting %s and %s" %
                                 (self.explain, u_stmt, v_stmt))
         return result
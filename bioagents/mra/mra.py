@@ -7,23 +7,32 @@ import os
 import copy
 import json
 import logging
-import networkx
 import subprocess
-import kappy
 from indra.sources import trips
 from indra.statements import Complex, Activation, IncreaseAmount, \
                             AddModification, stmts_from_json
 from indra.databases import uniprot_client
-from indra.preassembler.hierarchy_manager import hierarchies
 from indra.assemblers.pysb import assembler as pysb_assembler
 from indra.assemblers.pysb import PysbAssembler
 from pysb.bng import BngInterfaceError
-from pysb.tools import render_reactions
 from pysb.export import export
 from indra.util.kappa_util import im_json_to_graph, cm_json_to_graph
-from bioagents.mra.sbgn_colorizer import SbgnColorizer
 import pickle
-from bioagents.mra.model_diagnoser import ModelDiagnoser
+from bioagents.lazy import lazy_import, lazy_resource, \
+    lazy_module_attributes
+from bioagents.deadline import DeadlineExceeded
+from bioagents.process_pool import run_in_pool
+from bioagents.logs import LargePayload
+from bioagents.model_registry import get_model_registry
+
+# These are only needed for some requests and are slow to import, so they are
+# imported when first used.
+networkx = lazy_import('networkx')
+kappy = lazy_import('kappy')
+render_reactions = lazy_import('pysb.tools.render_reactions')
+hierarchy_manager = lazy_import('indra.preassembler.hierarchy_manager')
+sbgn_colorizer = lazy_import('bioagents.mra.sbgn_colorizer')
+model_diagnoser = lazy_import('bioagents.mra.model_diagnoser')
 
 logger = logging.getLogger('MRA')
 
@@ -48,11 +57,15 @@ class MRA(object):
         return False
 
     def assemble_pysb(self, stmts):
-        pa = PysbAssembler(policies=self.default_policy)
-        pa.add_statements(stmts)
-        pa.make_model()
-        pa.add_default_initial_conditions(self.default_initial_amount)
-        return pa.model
+        # Models with the same statements, e.g. after an undo, are only
+        # assembled once
+        registry = get_model_registry()
+        return registry.get_assembled(registry.register(stmts), 'mra',
+                                      self._assemble_pysb)
+
+    def _assemble_pysb(self, stmts):
+        return run_in_pool(assemble_pysb_model, stmts, self.default_policy,
+                           self.default_initial_amount)
 
     def build_model_from_ekb(self, model_ekb):
         """Build a model using DRUM extraction knowledge base."""
@@ -110,24 +123,10 @@ class MRA(object):
                                         self.models[new_model_id],
                                         self.context)
         # Use a model diagnoser to identify explanations given the executable
-        # model, the current statements, and the explanation goal
-        if self.explain:
-            md = ModelDiagnoser(model_stmts, model=model_exec,
-                                explain=self.explain)
-            md_result = md.check_explanation()
-            res.update(md_result)
-            # If we got a proposal for a statement, get a specific
-            # recommendation
-            connect_stmts = res.get('connect_stmts')
-            if connect_stmts:
-                u_stmt, v_stmt = connect_stmts
-                stmt_suggestions = md.suggest_statements(u_stmt, v_stmt)
-                if stmt_suggestions:
-                    res['stmt_suggestions'] = stmt_suggestions
-        md = ModelDiagnoser(model_stmts)
-        acts = md.get_missing_activities()
-        if acts:
-            res['stmt_corrections'] = acts
+        # model, the current statements, and the explanation goal, and to
+        # find missing activities
+        res.update(run_in_pool(model_diagnoser.diagnose_model, model_stmts,
+                               model_exec, self.explain))
         return res
 
     def expand_model_from_json(self, model_json, model_id):
@@ -159,7 +158,8 @@ class MRA(object):
         res['query'] = query_st
         model_stmts = self.models[model_id]
         for model_st in model_stmts:
-            if model_st.refinement_of(query_st, hierarchies):
+            if model_st.refinement_of(query_st,
+                                      hierarchy_manager.hierarchies):
                 res['has_mechanism'] = True
                 return res
         res['has_mechanism'] = False
@@ -169,14 +169,15 @@ class MRA(object):
         """Return a new model with the given mechanism having been removed."""
         tp = trips.process_xml(mech_ekb)
         rem_stmts = tp.statements
-        logger.info('Removing statements: %s' % rem_stmts)
+        logger.info('Removing statements: %s', LargePayload(rem_stmts))
         new_stmts = []
         removed_stmts = []
         model_stmts = self.models[model_id]
         for model_st in model_stmts:
             found = False
             for rem_st in rem_stmts:
-                if model_st.refinement_of(rem_st, hierarchies):
+                if model_st.refinement_of(rem_st,
+                                          hierarchy_manager.hierarchies):
                     found = True
                     break
             if not found:
@@ -252,6 +253,8 @@ class MRA(object):
             return None
         try:
             self.context = get_context(explain)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error('MRA could not set context from USER-GOAL')
             logger.error(e)
@@ -326,13 +329,13 @@ def make_diagrams(pysb_model, model_id, current_model, context=None):
     if sbgn is not None:
         if context:
             try:
-                cell_line = ccle_map[context]
+                cell_line = get_ccle_map()[context]
             except KeyError:
                 cell_line = 'A375_SKIN'
         else:
             cell_line = 'A375_SKIN'
         try:
-            colorizer = SbgnColorizer(sbgn)
+            colorizer = sbgn_colorizer.SbgnColorizer(sbgn)
             colorizer.set_style_expression_mutation(current_model,
                                                     cell_line=cell_line)
             sbgn = colorizer.generate_xml()
@@ -451,6 +454,15 @@ def stmt_exists(stmts, stmt):
             return True
     return False
 
+def assemble_pysb_model(stmts, policy, initial_amount):
+    """Return a PySB model assembled from statements."""
+    pa = PysbAssembler(policies=policy)
+    pa.add_statements(stmts)
+    pa.make_model()
+    pa.add_default_initial_conditions(initial_amount)
+    return pa.model
+
+
 def make_ccle_map():
     fname = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                          '../resources/ccle_lines.txt')
@@ -460,4 +472,7 @@ def make_ccle_map():
     ccle_map = {c.split('_')[0]: c for c in clines}
     return ccle_map
 
-ccle_map = make_ccle_map()
+
+get_ccle_map = lazy_resource(make_ccle_map)
+# The map used to be loaded on import as ccle_map
+lazy_module_attributes(__name__, ccle_map=get_ccle_map)
@@ -7,8 +7,6 @@ import pysb.export
 
 from indra.databases import hgnc_client
 from indra.assemblers.english import EnglishAssembler
-from indra.sources.trips.processor import TripsProcessor
-from indra.preassembler.hierarchy_manager import hierarchies
 from indra.statements import stmts_to_json, Complex, SelfModification,\
     ActiveForm
 from indra import has_config
@@ -20,8 +18,16 @@ logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
 logger = logging.getLogger('MRA')
 
 from bioagents import Bioagent, BioagentException
+from bioagents.deadline import DeadlineExceeded
+from bioagents.lazy import lazy_import
+from bioagents.ekb import resolve_ekb
+from bioagents.logs import LargePayload
+from bioagents.model_registry import get_model_registry
+from bioagents.warmup import ekb_kstring
 from .mra import MRA
 
+hierarchy_manager = lazy_import('indra.preassembler.hierarchy_manager')
+
 
 if has_config('INDRA_DB_REST_URL') and has_config('INDRA_DB_REST_API_KEY'):
     from indra.sources.indra_db_rest import get_statements
@@ -64,6 +70,21 @@ class MRA_Module(Bioagent):
         self.reply_with_content(msg, reply_content)
         return
 
+    def get_memory_subsystems(self):
+        subsystems = super(MRA_Module, self).get_memory_subsystems()
+        subsystems['mra_models'] = self.mra.models
+        subsystems['mra_transformations'] = self.mra.transformations
+        return subsystems
+
+    def get_warmup_requests(self):
+        content = KQMLList('BUILD-MODEL')
+        content.set('description', ekb_kstring('MEK1 phosphorylates ERK2'))
+        return [content]
+
+    def end_warmup(self):
+        super(MRA_Module, self).end_warmup()
+        self.mra = MRA()
+
     def respond_build_model(self, content):
         """Return response content to build-model request."""
         descr = content.gets('description')
@@ -89,8 +110,7 @@ class MRA_Module(Bioagent):
         model = res.get('model')
         if model and (descr_format == 'ekb' or not descr_format):
             self.send_background_support(model)
-        model_msg = encode_indra_stmts(model)
-        msg.sets('model', model_msg)
+        self._set_model(msg, model)
         # Add the diagrams
         diagrams = res.get('diagrams')
         if not no_display:
@@ -121,6 +141,8 @@ class MRA_Module(Bioagent):
             else:
                 err_msg = 'Invalid description format: %s' % descr_format
                 raise InvalidModelDescriptionError(err_msg)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise InvalidModelDescriptionError(e)
         new_model_id = res.get('model_id')
@@ -132,8 +154,7 @@ class MRA_Module(Bioagent):
         msg.set('model-id', str(new_model_id))
         # Add the INDRA model json
         model = res.get('model')
-        model_msg = encode_indra_stmts(model)
-        msg.sets('model', model_msg)
+        self._set_model(msg, model)
         # Add the INDRA model new json
         model_new = res.get('model_new')
 
@@ -219,8 +240,7 @@ class MRA_Module(Bioagent):
         if not model:
             self.send_clean_model()
 
-        model_msg = encode_indra_stmts(model)
-        msg.sets('model', model_msg)
+        self._set_model(msg, model)
         # Get the action and add it to the message
         action = res.get('action')
         actionl = KQMLList()
@@ -248,6 +268,8 @@ class MRA_Module(Bioagent):
         model_id = self._get_model_id(content)
         try:
             res = self.mra.has_mechanism(ekb, model_id)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise InvalidModelDescriptionError(e)
         # Start a SUCCESS message
@@ -270,6 +292,8 @@ class MRA_Module(Bioagent):
         no_display = content.get('no-display')
         try:
             res = self.mra.remove_mechanism(ekb, model_id)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise InvalidModelDescriptionError(e)
         model_id = res.get('model_id')
@@ -281,8 +305,7 @@ class MRA_Module(Bioagent):
         msg.set('model-id', str(model_id))
         # Add the INDRA model json
         model = res.get('model')
-        model_msg = encode_indra_stmts(model)
-        msg.sets('model', model_msg)
+        self._set_model(msg, model)
 
         # Handle empty model
         if not model:
@@ -300,7 +323,7 @@ class MRA_Module(Bioagent):
 
         # Add the diagram
         diagrams = res.get('diagrams')
-        logger.info(diagrams)
+        logger.info('Diagrams: %s', LargePayload(diagrams))
         if not no_display:
             if diagrams:
                 rxn_diagram = diagrams.get('reactionnetwork')
@@ -338,9 +361,8 @@ class MRA_Module(Bioagent):
             model_id = None
         model = self.mra.get_model_by_id(model_id)
         if model is not None:
-            model_msg = encode_indra_stmts(model)
             reply = KQMLList('SUCCESS')
-            reply.sets('model', model_msg)
+            self._set_model(reply, model)
         else:
             reply = self.make_failure('MISSING_MODEL')
         return reply
@@ -392,6 +414,12 @@ class MRA_Module(Bioagent):
             else:
                 self.send_null_provenance(stmt, for_what)
 
+    def _set_model(self, msg, stmts):
+        """Add the INDRA JSON of a model and its hash to a message."""
+        model_msg, model_hash = encode_model(stmts)
+        msg.sets('model', model_msg)
+        msg.set('model-hash', model_hash)
+
     def _get_model_id(self, content):
         model_id_arg = content.get('model-id')
         if model_id_arg is None:
@@ -439,12 +467,9 @@ def ekb_from_agent(agent):
 
 
 def get_target(target_str):
-    tp = TripsProcessor(target_str)
-    terms = tp.tree.findall('TERM')
-    assert len(terms) > 0, "No terms found."
-    term_id = terms[0].attrib['id']
-    agent = tp._get_agent_by_id(term_id, None)
-    return agent
+    ekb = resolve_ekb(target_str)
+    assert len(ekb.term_ids) > 0, "No terms found."
+    return ekb.get_agent()
 
 
 def encode_pysb_model(pysb_model):
@@ -453,6 +478,14 @@ def encode_pysb_model(pysb_model):
     return model_str
 
 
+def encode_model(stmts):
+    """Return the INDRA JSON of a model and register it by its hash."""
+    stmts_json = stmts_to_json(stmts)
+    json_str = json.dumps(stmts_json)
+    model_hash = get_model_registry().register(stmts, stmts_json, json_str)
+    return json_str, model_hash
+
+
 def encode_indra_stmts(stmts):
     stmts_json = stmts_to_json(stmts)
     json_str = json.dumps(stmts_json)
@@ -486,7 +519,7 @@ def get_ambiguities_msg(ambiguities):
 
 
 def _get_agent_comp(agent):
-    eh = hierarchies['entity']
+    eh = hierarchy_manager.hierarchies['entity']
     a_ns, a_id = agent.get_grounding()
     if (a_ns is None) or (a_id is None):
         return None
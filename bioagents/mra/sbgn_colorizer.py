@@ -13,10 +13,29 @@ from indra.sources.indra_db_rest import get_statements
 from indra.tools.expand_families import Expander
 from indra.preassembler.hierarchy_manager import hierarchies
 from indra.databases import context_client
+from bioagents.lazy import lazy_resource
 
 
 logger = logging.getLogger('sbgn_colorizer')
 
+_resource_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'resources')
+
+
+@lazy_resource
+def get_expression_cache():
+    """Return the cached expression levels of genes in cell lines."""
+    with open(os.path.join(_resource_dir, 'expression_cache.json'), 'r') as fh:
+        return json.load(fh)
+
+
+@lazy_resource
+def get_mutation_cache():
+    """Return the cached mutations of genes in cell lines."""
+    with open(os.path.join(_resource_dir, 'mutation_cache.json'), 'r') as fh:
+        return json.load(fh)
+
+
 # How a node should be colorized
 Style = collections.namedtuple('Style', ['border_color', 'fill_color'])
 
@@ -97,14 +116,9 @@ class SbgnColorizer(object):
             if 'id' in element.attrib:
                 self.element_ids.add(element.attrib['id'])
 
-        # Load caches
-        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                            '../resources/expression_cache.json'), 'r') as fh:
-
-            self.expr = json.load(fh)
-        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                            '../resources/mutation_cache.json'), 'r') as fh:
-            self.mut = json.load(fh)
+        # The caches are shared by all colorizers
+        self.expr = get_expression_cache()
+        self.mut = get_mutation_cache()
 
 
     def get_nodes(self):
@@ -12,9 +12,6 @@ logger = logging.getLogger('MSA')
 from kqml import KQMLPerformative, KQMLList
 
 from indra import has_config
-from indra.sources.trips.processor import TripsProcessor
-from indra.assemblers.sbgn import SBGNAssembler
-from indra.tools import assemble_corpus as ac
 
 if has_config('INDRA_DB_REST_URL') and has_config('INDRA_DB_REST_API_KEY'):
     from indra.sources.indra_db_rest import get_statements, IndraDBRestError, \
@@ -26,6 +23,13 @@ else:
     CAN_CHECK_STATEMENTS = False
 
 from bioagents import Bioagent
+from bioagents.lazy import lazy_import, lazy_property
+from bioagents.ekb import resolve_ekb
+from bioagents.process_pool import run_in_pool
+from bioagents.logs import LargePayload
+
+sbgn = lazy_import('indra.assemblers.sbgn')
+ac = lazy_import('indra.tools.assemble_corpus')
 
 
 def _read_signor_afs():
@@ -53,7 +57,13 @@ class MSA_Module(Bioagent):
     name = 'MSA'
     tasks = ['PHOSPHORYLATION-ACTIVATING', 'FIND-RELATIONS-FROM-LITERATURE',
              'GET-PAPER-MODEL', 'CONFIRM-RELATION-FROM-LITERATURE']
-    signor_afs = _read_signor_afs()
+    # Results change as the literature does, so they are only shared
+    # between duplicate requests rather than cached
+    coalesced_tasks = tasks
+
+    @lazy_property
+    def signor_afs(self):
+        return _read_signor_afs()
 
     def respond_phosphorylation_activating(self, content):
         """Return response content to phosphorylation_activating request."""
@@ -231,9 +241,7 @@ class MSA_Module(Bioagent):
             resp = KQMLPerformative('SUCCESS')
             resp.set('relations-found', 0)
             return resp
-        stmts = ac.map_grounding(stmts)
-        stmts = ac.map_sequence(stmts)
-        unique_stmts = ac.run_preassembly(stmts, return_toplevel=True)
+        stmts, unique_stmts = run_in_pool(_preassemble, stmts)
         diagrams = _make_diagrams(stmts)
         self.send_display_model(diagrams)
         resp = KQMLPerformative('SUCCESS')
@@ -290,14 +298,10 @@ class MSA_Module(Bioagent):
 
     @staticmethod
     def _get_agent(agent_ekb):
-        tp = TripsProcessor(agent_ekb)
-        terms = tp.tree.findall('TERM')
-        if len(terms):
-            term_id = terms[0].attrib['id']
-            agent = tp._get_agent_by_id(term_id, None)
-        else:
-            agent = None
-        return agent
+        ekb = resolve_ekb(agent_ekb)
+        if not ekb.term_ids:
+            return None
+        return ekb.get_agent()
 
     def _matching(self, stmt, residue, position, action, polarity):
         if stmt.is_active is not (polarity == 'activating'):
@@ -310,12 +314,20 @@ class MSA_Module(Bioagent):
         return matching_residues
 
 
+def _preassemble(stmts):
+    """Return the mapped statements and the unique ones among them."""
+    stmts = ac.map_grounding(stmts)
+    stmts = ac.map_sequence(stmts)
+    unique_stmts = ac.run_preassembly(stmts, return_toplevel=True)
+    return stmts, unique_stmts
+
+
 def _make_sbgn(stmts):
-    sa = SBGNAssembler()
+    sa = sbgn.SBGNAssembler()
     sa.add_statements(stmts)
     sa.make_model()
     sbgn_str = sa.print_model()
-    logger.info(sbgn_str)
+    logger.info('SBGN: %s', LargePayload(sbgn_str))
     return sbgn_str
 
 
@@ -0,0 +1,300 @@
+"""A pool of worker processes for CPU-bound work on INDRA Statements.
+
+Assembling models, preassembling statements and searching for paths in
+models is pure Python work that holds the GIL, so requests doing it can't
+run in parallel on threads. Such work can instead be sent to a pool of
+worker processes which have INDRA already imported. The statements a job
+works on are sent to the worker as JSON, while its other arguments and its
+result are pickled.
+
+Other work, e.g. the simulations of an ensemble, can be spread over the
+pool with `map_in_pool`, whose arguments and results are pickled.
+
+The pool is shared by all the agents in a process. Until it is started with
+`start_process_pool`, `run_in_pool` and `map_in_pool` simply call the
+function in the current process, so code can use them whether or not a pool
+is running.
+"""
+import sys
+import logging
+import importlib
+import itertools
+import threading
+import multiprocessing
+from bioagents.deadline import Deadline, deadline_scope, current_deadline, \
+    check_deadline, deadline_reached
+
+
+logger = logging.getLogger('Bioagents')
+
+
+# The modules the workers import when they start
+PRELOAD_MODULES = ['indra.statements', 'indra.assemblers.pysb',
+                   'indra.tools.assemble_corpus',
+                   'indra.preassembler.hierarchy_manager',
+                   'indra.explanation.model_checker']
+
+
+# The number of batches of calls whose cancellation the workers can tell
+# apart, i.e. how many calls to map_in_pool can be running at once
+_NUM_BATCH_SLOTS = 1024
+# The flags shared by the workers with the ids of the cancelled batches,
+# set in each worker when it starts
+_cancelled_batches = None
+
+
+def _init_worker(modules, cancelled_batches):
+    global _cancelled_batches
+    _cancelled_batches = cancelled_batches
+    _preload(modules)
+
+
+def _preload(modules):
+    for module_name in modules:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            logger.warning('Could not preload %s: %s' % (module_name, e))
+
+
+def _get_function_path(func):
+    return '%s.%s' % (func.__module__, func.__name__)
+
+
+class _BatchDeadline(Deadline):
+    """A deadline in a worker that is also cancelled with its batch."""
+    def __init__(self, expires_at, batch_id):
+        super(_BatchDeadline, self).__init__()
+        self.expires_at = expires_at
+        self.batch_id = batch_id
+
+    def expired(self):
+        if _cancelled_batches[self.batch_id % _NUM_BATCH_SLOTS] == \
+                self.batch_id:
+            self.cancelled = True
+        return super(_BatchDeadline, self).expired()
+
+
+def _run_call(func_path, args, kwargs, expires_at, batch_id=None):
+    """Call a function in a worker process and return its result."""
+    module_name, func_name = func_path.rsplit('.', 1)
+    func = getattr(importlib.import_module(module_name), func_name)
+    deadline = Deadline.at(expires_at) if batch_id is None else \
+        _BatchDeadline(expires_at, batch_id)
+    with deadline_scope(deadline):
+        # Calls of a batch that was cancelled before they started are
+        # skipped
+        check_deadline()
+        result = func(*args, **kwargs)
+    return result, deadline.truncated
+
+
+def _run_job(func_path, stmts_json, args, kwargs, expires_at):
+    """Run a job in a worker process and return its result."""
+    from indra.statements import stmts_from_json
+    stmts = stmts_from_json(stmts_json)
+    return _run_call(func_path, (stmts,) + tuple(args), kwargs, expires_at)
+
+
+class ProcessPool(object):
+    """A pool of worker processes running functions on statements.
+
+    Parameters
+    ----------
+    num_workers : Optional[int]
+        The number of worker processes. Default: the number of CPUs.
+    preload : Optional[list[str]]
+        The modules the workers import before they take jobs.
+        Default: PRELOAD_MODULES
+    """
+    def __init__(self, num_workers=None, preload=None):
+        self.num_workers = num_workers if num_workers else \
+            multiprocessing.cpu_count()
+        self.preload = preload if preload is not None else PRELOAD_MODULES
+        # Workers are not forked from the agent's process since it has
+        # threads of its own. Where possible, they are forked from a server
+        # process which has imported the modules to preload.
+        if sys.platform != 'win32':
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(self.preload)
+        else:
+            ctx = multiprocessing.get_context('spawn')
+        self._cancelled_batches = ctx.RawArray('l', _NUM_BATCH_SLOTS)
+        self._batch_ids = itertools.count(1)
+        self._batch_lock = threading.Lock()
+        self._pool = ctx.Pool(self.num_workers, initializer=_init_worker,
+                              initargs=(self.preload,
+                                        self._cancelled_batches))
+        logger.info('Started a pool of %d worker processes.' %
+                    self.num_workers)
+
+    def submit(self, func, stmts, *args, **kwargs):
+        """Start running func(stmts, *args, **kwargs) in a worker.
+
+        The function has to be defined at the top level of a module. The
+        deadline of the current request, if any, applies to the job too.
+
+        Returns
+        -------
+        multiprocessing.pool.AsyncResult
+            The result of the job, whose get method returns the result of
+            the function and whether it was cut short by the deadline.
+        """
+        from indra.statements import stmts_to_json
+        deadline = current_deadline()
+        expires_at = deadline.expires_at if deadline is not None else None
+        return self._pool.apply_async(_run_job, (_get_function_path(func),
+                                                 stmts_to_json(stmts),
+                                                 args, kwargs, expires_at))
+
+    def submit_call(self, func, *args, **kwargs):
+        """Start running func(*args, **kwargs) in a worker.
+
+        Unlike with submit, all the arguments are pickled.
+        """
+        deadline = current_deadline()
+        expires_at = deadline.expires_at if deadline is not None else None
+        return self._pool.apply_async(_run_call, (_get_function_path(func),
+                                                  args, kwargs, expires_at))
+
+    def map(self, func, args_list, partial=False):
+        """Call func(*args) in the workers for each args in a list.
+
+        See map_in_pool. Once this returns or raises, e.g. because a call
+        failed or the current request ran out of time, the calls still
+        queued or running are cancelled: they stop at their next check of
+        the deadline.
+        """
+        with self._batch_lock:
+            batch_id = next(self._batch_ids)
+        deadline = current_deadline()
+        expires_at = deadline.expires_at if deadline is not None else None
+        func_path = _get_function_path(func)
+        async_results = [self._pool.apply_async(_run_call,
+                                                (func_path, args, {},
+                                                 expires_at, batch_id))
+                         for args in args_list]
+        results = []
+        try:
+            for async_result in async_results:
+                while not async_result.ready():
+                    if partial and results and deadline_reached():
+                        return results
+                    check_deadline()
+                    async_result.wait(0.1)
+                results.append(self.wait(async_result))
+            return results
+        finally:
+            if len(results) < len(async_results):
+                self._cancelled_batches[batch_id % _NUM_BATCH_SLOTS] = \
+                    batch_id
+
+    def wait(self, async_result):
+        """Return the result of a job once it is done.
+
+        If the current request runs out of time or is cancelled while
+        waiting for the result, DeadlineExceeded is raised.
+        """
+        while True:
+            try:
+                result, truncated = async_result.get(0.1)
+                break
+            except multiprocessing.TimeoutError:
+                check_deadline()
+        # If the job stopped early, so does the request
+        if truncated:
+            current_deadline().truncated = True
+        return result
+
+    def run(self, func, stmts, *args, **kwargs):
+        """Run func(stmts, *args, **kwargs) in a worker and return the result.
+
+        If the current request runs out of time or is cancelled while
+        waiting for the result, DeadlineExceeded is raised.
+        """
+        return self.wait(self.submit(func, stmts, *args, **kwargs))
+
+    def shutdown(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def start_process_pool(num_workers=None, preload=None):
+    """Start the process pool shared by the agents, if not yet started."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPool(num_workers, preload)
+    return _process_pool
+
+
+def get_process_pool():
+    """Return the shared process pool, or None if it hasn't been started."""
+    return _process_pool
+
+
+def stop_process_pool():
+    """Shut down the shared process pool, if started.
+
+    Work is then done in the current process again until the pool is
+    started anew.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        pool = _process_pool
+        _process_pool = None
+    if pool is not None:
+        pool.shutdown()
+
+
+def run_in_pool(func, stmts, *args, **kwargs):
+    """Run func(stmts, *args, **kwargs) in the shared pool, if started.
+
+    If no process pool has been started, the function is called in this
+    process.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return func(stmts, *args, **kwargs)
+    return pool.run(func, stmts, *args, **kwargs)
+
+
+def map_in_pool(func, args_list, partial=False):
+    """Call func(*args) for each args in a list, in the shared pool if any.
+
+    The calls run in parallel in the pool, or one after the other in this
+    process if no pool has been started. Either way, the results are in the
+    order of the list. If a call fails or the request runs out of time, the
+    calls still queued or running in the pool are cancelled.
+
+    Parameters
+    ----------
+    func : callable
+        A function defined at the top level of a module.
+    args_list : list[tuple]
+        The arguments of each call.
+    partial : Optional[bool]
+        If True and the current request runs out of time, the results of
+        the calls done by then (in order, and at least one) are returned
+        and the request is marked as partial. Otherwise DeadlineExceeded is
+        raised. Default: False
+
+    Returns
+    -------
+    list
+        The results of the calls.
+    """
+    pool = get_process_pool()
+    if pool is not None:
+        return pool.map(func, args_list, partial)
+    results = []
+    for args in args_list:
+        if partial and results and deadline_reached():
+            break
+        check_deadline()
+        results.append(func(*args))
+    return results
@@ -0,0 +1,170 @@
+"""Profile the requests a running bioagent handles, on demand.
+
+A profiling session is started with the built-in PROFILE task and covers a
+given number of requests or the requests arriving within a given number of
+seconds. Each request in the session is profiled with cProfile on the
+thread handling it, so requests handled by worker threads are profiled too,
+and the statistics of all of them are added up. When the session ends, the
+statistics are written to a file that can be read with pstats or a viewer
+such as snakeviz, and the functions taking the most time can be requested
+with PROFILE as well.
+"""
+import time
+import pstats
+import logging
+import cProfile
+import threading
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class RequestProfiler(object):
+    """Profile the requests handled during a profiling session."""
+    def __init__(self):
+        self.active = False
+        # The file the statistics of the last session were written to
+        self.fname = None
+        self.num_profiled = 0
+        self._stats = None
+        self._stats_fname = None
+        self._remaining = None
+        self._until = None
+        self._in_progress = 0
+        self._lock = threading.Lock()
+
+    def start(self, num_requests=None, duration=None, fname=None):
+        """Start a profiling session, ending any running one.
+
+        Parameters
+        ----------
+        num_requests : Optional[int]
+            The number of requests to profile.
+        duration : Optional[float]
+            The number of seconds during which requests are profiled. If
+            neither this nor num_requests is given, 10 requests are
+            profiled.
+        fname : Optional[str]
+            The file the statistics are written to when the session ends.
+        """
+        if num_requests is None and duration is None:
+            num_requests = 10
+        with self._lock:
+            self.active = True
+            self.fname = None
+            self._stats_fname = fname
+            self.num_profiled = 0
+            self._stats = None
+            self._remaining = num_requests
+            self._until = time.time() + duration if duration is not None \
+                else None
+        logger.info('Started profiling %s.' %
+                    ('%d requests' % num_requests if num_requests is not None
+                     else 'requests for %.1f seconds' % duration))
+
+    def stop(self):
+        """End the profiling session and write out its statistics."""
+        with self._lock:
+            self._finish()
+
+    def check_expired(self):
+        """End the session if its duration has passed.
+
+        A session is otherwise only ended by a request after its duration,
+        which may never come.
+        """
+        with self._lock:
+            if self.active and not self._in_progress and \
+                    self._until is not None and time.time() > self._until:
+                self._finish()
+
+    def _finish(self):
+        if not self.active:
+            return
+        self.active = False
+        if self._stats is not None and self._stats_fname:
+            self._stats.dump_stats(self._stats_fname)
+            self.fname = self._stats_fname
+            logger.info('Wrote the profile of %d requests to %s.' %
+                        (self.num_profiled, self.fname))
+
+    def _begin_request(self):
+        with self._lock:
+            if not self.active:
+                return False
+            if self._until is not None and time.time() > self._until:
+                if not self._in_progress:
+                    self._finish()
+                return False
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    return False
+                self._remaining -= 1
+            self._in_progress += 1
+            return True
+
+    def _end_request(self, profile):
+        with self._lock:
+            self._in_progress -= 1
+            if profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self.num_profiled += 1
+            if self._in_progress:
+                return
+            if self._remaining == 0 or \
+                    (self._until is not None and time.time() > self._until):
+                self._finish()
+
+    def call(self, func, *args, **kwargs):
+        """Call a function, profiling it if a session is running."""
+        if not self.active or not self._begin_request():
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            self._end_request(None)
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._end_request(profile)
+
+    def get_top_functions(self, num_functions=10, sort='tottime'):
+        """Return the functions that took the most time in the session.
+
+        Parameters
+        ----------
+        num_functions : Optional[int]
+            The number of functions to return. Default: 10
+        sort : Optional[str]
+            Either tottime, the time spent in the function itself, or
+            cumtime, the time including the functions it called.
+            Default: tottime
+
+        Returns
+        -------
+        list[dict]
+            The name (file:line(function)), number of calls, tottime and
+            cumtime of each function, in decreasing order of time.
+        """
+        with self._lock:
+            if self._stats is None:
+                return []
+            entries = list(self._stats.stats.items())
+        idx = 3 if sort == 'cumtime' else 2
+        entries.sort(key=lambda entry: entry[1][idx], reverse=True)
+        functions = []
+        for (fname, line, func_name), (_, ncalls, tottime, cumtime, _) in \
+                entries[:num_functions]:
+            functions.append({'function': '%s:%d(%s)' % (fname, line,
+                                                          func_name),
+                              'calls': ncalls,
+                              'tottime': tottime,
+                              'cumtime': cumtime})
+        return functions
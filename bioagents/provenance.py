@@ -0,0 +1,83 @@
+"""Background rendering and sending of provenance for bioagents.
+
+In testing mode, or if the agent's `async_provenance` is False, provenance
+is sent right away instead.
+"""
+import logging
+import threading
+import queue
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class ProvenanceQueue(object):
+    """Collect provenance during a request and send it in the background.
+
+    Provenance is added as functions that render an HTML snippet. The
+    snippets added while a request is handled (i.e., on the same thread) are
+    kept until `flush` is called, typically after the reply to the request
+    has been sent. They are then rendered on a background thread, merged
+    into a single HTML block and sent with one call to `send_html`.
+
+    Parameters
+    ----------
+    send_html : callable
+        A function taking an HTML string and sending it as provenance.
+    """
+    def __init__(self, send_html):
+        self.send_html = send_html
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _get_pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = []
+            self._local.pending = pending
+        return pending
+
+    def add(self, render):
+        """Add a function rendering provenance HTML to the current batch."""
+        self._get_pending().append(render)
+
+    def flush(self):
+        """Queue the provenance added on this thread to be sent."""
+        pending = self._get_pending()
+        if pending:
+            self._local.pending = []
+            self._queue.put(pending)
+
+    def _run(self):
+        while True:
+            renders = self._queue.get()
+            if renders is None:
+                self._queue.task_done()
+                return
+            self._send_batch(renders)
+            self._queue.task_done()
+
+    def _send_batch(self, renders):
+        htmls = []
+        for render in renders:
+            try:
+                htmls.append(render())
+            except Exception as e:
+                logger.error('Could not render provenance.')
+                logger.exception(e)
+        if htmls:
+            try:
+                self.send_html('\n'.join(htmls))
+            except Exception as e:
+                logger.error('Could not send provenance.')
+                logger.exception(e)
+
+    def join(self):
+        """Wait until all queued provenance has been sent."""
+        self._queue.join()
+
+    def stop(self):
+        self._queue.put(None)
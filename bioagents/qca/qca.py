@@ -4,16 +4,19 @@
 import os
 import logging
 import json
-import ndex2.client as nc
 import requests
 import io
 import functools
 from enum import Enum
 from bioagents import BioagentException
+from bioagents.lazy import lazy_import, lazy_property
+from bioagents.deadline import check_deadline, deadline_reached
 
 
 logger = logging.getLogger('QCA')
 
+nc = lazy_import('ndex2.client')
+
 
 class PathNotFoundException(BioagentException):
     def __init__(self, *args, **kwargs):
@@ -103,12 +106,15 @@ class QCA(object):
         # list of query dicts
         self.queries = []
 
+    @lazy_property
+    def ndex(self):
+        # Connect to NDEx the first time it is needed
         try:
-            self.ndex = nc.Ndex2(host=self.host)
+            return nc.Ndex2(host=self.host)
         except Exception as e:
             logger.error('QCA could not connect to %s' % self.host)
             logger.error(e)
-            self.ndex = None
+            return None
 
     def find_causal_path(self, source_names, target_names,
                          exit_on_found_path=False, relation_types=None):
@@ -132,6 +138,10 @@ class QCA(object):
         # Find paths in all available networks
         #==========================================
         for network in self.reference_networks:
+            # If the request is out of time, we return the paths found so far
+            if results_list and deadline_reached():
+                break
+            check_deadline()
             pr = self.get_directed_paths_by_names(source_names, target_names,
                                                   network.get("id"),
                                                   network.get("server"),
@@ -3,11 +3,11 @@ import sys
 import json
 import logging
 from bioagents import Bioagent
+from bioagents.ekb import resolve_ekb
 from kqml import KQMLList, KQMLString
 from .qca import QCA
 from indra.statements import stmts_from_json
 from indra.assemblers.english import EnglishAssembler
-from indra.sources.trips.processor import TripsProcessor
 
 
 logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
@@ -23,6 +23,10 @@ class QCA_Module(Bioagent):
     '''
     name = 'QCA'
     tasks = ['FIND-QCA-PATH', 'HAS-QCA-PATH']
+    # FIND-QCA-PATH also sends provenance and images so it isn't cached
+    cacheable_tasks = ['HAS-QCA-PATH']
+    # but duplicate requests for it can share the reply of the first one
+    coalesced_tasks = ['FIND-QCA-PATH']
 
     def __init__(self, **kwargs):
         # For local testing use
@@ -154,12 +158,10 @@ class QCA_Module(Bioagent):
         return reply
 
     def _get_term_name(self, term_str):
-        tp = TripsProcessor(term_str)
-        terms = tp.tree.findall('TERM')
-        if not terms:
+        ekb = resolve_ekb(term_str)
+        if not ekb.term_ids:
             return None
-        term_id = terms[0].attrib['id']
-        agent = tp._get_agent_by_id(term_id, None)
+        agent = ekb.get_agent()
         if agent is None:
             return None
         return agent.name
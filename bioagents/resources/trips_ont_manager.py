@@ -1,11 +1,17 @@
 import os
-from indra.preassembler.hierarchy_manager import HierarchyManager
+from bioagents.lazy import lazy_resource, lazy_module_attributes
+
+
+@lazy_resource
+def get_trips_ontology():
+    """Return the TRIPS ontology, loading it when first needed."""
+    from indra.preassembler.hierarchy_manager import HierarchyManager
+    fname = os.path.join(os.path.dirname(__file__), 'trips_ontology.rdf')
+    trips_ontology = HierarchyManager(fname, uri_as_name=False)
+    trips_ontology.relations_prefix = 'http://trips.ihmc.us/relations/'
+    trips_ontology.initialize()
+    return trips_ontology
 
-# Make a TRIPS ontology
-_fname = os.path.join(os.path.dirname(__file__), 'trips_ontology.rdf')
-trips_ontology = HierarchyManager(_fname, uri_as_name=False)
-trips_ontology.relations_prefix = 'http://trips.ihmc.us/relations/'
-trips_ontology.initialize()
 
 def trips_isa(concept1, concept2):
     # Preprocess to make this more general
@@ -13,6 +19,10 @@ def trips_isa(concept1, concept2):
     concept2 = concept2.lower().replace('ont::', '')
     if concept1 == concept2:
         return True
-    isa = trips_ontology.isa('http://trips.ihmc.us/concepts/', concept1,
-                             'http://trips.ihmc.us/concepts/', concept2)
+    isa = get_trips_ontology().isa('http://trips.ihmc.us/concepts/', concept1,
+                                   'http://trips.ihmc.us/concepts/', concept2)
     return isa
+
+
+# The ontology used to be loaded on import as trips_ontology
+lazy_module_attributes(__name__, trips_ontology=get_trips_ontology)
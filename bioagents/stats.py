@@ -0,0 +1,172 @@
+"""Latency and throughput statistics for the tasks a bioagent performs.
+
+The statistics can be requested with the built-in AGENT-STATS task and are
+also written to a text file every `stats_interval` seconds (unless it is 0).
+"""
+import time
+import threading
+from collections import deque
+
+
+class RollingHistogram(object):
+    """Keep the most recent samples of a measurement and summarize them.
+
+    Parameters
+    ----------
+    max_samples : int
+        The number of most recent samples to keep.
+    bounds : list[float]
+        The upper bounds of histogram buckets, in increasing order. Values
+        above the last bound are counted in an overflow bucket.
+    """
+    def __init__(self, max_samples=1000, bounds=None):
+        self.samples = deque(maxlen=max_samples)
+        self.bounds = bounds if bounds else \
+            [0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0]
+
+    def add(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.samples.append((timestamp, value))
+
+    def values(self):
+        return [v for _, v in self.samples]
+
+    def rate(self, window=60.0, now=None):
+        """Return the number of samples per second over the last window."""
+        if now is None:
+            now = time.time()
+        num_recent = len([t for t, _ in self.samples if now - t <= window])
+        return num_recent / window
+
+    def buckets(self):
+        """Return a list of (upper bound, count) tuples for the samples."""
+        counts = [0] * (len(self.bounds) + 1)
+        for v in self.values():
+            for i, bound in enumerate(self.bounds):
+                if v <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return list(zip(self.bounds + [float('inf')], counts))
+
+    def summary(self):
+        """Return a dict with the count, mean, percentiles and max."""
+        values = sorted(self.values())
+        if not values:
+            return {'count': 0}
+
+        def percentile(p):
+            idx = min(int(round(p * (len(values) - 1))), len(values) - 1)
+            return values[idx]
+        return {'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': values[-1]}
+
+
+class TaskStats(object):
+    """Statistics for a single task."""
+    metrics = ['queue-wait', 'handler', 'reply']
+
+    def __init__(self, max_samples=1000):
+        self.count = 0
+        self.failures = 0
+        self.histograms = {m: RollingHistogram(max_samples)
+                           for m in self.metrics}
+
+
+class AgentStats(object):
+    """Collect per-task timing statistics for an agent.
+
+    Three durations are tracked for each task: the time a request waits
+    before a worker picks it up (queue-wait), the time spent in the respond
+    method (handler) and the time spent serializing and sending the reply
+    (reply). The number of requests and the number of failures are also
+    counted for each task.
+    """
+    def __init__(self, name, max_samples=1000):
+        self.name = name
+        self.max_samples = max_samples
+        self.start_time = time.time()
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    def _get_task(self, task):
+        task_stats = self.tasks.get(task)
+        if task_stats is None:
+            task_stats = TaskStats(self.max_samples)
+            self.tasks[task] = task_stats
+        return task_stats
+
+    def record(self, task, metric, duration):
+        """Record a duration in seconds for the given task and metric."""
+        with self._lock:
+            task_stats = self._get_task(task)
+            task_stats.histograms[metric].add(duration)
+            if metric == 'handler':
+                task_stats.count += 1
+
+    def record_failure(self, task):
+        with self._lock:
+            self._get_task(task).failures += 1
+
+    def get_summary(self):
+        """Return a dict summarizing the statistics of each task."""
+        with self._lock:
+            summary = {}
+            for task, task_stats in self.tasks.items():
+                handler_hist = task_stats.histograms['handler']
+                task_summary = {'count': task_stats.count,
+                                'failures': task_stats.failures,
+                                'throughput': handler_hist.rate()}
+                for metric, hist in task_stats.histograms.items():
+                    task_summary[metric] = hist.summary()
+                    task_summary[metric]['buckets'] = hist.buckets()
+                summary[task] = task_summary
+        return summary
+
+    def format_text(self):
+        """Return the statistics formatted as human-readable text."""
+        lines = ['%s statistics (uptime %.1f s)' %
+                 (self.name, time.time() - self.start_time)]
+        for task, ts in sorted(self.get_summary().items()):
+            lines.append('%s: %d requests, %d failures, %.3f requests/s' %
+                         (task, ts['count'], ts['failures'],
+                          ts['throughput']))
+            for metric in TaskStats.metrics:
+                ms = ts[metric]
+                if not ms['count']:
+                    continue
+                buckets = ' '.join('<=%g:%d' % b for b in ms['buckets']
+                                   if b[1])
+                lines.append('  %-10s n=%d mean=%.4f p50=%.4f p95=%.4f '
+                             'p99=%.4f max=%.4f [%s]' %
+                             (metric, ms['count'], ms['mean'], ms['p50'],
+                              ms['p95'], ms['p99'], ms['max'], buckets))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fname):
+        with open(fname, 'w') as fh:
+            fh.write(self.format_text())
+
+
+class StatsWriter(threading.Thread):
+    """A daemon thread that periodically writes statistics to a file."""
+    def __init__(self, stats, fname, interval=60.0):
+        super(StatsWriter, self).__init__()
+        self.daemon = True
+        self.stats = stats
+        self.fname = fname
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.stats.write(self.fname)
+
+    def stop(self):
+        self._stop_event.set()
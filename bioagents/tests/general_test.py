@@ -1,7 +1,31 @@
+import os
+import sys
+import types
+import logging
 import re
+import time
+import tempfile
+import threading
 from indra.statements import Phosphorylation, Agent, Evidence
 from bioagents.tests.integration import _IntegrationTest
 from bioagents import Bioagent, BioagentException, make_evidence_html
+from bioagents.executor import RequestExecutor
+from bioagents.provenance import ProvenanceQueue
+from bioagents.lazy import lazy_import, lazy_resource, \
+    lazy_module_attributes
+from bioagents.host import AgentHost
+from bioagents.bus import MessageBus
+from bioagents.model_registry import ModelRegistry, get_model_hash
+from bioagents.http_cache import install_http_cache, uninstall_http_cache, \
+    OfflineCacheMiss
+from bioagents.traffic import read_traffic, replay
+from bioagents.deadline import check_deadline
+from bioagents.ekb import resolve_ekb
+from bioagents.process_pool import ProcessPool, run_in_pool, map_in_pool, \
+    start_process_pool, stop_process_pool, get_process_pool
+from bioagents.logs import add_agent_log_file, log_agent_scope, \
+    start_queue_logging, stop_queue_logging, LargePayload, PayloadRateFilter
+from bioagents.tests.util import ekb_from_text, get_reply, DummyAgent
 from kqml import KQMLList, KQMLPerformative
 
 
@@ -22,6 +46,64 @@ def test_make_evidence_html1():
     assert 'Database entry in \'bel\'' in ev_html, ev_html
 
 
+def test_make_evidence_html_limit_order():
+    evs = [Evidence(source_api='bel', source_id='bel_%d' % i)
+           for i in range(3)]
+    evs += [Evidence(source_api='trips', pmid=str(i), text='Text %d' % i)
+            for i in range(100)]
+    stmt = Phosphorylation(Agent('A'), Agent('B'), evidence=evs)
+    ev_html = make_evidence_html([stmt], limit=5)
+    entries = re.findall('<li>(.*?)</li>', ev_html)
+    assert len(entries) == 5, entries
+    # Evidence with text comes first, in the order it is listed
+    assert all('Text %d' % i in entries[i] for i in range(5)), entries
+    ev_html = make_evidence_html([stmt], limit=102)
+    entries = re.findall('<li>(.*?)</li>', ev_html)
+    assert 'bel_0' in entries[100] and 'bel_1' in entries[101], entries
+
+
+def test_lazy_loading():
+    calls = []
+
+    @lazy_resource
+    def get_resource():
+        calls.append(1)
+        return {'a': 1}
+    assert not get_resource.is_loaded()
+    assert get_resource() is get_resource()
+    assert len(calls) == 1
+    json_module = lazy_import('json')
+    assert json_module.loads('[1]') == [1]
+    assert json_module.is_loaded
+
+
+def test_lazy_module_attributes():
+    calls = []
+
+    @lazy_resource
+    def get_resource():
+        calls.append(1)
+        return {'a': 1}
+    module = types.ModuleType('lazy_attributes_test')
+    sys.modules[module.__name__] = module
+    try:
+        lazy_module_attributes(module.__name__, resource=get_resource)
+        assert not calls
+        assert module.resource is get_resource()
+        assert len(calls) == 1
+    finally:
+        del sys.modules[module.__name__]
+
+
+def test_agent_host():
+    host = AgentHost(['BioNLG'], preload=False, testing=True)
+    host.start()
+    host.join()
+    agent = host.agents['BioNLG']
+    assert agent.testing
+    assert agent.out.getvalue()
+
+
 class TestErrorHandling(_IntegrationTest):
     reason = 'FOUND-IT'
 
@@ -29,10 +111,7 @@ class TestErrorHandling(_IntegrationTest):
         class FindMe(BioagentException):
             pass
 
-        class TestAgent(Bioagent):
-            name = 'test'
-            tasks = ['TEST']
-
+        class TestAgent(DummyAgent):
             def receive_request(self, msg, content):
                 try:
                     Bioagent.receive_request(self, msg, content)
@@ -61,3 +140,510 @@ class TestErrorHandling(_IntegrationTest):
         assert output.get('reason') == self.reason,\
             ("Exception caught too soon (wrong reason: %s)."
              % output.get('reason'))
+
+
+def test_request_executor_task_pools():
+    ex = RequestExecutor(num_workers=1, task_workers={'slow': 2})
+    # Both requests need to run at the same time to get past the barrier,
+    # which is only possible with a dedicated pool of two workers.
+    barrier = threading.Barrier(2, timeout=5)
+    futures = [ex.submit('SLOW', barrier.wait) for _ in range(2)]
+    futures.append(ex.submit('FAST', lambda: 'fast'))
+    assert futures[2].result(timeout=5) == 'fast'
+    assert {f.result(timeout=5) for f in futures[:2]} == {0, 1}
+    ex.shutdown()
+
+
+def test_concurrent_request_dispatch():
+    agent = DummyAgent(testing=True, num_workers=2)
+    for i in range(5):
+        content = KQMLList('TEST')
+        content.set('value', str(i))
+        msg = KQMLPerformative('REQUEST')
+        msg.set('content', content)
+        msg.set('reply-with', 'IO-%d' % i)
+        agent.dispatcher.dispatch_message(msg)
+    agent.executor.shutdown()
+    out = agent.out.getvalue().decode()
+    for i in range(5):
+        assert '(SUCCESS :value %d) :in-reply-to IO-%d' % (i, i) in out, out
+
+
+def test_agent_stats():
+    agent = DummyAgent(testing=True)
+    for content_str in ('(TEST)', '(TEST)', '(TEST :fail TRUE)'):
+        get_reply(agent, content_str)
+    reply = get_reply(agent, '(AGENT-STATS)')
+    assert reply.head() == 'SUCCESS', reply
+    task_stats = reply.get('tasks')[0]
+    assert task_stats.gets('task') == 'TEST', task_stats
+    assert task_stats.gets('count') == '3', task_stats
+    assert task_stats.gets('failures') == '1', task_stats
+    assert task_stats.get('handler').gets('count') == '3', task_stats
+    assert 'TEST: 3 requests, 1 failures' in agent.stats.format_text()
+    # Built-in tasks are only answered when addressed to the agent
+    msg = KQMLPerformative.from_string('(request :content (AGENT-STATS))')
+    agent.receive_request(msg, msg.get('content'))
+    out = agent.out.getvalue().decode().strip().split('\n')[-1]
+    reply = KQMLPerformative.from_string(out).get('content')
+    assert reply.gets('reason') == 'MISSING_RECEIVER', reply
+
+
+def test_response_cache():
+    agent = DummyAgent(testing=True, cacheable_tasks=['TEST'])
+    contents = ['(TEST :a "x" :b 1)', '(test :B 1 :A "x")', '(TEST :a "y")',
+                '(TEST :a "y" :timeout 30)']
+    for content_str in contents:
+        get_reply(agent, content_str)
+    # The first two differ only in keyword order and case, the last two
+    # only in the time they may take
+    assert len(agent.handled) == 2, agent.handled
+    assert agent.response_cache.hits == 2
+    tell = KQMLList.from_string('(START-CONVERSATION)')
+    agent.receive_tell(KQMLPerformative('TELL'), tell)
+    assert len(agent.response_cache) == 0
+
+
+def test_provenance_queue_merges_batch():
+    sent = []
+    pq = ProvenanceQueue(sent.append)
+    pq.add(lambda: '<h4>A</h4>')
+    pq.add(lambda: '<h4>B</h4>')
+    # Nothing is sent until the batch is flushed
+    pq.join()
+    assert not sent
+    pq.flush()
+    pq.join()
+    assert sent == ['<h4>A</h4>\n<h4>B</h4>'], sent
+    pq.stop()
+
+
+def test_provenance_flushed_without_reply():
+    class ProvenanceAgent(DummyAgent):
+        def receive_request(self, msg, content):
+            value = content.gets('value')
+            self._add_provenance(lambda: '<h4>%s</h4>' % value)
+            if value == 'A':
+                return self.error_reply(msg, 'failed')
+            return super(ProvenanceAgent, self).receive_request(msg,
+                                                                content)
+
+    sent = []
+    agent = ProvenanceAgent(testing=True)
+    agent.provenance_queue = ProvenanceQueue(sent.append)
+    for value in ['A', 'B']:
+        agent.dispatcher.dispatch_message(KQMLPerformative.from_string(
+            '(request :content (TEST :value %s))' % value))
+        agent.provenance_queue.join()
+    # The provenance of the request that got an error reply wasn't sent as
+    # if it came from the next request.
+    assert sent == ['<h4>A</h4>', '<h4>B</h4>'], sent
+    agent.provenance_queue.stop()
+
+
+def test_traffic_record_replay():
+    fname = os.path.join(tempfile.mkdtemp(), 'traffic.in')
+    agent = DummyAgent(testing=True, traffic_file=fname)
+    msg = KQMLPerformative.from_string(
+        '(request :reply-with IO-1 :content (TEST :value 1))')
+    agent.receive_request(msg, msg.get('content'))
+    traffic = read_traffic(fname)
+    assert traffic == [('(TEST :value 1)', '(SUCCESS :value 1)')], traffic
+    results = replay(agent, [req for req, _ in traffic], concurrency=2,
+                     repeats=3)
+    assert results['TEST'].summary()['count'] == 3
+    assert len(read_traffic(fname)) == 4
+    # Requests are handed to the worker threads of the agent, if any
+    agent = DummyAgent(testing=True, traffic_file=fname, num_workers=2)
+    results = replay(agent, ['(TEST :value 2)', '(AGENT-STATS)'],
+                     concurrency=2)
+    assert results['TEST'].summary()['count'] == 1
+    traffic = read_traffic(fname)
+    assert len(traffic) == 6, traffic
+    assert '(SUCCESS :value 2)' in [reply for _, reply in traffic]
+    agent.executor.shutdown()
+
+
+def test_request_deadline():
+    agent = DummyAgent(testing=True, task_timeouts={'TEST': 0.05})
+    replies = [get_reply(agent, content_str)
+               for content_str in ('(TEST :steps 1000)',
+                                   '(TEST :steps 1000 :partial TRUE)',
+                                   '(TEST :steps 1000 :timeout 0.02 '
+                                   ':partial TRUE)')]
+    assert replies[0].head() == 'FAILURE', replies[0]
+    assert replies[0].gets('reason') == 'TIMEOUT', replies[0]
+    assert replies[1].head() == 'PARTIAL', replies[1]
+    assert 0 < int(replies[1].gets('done')) < 1000, replies[1]
+    assert int(replies[2].gets('done')) < int(replies[1].gets('done'))
+
+
+def test_resolve_ekb():
+    ekb = ekb_from_text('MAP2K1')
+    resolved = resolve_ekb(ekb)
+    assert resolve_ekb(ekb) is resolved
+    agent = resolved.get_agent()
+    assert agent.name == 'MAP2K1', agent
+    assert resolved.get_ont_type() == 'ONT::GENE'
+    assert 'HGNC' in resolved.get_groundings()
+    # Agents are copies that can be changed without changing the cache
+    agent.name = 'X'
+    assert resolved.get_agent().name == 'MAP2K1'
+
+
+def test_process_pool():
+    stmts = [Phosphorylation(Agent('MAP2K1'), Agent('MAPK1')),
+             Phosphorylation(Agent('BRAF'), Agent('MAP2K1'))]
+    # Without a pool, the function is called in this process
+    assert run_in_pool(len, stmts) == 2
+    pool = ProcessPool(1, preload=[])
+    try:
+        assert pool.run(len, stmts) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_map_in_pool():
+    args_list = [(i, 2) for i in range(6)]
+    expected = [i ** 2 for i in range(6)]
+    # Without a pool, the calls are made one after the other
+    assert map_in_pool(pow, args_list) == expected
+    start_process_pool(2, preload=[])
+    try:
+        # The results are in the order of the arguments
+        assert map_in_pool(pow, args_list) == expected
+    finally:
+        stop_process_pool()
+    assert get_process_pool() is None
+
+
+def _wait_or_fail(seconds):
+    """Wait for a number of seconds, or fail right away if it is None."""
+    if seconds is None:
+        raise ValueError('Failed')
+    end = time.time() + seconds
+    while time.time() < end:
+        check_deadline()
+        time.sleep(0.01)
+    return seconds
+
+
+def test_process_pool_map_cancels():
+    pool = ProcessPool(2, preload=[])
+    try:
+        try:
+            pool.map(_wait_or_fail, [(None,), (30,), (30,), (30,)])
+            assert False, 'The failed call should raise.'
+        except ValueError:
+            pass
+        # The other calls were cancelled, so the workers are free again
+        ts = time.time()
+        assert pool.map(pow, [(2, 2)]) == [4]
+        assert time.time() - ts < 10
+    finally:
+        pool.shutdown()
+
+
+def test_process_workers_argv():
+    fname = os.path.join(tempfile.mkdtemp(), 'traffic.in')
+    agent = DummyAgent(argv=['-process-workers', '2', '-warmup', 'false',
+                            '-traffic-file', fname, '-testing', 'true'])
+    assert agent.testing
+    assert agent.process_workers == 2
+    assert not agent.warmup
+    assert agent.traffic_recorder.fname == fname
+
+
+def test_queue_logging_routes_agent_records():
+    tmp_dir = tempfile.mkdtemp()
+    fnames = [add_agent_log_file(name, os.path.join(tmp_dir, name + '.log'))
+              for name in ('AGENT_A', 'AGENT_B')]
+    test_logger = logging.getLogger('log_test')
+    with log_agent_scope('AGENT_A'):
+        test_logger.info('Record of A')
+    with log_agent_scope('AGENT_B'):
+        test_logger.info('Record of B')
+    with log_agent_scope(None):
+        test_logger.info('Record of no agent')
+    # Stopping writes out the queued records
+    stop_queue_logging()
+    start_queue_logging()
+    with open(fnames[0], 'r') as fh:
+        log_a = fh.read()
+    assert 'Record of A' in log_a and 'Record of B' not in log_a, log_a
+    assert 'Record of no agent' in log_a, log_a
+
+
+def test_large_payload():
+    text = str(LargePayload(list(range(1000)), max_items=3))
+    assert text == '[0, 1, 2] ... (1000 items)', text
+    assert len(str(LargePayload('x' * 5000, max_length=100))) < 200
+    rate_filter = PayloadRateFilter(interval=60)
+    records = [logging.LogRecord('log_test', logging.INFO, '', 0,
+                                 'Model: %s', (LargePayload(['x']),), None)
+               for _ in range(3)]
+    assert [rate_filter.filter(r) for r in records] == [True, False, False]
+
+
+def test_message_bus():
+    class EchoAgent(Bioagent):
+        name = 'ECHO_AGENT'
+        tasks = ['ECHO']
+
+        def respond_echo(self, content):
+            reply = KQMLList('SUCCESS')
+            reply.set('value', content.get('value'))
+            return reply
+
+    class Continuation(object):
+        def __init__(self):
+            self.replies = []
+            self.received = threading.Event()
+
+        def receive(self, msg):
+            self.replies.append(msg)
+            self.received.set()
+
+    bus = MessageBus()
+    EchoAgent(testing=True, message_bus=bus)
+    sender = Bioagent.__new__(Bioagent)
+    sender.name = 'SENDER_AGENT'
+    Bioagent.__init__(sender, testing=True, message_bus=bus)
+    assert bus.is_local('echo_agent')
+    sent_before = sender.out.getvalue()
+    msg = KQMLPerformative.from_string(
+        '(request :receiver ECHO_AGENT :reply-with S-1 '
+        ':content (ECHO :value 42))')
+    cont = Continuation()
+    sender.dispatcher.add_reply_continuation('S-1', cont)
+    sender.send(msg)
+    assert cont.received.wait(5)
+    reply = cont.replies[0]
+    assert reply.get('content').gets('value') == '42', reply
+    assert reply.get('sender').string_value() == 'ECHO_AGENT', reply
+    # Nothing went over the sender's connection
+    assert sender.out.getvalue() == sent_before
+    bus.unregister('ECHO_AGENT')
+    assert not bus.is_local('ECHO_AGENT')
+
+
+def test_message_bus_serial_dispatch():
+    class SlowAgent(Bioagent):
+        name = 'SLOW_AGENT'
+        tasks = ['SLOW']
+
+        def __init__(self, **kwargs):
+            self.running = 0
+            self.max_running = 0
+            self.handled = threading.Semaphore(0)
+            super(SlowAgent, self).__init__(**kwargs)
+
+        def respond_slow(self, content):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            time.sleep(0.2)
+            self.running -= 1
+            self.handled.release()
+            return KQMLList('SUCCESS')
+
+    bus = MessageBus()
+    agent = SlowAgent(testing=True, message_bus=bus)
+    msg = KQMLPerformative.from_string(
+        '(request :receiver SLOW_AGENT :reply-with S-1 :content (SLOW))')
+    assert bus.deliver(msg, 'SENDER_AGENT')
+    agent.dispatcher.dispatch_message(
+        KQMLPerformative.from_string('(request :content (SLOW))'))
+    assert agent.handled.acquire(timeout=5)
+    assert agent.handled.acquire(timeout=5)
+    # The message from the bus and the one from the connection were not
+    # handled at the same time.
+    assert agent.max_running == 1
+    bus.unregister('SLOW_AGENT')
+
+
+def test_model_registry():
+    stmts = [Phosphorylation(Agent('MAP2K1'), Agent('MAPK1')),
+             Phosphorylation(Agent('BRAF'), Agent('MAP2K1'))]
+    other_stmts = [Phosphorylation(Agent('BRAF'), Agent('MAP2K1'),
+                                   evidence=[Evidence(text='BRAF...')]),
+                   Phosphorylation(Agent('MAP2K1'), Agent('MAPK1'))]
+    # The hash doesn't depend on the order or the evidence of statements
+    assert get_model_hash(stmts) == get_model_hash(other_stmts)
+    assert get_model_hash(stmts) != get_model_hash(stmts[:1])
+
+    store_dir = tempfile.mkdtemp()
+    registry = ModelRegistry(store_dir=store_dir)
+    model_hash = registry.register(stmts)
+    # Changing the list of statements doesn't change the registered model
+    stmts.append(Phosphorylation(Agent('KRAS'), Agent('BRAF')))
+    assert len(registry.get_statements(model_hash)) == 2
+    calls = []
+
+    def assemble(model_stmts):
+        calls.append(model_stmts)
+        return {'monomers': [st.enz.name for st in model_stmts]}
+
+    model = registry.get_assembled(model_hash, 'test', assemble)
+    model['monomers'].append('X')
+    model = registry.get_assembled(model_hash, 'test', assemble)
+    assert model == {'monomers': ['MAP2K1', 'BRAF']}, model
+    assert len(calls) == 1
+    # Another process can load the model from the store
+    other_registry = ModelRegistry(store_dir=store_dir)
+    assert len(other_registry.get_statements(model_hash)) == 2
+    assert other_registry.get_json(model_hash) == registry.get_json(model_hash)
+    assert not other_registry.has_model('unknown')
+
+
+def test_http_cache():
+    import requests
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body = ('Response to %s' % self.path).encode('utf-8')
+            if self.headers.get('Accept') == 'application/json':
+                body = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('localhost', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://localhost:%d/genes' % server.server_port
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = install_http_cache(cache_dir)
+        for _ in range(2):
+            res = requests.get(url, params={'symbol': 'BRAF'})
+            assert res.text == 'Response to /genes?symbol=BRAF', res.text
+        assert len(hits) == 1 and cache.hits == 1
+        # The content of cached responses can be iterated over too
+        res = requests.get(url, params={'symbol': 'BRAF'})
+        assert b''.join(res.iter_content(4)) == \
+            b'Response to /genes?symbol=BRAF'
+        assert len(hits) == 1 and cache.hits == 2
+        # Requests with other headers or credentials get their own responses
+        res = requests.get(url, params={'symbol': 'BRAF'},
+                           headers={'Accept': 'application/json'})
+        assert res.text == '{}', res.text
+        requests.get(url, params={'symbol': 'BRAF'}, auth=('user', 'pass'))
+        assert len(hits) == 3 and cache.hits == 2
+        # Offline, recorded responses are replayed and others fail
+        install_http_cache(cache_dir, offline=True)
+        res = requests.Session().get(url, params={'symbol': 'BRAF'})
+        assert res.status_code == 200 and len(hits) == 3
+        try:
+            requests.get(url, params={'symbol': 'KRAS'})
+            assert False, 'Expected OfflineCacheMiss'
+        except OfflineCacheMiss:
+            pass
+        uninstall_http_cache()
+        requests.get(url, params={'symbol': 'KRAS'})
+        assert len(hits) == 4
+    finally:
+        uninstall_http_cache()
+        server.shutdown()
+
+
+def test_profile_task():
+    agent = DummyAgent(testing=True)
+    reply = get_reply(agent, '(PROFILE :requests 2)')
+    assert reply.gets('status') == 'running', reply
+    for _ in range(3):
+        get_reply(agent, '(TEST :steps 2)')
+    reply = get_reply(agent, '(PROFILE :top 5 :sort cumtime)')
+    assert reply.gets('status') == 'stopped', reply
+    assert reply.gets('requests') == '2', reply
+    assert len(reply.get('functions')) == 5, reply
+    fname = reply.gets('file')
+    assert os.path.exists(fname)
+    os.remove(fname)
+    # A session whose duration passes without requests ends too
+    reply = get_reply(agent, '(PROFILE :duration 0.1)')
+    assert reply.gets('status') == 'running', reply
+    assert reply.get('file') is None, reply
+    time.sleep(0.2)
+    reply = get_reply(agent, '(PROFILE)')
+    assert reply.gets('status') == 'stopped', reply
+    # No requests were profiled, so no statistics were written
+    assert reply.get('file') is None, reply
+
+
+def test_memory_report():
+    agent = DummyAgent(testing=True, cacheable_tasks=['TEST'])
+    try:
+        get_reply(agent, '(MEMORY-REPORT :resources FALSE :tracemalloc START)')
+        agent.handled.extend(['x' * 1000 + str(i) for i in range(1000)])
+        reply = get_reply(agent, '(MEMORY-REPORT :resources FALSE '
+                                ':tracemalloc DIFF :top 3)')
+    finally:
+        agent.allocation_tracker.stop()
+    assert int(reply.gets('rss')) > 0, reply
+    subsystems = {sub.gets('name'): sub for sub in reply.get('subsystems')}
+    assert set(subsystems) == {'handled', 'stats', 'response_cache'}, reply
+    assert subsystems['handled'].gets('count') == '1000'
+    assert int(subsystems['handled'].gets('size')) > 1000 * 1000
+    allocations = reply.get('allocations')
+    assert int(allocations[0].gets('size-diff')) > 1000 * 1000, allocations
+
+
+def test_warmup():
+    agent = DummyAgent(testing=True, warmup=True, cacheable_tasks=['TEST'])
+    assert agent.warmup_time is not None
+    assert agent.handled == []
+    assert not agent.stats.get_summary()
+    assert len(agent.response_cache) == 0
+    # The tell sent while warming up was dropped
+    assert 'DISPLAY' not in agent.out.getvalue().decode()
+    content = KQMLList.from_string('(AGENT-STATS)')
+    reply = agent._respond_to('AGENT-STATS', content)
+    assert reply.get('warmup-time') is not None, reply
+
+
+def test_coalesce_identical_requests():
+    class BlockingAgent(DummyAgent):
+        def __init__(self, **kwargs):
+            self.started = threading.Event()
+            self.release = threading.Event()
+            super(BlockingAgent, self).__init__(**kwargs)
+
+        def respond_test(self, content):
+            self.started.set()
+            self.release.wait(5)
+            return super(BlockingAgent, self).respond_test(content)
+
+    agent = BlockingAgent(testing=True, coalesced_tasks=['TEST'])
+    replies = []
+
+    def request(content_str):
+        content = KQMLList.from_string(content_str)
+        replies.append(agent._respond_to('TEST', content))
+
+    threads = [threading.Thread(target=request, args=('(TEST :value 1)',))]
+    threads[0].start()
+    assert agent.started.wait(5)
+    # The same content, with keywords in another order and case
+    threads.append(threading.Thread(target=request,
+                                    args=('(test :VALUE 1)',)))
+    threads[1].start()
+    # Give the second request time to join the first one
+    time.sleep(0.2)
+    agent.release.set()
+    for thread in threads:
+        thread.join()
+    assert len(agent.handled) == 1, agent.handled
+    assert agent.in_flight.coalesced == 1
+    assert replies[0] is replies[1]
+    # Once the first request is done, the next one is handled again
+    request('(TEST :value 1)')
+    assert len(agent.handled) == 2
+    assert len(agent.in_flight) == 0
@@ -1,11 +1,14 @@
 import json
+import time
 import unittest
 import xml.etree.ElementTree as ET
+from kqml import KQMLPerformative
 from kqml.kqml_list import KQMLList
 import indra.statements as sts
 from bioagents.tests.util import ekb_from_text, ekb_kstring_from_text, \
         get_request, stmts_json_from_text
 from bioagents.tests.integration import _IntegrationTest, _FailureTest
+from bioagents.deadline import check_deadline
 from bioagents.mra.mra import MRA, make_influence_map, make_contact_map
 from bioagents.mra.mra_module import MRA_Module, ekb_from_agent, get_target, \
     _get_matching_stmts, CAN_CHECK_STATEMENTS
@@ -218,6 +221,26 @@ def test_respond_model_undo():
     assert json.loads(stmts.string_value()) == json.loads(expand_stmts)
 
 
+def test_respond_deadline_failure():
+    mm = MRA_Module(testing=True)
+    model_id = mm.mra.new_model([sts.Phosphorylation(sts.Agent('MEK'),
+                                                     sts.Agent('ERK'))])
+
+    def has_mechanism(ekb, model_id):
+        while True:
+            check_deadline()
+            time.sleep(0.01)
+    mm.mra.has_mechanism = has_mechanism
+    content = KQMLList.from_string('(MODEL-HAS-MECHANISM :description "x" '
+                                   ':model-id %d :timeout 0.05)' % model_id)
+    mm.receive_request(get_request(content), content)
+    out = mm.out.getvalue().decode().strip().split('\n')[-1]
+    reply = KQMLPerformative.from_string(out).get('content')
+    # The deadline isn't reported as an invalid description
+    assert reply.head() == 'FAILURE', reply
+    assert reply.gets('reason') == 'TIMEOUT', reply
+
+
 def test_get_matching_statements():
     if not CAN_CHECK_STATEMENTS:
         raise SkipTest("Database api not accessible.")
@@ -1,8 +1,13 @@
 import json
+import numpy
 from nose.tools import raises
 import sympy.physics.units as units
 from bioagents.tra import tra_module
 from bioagents.tra import tra
+from bioagents.tra import smc
+from bioagents.tra import model_checker
+from bioagents.tra import ltl_parser
+from bioagents.model_registry import get_model_registry
 from pysb import Model, Rule, Monomer, Parameter, Initial, SelfExporter
 from indra.statements import stmts_to_json, Agent, Phosphorylation, \
                              Dephosphorylation, Activation, Inhibition, \
@@ -399,6 +404,168 @@ def test_module():
     assert res[2] is not None
 
 
+def test_module_model_hash():
+    tra = tra_module.TRA_Module(testing=True)
+    model_json = _get_gk_model_indra()
+    stmts = tra_module.decode_indra_stmts(model_json)
+    model_hash = get_model_registry().register(stmts)
+    pattern_msg = '(:type "sometime_value" :entities ((:description ' + \
+                  '%s)) :value (:type "qualitative" :value "high"))' % \
+                  ekb_complex
+    content = KQMLList()
+    content.set('pattern', KQMLList.from_string(pattern_msg))
+    content.set('model-hash', model_hash)
+    res = tra.respond_satisfies_pattern(content)
+    assert res.head() == 'SUCCESS', res
+    content.set('model-hash', 'unknown')
+    res = tra.respond_satisfies_pattern(content)
+    assert res.gets('reason') == 'UNKNOWN_MODEL', res
+
+
+def test_module_confidence():
+    tra = tra_module.TRA_Module(testing=True)
+    pattern_msg = '(:type "sometime_value" :entities ((:description ' + \
+                  '%s)) :value (:type "qualitative" :value "high"))' % \
+                  ekb_complex
+    content = KQMLList()
+    content.set('pattern', KQMLList.from_string(pattern_msg))
+    content.sets('model', _get_gk_model_indra())
+    content.set('confidence', '0.9')
+    res = tra.respond_satisfies_pattern(content)
+    assert res.head() == 'SUCCESS', res
+    interval = res.get('content').get('confidence-interval')
+    assert len(interval) == 2, res
+    content.set('confidence', '2')
+    res = tra.respond_satisfies_pattern(content)
+    assert res.gets('reason') == 'INVALID_CONFIDENCE', res
+
+
+def test_sequential_test():
+    # A property that always holds is decided after a few simulations
+    test = smc.SequentialTest(0.3)
+    while test.add(True) is None:
+        pass
+    assert test.decision is True
+    assert test.num_samples < 10
+    # One that never holds too
+    test = smc.SequentialTest(0.3)
+    while test.add(False) is None:
+        pass
+    assert test.decision is False
+    assert test.num_samples < 20
+    # The rest of a batch of simulations is still counted once decided
+    num_samples = test.num_samples
+    assert test.add(True) is False
+    assert test.num_samples == num_samples + 1
+
+
+def test_confidence_interval():
+    low, high = smc.get_confidence_interval(5, 10)
+    assert 0.2 < low < 0.5 < high < 0.8
+    low, high = smc.get_confidence_interval(10, 10)
+    assert high == 1.0 and low > 0.6
+    low2, high2 = smc.get_confidence_interval(100, 100)
+    assert low2 > low
+
+
+def test_model_checker_trace():
+    states = numpy.zeros(10, dtype=[('x', float)])
+    # A brief activation in between samples of every fifth time point
+    states['x'][3] = 1
+    mc = model_checker
+    assert mc.ModelChecker(mc.transient_formula('x'), states).truth
+    assert not mc.ModelChecker(mc.sustained_formula('x'), states).truth
+    assert not mc.ModelChecker(mc.noact_formula('x'), states).truth
+    assert mc.ModelChecker('F[x,1,1] & !G[x,1,1]', states).truth
+    # Each row of a 2D array is a trace
+    traces = {'x': numpy.array([[0, 1, 1], [0, 1, 0], [0, 0, 0]])}
+    truths = mc.get_truths(ltl_parser.parse_formula('FG[x,1,1]'), traces)
+    assert list(truths[:, 0]) == [True, False, False]
+
+
+def test_batch_checker():
+    traces = []
+    for values in ([0, 1, 0, 0], [0, 1, 1, 1], [0, 0, 0, 0]):
+        trace = numpy.zeros(4, dtype=[('x', float)])
+        trace['x'] = values
+        traces.append(trace)
+    fstrs = [model_checker.transient_formula('x'),
+             model_checker.sustained_formula('x'),
+             model_checker.noact_formula('x')]
+    checker = model_checker.BatchChecker(fstrs)
+    truths = checker.check(traces)
+    assert truths.shape == (3, 3)
+    for fstr, row in zip(fstrs, truths):
+        assert list(row) == [model_checker.ModelChecker(fstr, trace).truth
+                             for trace in traces]
+    assert list(checker.get_sat_rates(traces)) == [1/3., 1/3., 1/3.]
+
+
+def test_batch_checker_different_lengths():
+    # Simulations can stop early, so traces needn't have the same length
+    traces = []
+    for values in ([0, 1, 0, 0], [0, 1, 1], [0, 0, 0, 0, 0], [0, 1]):
+        trace = numpy.zeros(len(values), dtype=[('x', float)])
+        trace['x'] = values
+        traces.append(trace)
+    fstrs = [model_checker.transient_formula('x'),
+             model_checker.sustained_formula('x')]
+    truths = model_checker.BatchChecker(fstrs).check(traces)
+    assert truths.shape == (2, 4)
+    for fstr, row in zip(fstrs, truths):
+        assert list(row) == [model_checker.ModelChecker(fstr, trace).truth
+                             for trace in traces]
+
+
+def test_model_checker_bounded_streaming():
+    # Bounds count from where the operator is evaluated on both paths
+    fstrs = ['G F{1}[x,1,1]', 'F G{2}[x,1,1]', 'G{3} F{1}[x,1,1]',
+             'F{2} G{1}[x,0,0]', 'F{1}[x,1,1] & G{2} F{2}[x,0,0]']
+    for values in ([0, 1, 0, 0, 0, 1, 1], [0, 1, 1, 1, 0, 0, 0],
+                   [1, 0, 1, 0, 1, 0, 1], [0, 0, 0, 1, 1, 1, 1]):
+        states = numpy.zeros(len(values), dtype=[('x', float)])
+        states['x'] = values
+        for fstr in fstrs:
+            checker = model_checker.ModelChecker(fstr)
+            for t, state in enumerate(states):
+                truth = checker.update(state, t == len(states) - 1)
+                if truth is not None:
+                    break
+            assert truth == \
+                model_checker.ModelChecker(fstr, states).truth, \
+                (fstr, values)
+    states = numpy.zeros(7, dtype=[('x', float)])
+    states['x'] = [0, 1, 0, 0, 0, 1, 1]
+    assert not model_checker.ModelChecker('G F{1}[x,1,1]', states).truth
+
+
+def test_parse_formula():
+    formula = ltl_parser.parse_formula('(F[x,1,1] & !G{5}[x,0,0]) | [y,0,2]')
+    atom = ltl_parser.Atomic('x', 1, 1)
+    assert formula == ltl_parser.Or(
+        ltl_parser.And(ltl_parser.Eventually(atom, None),
+                       ltl_parser.Not(ltl_parser.Always(
+                           ltl_parser.Atomic('x', 0, 0), 5))),
+        ltl_parser.Atomic('y', 0, 2))
+    # Formulas are parsed once and their syntax trees are shared
+    assert ltl_parser.parse_formula('FG[x,1,1]') is \
+        ltl_parser.parse_formula('FG[x,1,1]')
+    assert ltl_parser.And(atom, atom) != ltl_parser.Or(atom, atom)
+
+
+@raises(ltl_parser.InvalidFormulaError)
+def test_parse_formula_invalid():
+    ltl_parser.parse_formula('F[x,1,1] &')
+
+
+def test_model_checker_bounded():
+    states = numpy.zeros(10, dtype=[('x', float)])
+    states['x'][6] = 1
+    assert not model_checker.ModelChecker('F{5}[x,1,1]', states).truth
+    assert model_checker.ModelChecker('F{6}[x,1,1]', states).truth
+    assert model_checker.ModelChecker('G{5}[x,0,0]', states).truth
+
+
 # TRA integration tests
 
 class _TraTestModel1(_IntegrationTest):
@@ -1,9 +1,12 @@
 import os
+import time
 import json
 from collections import OrderedDict
-from kqml import KQMLString, KQMLPerformative
+from kqml import KQMLString, KQMLPerformative, KQMLList
 from indra.statements import stmts_to_json
 from indra.sources import trips
+from bioagents import Bioagent
+from bioagents.deadline import check_deadline, deadline_reached
 
 
 def ekb_from_text(text):
@@ -37,6 +40,78 @@ def get_request(content):
     return msg
 
 
+def get_reply(agent, content_str):
+    """Send a request to an agent in testing mode and return its reply."""
+    content = KQMLList.from_string(content_str)
+    msg = KQMLPerformative('REQUEST')
+    msg.set('receiver', agent.name)
+    msg.set('content', content)
+    agent.receive_request(msg, content)
+    out = agent.out.getvalue().decode().strip().split('\n')[-1]
+    return KQMLPerformative.from_string(out).get('content')
+
+
+class DummyAgent(Bioagent):
+    """A Bioagent with a TEST task, for testing what all agents do.
+
+    TEST replies SUCCESS with the :value of the request, if any, and fails
+    with reason FAILED if the request has :fail. With :display, it first
+    tells a (DISPLAY) message. With :steps N, it takes N steps of 10 ms,
+    checking the deadline of the request at each (or, with :partial,
+    stopping early when it is reached), and replies with the number of steps
+    done as :done.
+
+    The contents of the TEST requests handled are kept in `handled`, which
+    is reported as a memory subsystem and emptied after warming up. The
+    class attributes configuring a Bioagent, e.g. cacheable_tasks or
+    task_timeouts, can be given to the constructor.
+    """
+    name = 'test'
+    tasks = ['TEST']
+
+    def __init__(self, **kwargs):
+        for attr in ('cacheable_tasks', 'coalesced_tasks', 'task_timeouts'):
+            if attr in kwargs:
+                setattr(self, attr, kwargs.pop(attr))
+        self.handled = []
+        super(DummyAgent, self).__init__(**kwargs)
+
+    def get_warmup_requests(self):
+        return [KQMLList.from_string('(TEST :value 1 :display TRUE)'),
+                KQMLList.from_string('(UNKNOWN)')]
+
+    def end_warmup(self):
+        super(DummyAgent, self).end_warmup()
+        self.handled = []
+
+    def get_memory_subsystems(self):
+        subsystems = super(DummyAgent, self).get_memory_subsystems()
+        subsystems['handled'] = self.handled
+        return subsystems
+
+    def respond_test(self, content):
+        self.handled.append(content)
+        if content.get('display') is not None:
+            self.tell(KQMLList('DISPLAY'))
+        if content.get('fail') is not None:
+            return self.make_failure('FAILED')
+        reply = KQMLList('SUCCESS')
+        if content.get('value') is not None:
+            reply.set('value', content.get('value'))
+        if content.get('steps') is not None:
+            done = 0
+            while done < int(content.gets('steps')):
+                if content.get('partial') is not None:
+                    if deadline_reached():
+                        break
+                else:
+                    check_deadline()
+                time.sleep(0.01)
+                done += 1
+            reply.set('done', str(done))
+        return reply
+
+
 cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                           'ekb_cache.json')
 
@@ -71,10 +71,9 @@ class KappaRuntime(object):
             'seed': None,
             'store_trace': True
             }
+        complete_params.update(parameters)
         sim_params = kappy.SimulationParameter(**complete_params)
-        self.kappa_instance.simulation_start(sim_params)
-        resp = complete_params.update(parameters)
-        return resp.json()
+        return self.kappa_instance.simulation_start(sim_params)
 
     def pause_sim(self):
         """Pause a given simulation."""
@@ -84,6 +83,10 @@ class KappaRuntime(object):
         """Continue the pause simulation."""
         self.kappa_instance.simulation_continue()
 
+    def delete_sim(self):
+        """Delete the simulation, keeping the compiled model."""
+        self.kappa_instance.simulation_delete()
+
     def sim_status(self):
         """Return status of running simulation."""
         return self.kappa_instance.simulation_info()
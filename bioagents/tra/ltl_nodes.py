@@ -1,64 +1,31 @@
-import re
 from copy import deepcopy
+from .ltl_parser import parse_formula, Atomic, Not, And, Or, Eventually
 
-def is_balanced(s, lc='(', rc=')'):
-    is_bal = 0
-    for i in range(len(s))[1:]:
-        is_bal += (s[i] == lc) - (s[i-1] == rc)
-    return is_bal
 
 def build_tree(formula_str, time_lim=None):
-    root = None
-    fstr = formula_str.strip()
-
-    str_r = fstr
-    str_l = None
-    while True:
-        parts = re.split('\|', fstr)
-        if len(parts) == 1:
-            break
-        str_l, str_r = parts[0], '|'.join(parts[1:])
-        if (is_balanced(str_l) == 0):
-            child1 = build_tree(str_l, time_lim)
-            child2 = build_tree(str_r, time_lim)
-            root = OrNode(time_lim, child1, child2)
-            return root
-
-    str_r = fstr
-    str_l = None
-    while True:
-        parts = re.split('&', fstr)
-        if len(parts) == 1:
-            break
-        str_l, str_r = parts[0], '&'.join(parts[1:])
-        if (is_balanced(str_l) == 0):
-            child1 = build_tree(str_l, time_lim)
-            child2 = build_tree(str_r, time_lim)
-            root = AndNode(time_lim, child1, child2)
-            return root
-
-    first_ch = fstr[0]
-    last_ch = fstr[-1]
-    if first_ch == '!':
-        child1 = build_tree(fstr[1:], time_lim)
-        root = NotNode(time_lim, child1)
-    elif first_ch == 'F':
-        child1 = build_tree(fstr[1:], time_lim)
-        root = FNode(time_lim, child1)
-    elif first_ch == 'G':
-        child1 = build_tree(fstr[1:], time_lim)
-        root = GNode(time_lim, child1)
-    elif first_ch == '[':
-        if last_ch == ']':
-            var_id, lb, ub = fstr[1:-1].split(',')
-            lb = int(lb)
-            ub = int(ub)
-            root = AtomicNode(var_id, lb, ub)
-    elif first_ch == '(':
-        if last_ch == ')':
-            root = build_tree(fstr[1:-1], time_lim)
-    if root is not None:
-        return root
+    """Return a tree of nodes that evaluates a formula state by state.
+
+    The formula is parsed with bioagents.tra.ltl_parser. The time limit, if
+    given, applies to the F and G operators that aren't bounded in the
+    formula, and counts time points from the start of the trace. Bounds in
+    the formula, as in F{n}, count time points from where the operator is
+    evaluated, as in bioagents.tra.model_checker.get_truths.
+    """
+    return _build_node(parse_formula(formula_str), time_lim)
+
+
+def _build_node(formula, time_lim):
+    if isinstance(formula, Atomic):
+        return AtomicNode(formula.var_id, formula.lb, formula.ub)
+    elif isinstance(formula, Not):
+        return NotNode(time_lim, _build_node(formula.child, time_lim))
+    elif isinstance(formula, (And, Or)):
+        node_class = AndNode if isinstance(formula, And) else OrNode
+        return node_class(time_lim, _build_node(formula.left, time_lim),
+                          _build_node(formula.right, time_lim))
+    node_class = FNode if isinstance(formula, Eventually) else GNode
+    return node_class(time_lim, _build_node(formula.child, time_lim),
+                      bound=formula.time_lim)
 
 
 class Node(object):
@@ -112,10 +79,46 @@ class Node(object):
                 s += ')'
         return s
 
-class FNode(Node):
+
+class TemporalNode(Node):
+    """A node for F or G, optionally bounded to the next bound + 1 points.
+
+    The truth of a bounded node at a time depends on its child at that time
+    and the following ones, which are the next nodes of its child.
+    """
+    def __init__(self, time_lim=None, child1=None, bound=None):
+        super(TemporalNode, self).__init__(time_lim, child1)
+        self.bound = bound
+
+    def eval_bounded(self, decisive):
+        """Evaluate the child over the window, stopping at a decisive truth.
+
+        Returns decisive if the child has that truth at a point of the
+        window, the other truth if it has it at every point, and None if
+        that isn't known yet.
+        """
+        child = self.child1
+        for _ in range(self.bound + 1):
+            if child is None:
+                return None
+            tf = child.eval_node()
+            if tf is decisive:
+                return decisive
+            if tf is None:
+                return None
+            if child.is_last:
+                break
+            child = child.next_node
+        return not decisive
+
+
+class FNode(TemporalNode):
     def eval_node(self):
         if self.truth is not None:
             return self.truth
+        if self.bound is not None:
+            self.truth = self.eval_bounded(True)
+            return self.truth
         tf = self.child1.eval_node()
         if self.is_last or (self.time_lim is not None and
                             (self.time == self.time_lim)):
@@ -131,10 +134,13 @@ class FNode(Node):
                     self.truth = tfx
         return self.truth
 
-class GNode(Node):
+class GNode(TemporalNode):
     def eval_node(self):
         if self.truth is not None:
             return self.truth
+        if self.bound is not None:
+            self.truth = self.eval_bounded(False)
+            return self.truth
         tf = self.child1.eval_node()
         if self.is_last or (self.time_lim is not None and
                             (self.time == self.time_lim)):
@@ -0,0 +1,198 @@
+"""Parse LTL formulas into immutable syntax trees.
+
+The grammar of formulas, from the lowest to the highest precedence, is
+
+    formula := conjunction ['|' formula]
+    conjunction := unary ['&' conjunction]
+    unary := '!' unary | 'F' [bound] unary | 'G' [bound] unary
+             | '(' formula ')' | atom
+    bound := '{' integer '}'
+    atom := '[' variable ',' lower bound ',' upper bound ']'
+
+e.g. 'F[X,1,1] & FG[X,0,0]'. F (eventually) and G (always) can be bounded
+by a number of time points, so that F{10}[X,1,1] holds if X is 1 at the
+current time point or at one of the next 10.
+
+Syntax trees are made of tuples and are shared: parse_formula returns the
+same tree for the same formula string, so that it is parsed once however
+many traces and checkers it is used by.
+"""
+import re
+from collections import namedtuple
+from bioagents import BioagentException
+from bioagents.cache import LRUCache
+
+
+class InvalidFormulaError(BioagentException):
+    pass
+
+
+class _Formula(tuple):
+    """A base for syntax tree nodes that compare equal only to their type."""
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + tuple(self))
+
+
+class Atomic(_Formula, namedtuple('Atomic', ['var_id', 'lb', 'ub'])):
+    """Holds where the variable is between lb and ub (inclusive)."""
+    __slots__ = ()
+
+
+class Not(_Formula, namedtuple('Not', ['child'])):
+    __slots__ = ()
+
+
+class And(_Formula, namedtuple('And', ['left', 'right'])):
+    __slots__ = ()
+
+
+class Or(_Formula, namedtuple('Or', ['left', 'right'])):
+    __slots__ = ()
+
+
+class Eventually(_Formula, namedtuple('Eventually', ['child', 'time_lim'])):
+    """Holds where the child holds now or later, within time_lim points."""
+    __slots__ = ()
+
+
+class Always(_Formula, namedtuple('Always', ['child', 'time_lim'])):
+    """Holds where the child holds now and later, for time_lim points."""
+    __slots__ = ()
+
+
+_token_pattern = re.compile(r'\s*(?:'
+                            r'(?P<atom>\[[^\[\]]*\])|'
+                            r'(?P<bound>\{\s*\d+\s*\})|'
+                            r'(?P<op>[!&|()FG]))')
+
+
+def tokenize(formula_str):
+    """Return the tokens of a formula as (kind, text, position) tuples.
+
+    The kinds of tokens are atom, bound and op (an operator or
+    parenthesis).
+    """
+    tokens = []
+    pos = 0
+    formula_str = formula_str.rstrip()
+    while pos < len(formula_str):
+        match = _token_pattern.match(formula_str, pos)
+        if match is None:
+            raise InvalidFormulaError('Unexpected character at %d in %s.' %
+                                      (pos, formula_str))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        pos = match.end()
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, formula_str):
+        self.formula_str = formula_str
+        self.tokens = tokenize(formula_str)
+        self.idx = 0
+
+    def parse(self):
+        formula = self.parse_formula()
+        if self.idx < len(self.tokens):
+            self.fail('Unexpected %s' % self.tokens[self.idx][1])
+        return formula
+
+    def peek(self):
+        if self.idx < len(self.tokens):
+            return self.tokens[self.idx]
+        return None, None, len(self.formula_str)
+
+    def accept(self, text):
+        kind, token_text, _ = self.peek()
+        if kind == 'op' and token_text == text:
+            self.idx += 1
+            return True
+        return False
+
+    def fail(self, msg):
+        raise InvalidFormulaError('%s at %d in %s.' %
+                                  (msg, self.peek()[2], self.formula_str))
+
+    def parse_formula(self):
+        left = self.parse_conjunction()
+        if self.accept('|'):
+            return Or(left, self.parse_formula())
+        return left
+
+    def parse_conjunction(self):
+        left = self.parse_unary()
+        if self.accept('&'):
+            return And(left, self.parse_conjunction())
+        return left
+
+    def parse_unary(self):
+        kind, text, _ = self.peek()
+        if kind == 'atom':
+            self.idx += 1
+            return _parse_atom(text, self)
+        if self.accept('!'):
+            return Not(self.parse_unary())
+        for op, node_class in (('F', Eventually), ('G', Always)):
+            if self.accept(op):
+                time_lim = None
+                kind, text, _ = self.peek()
+                if kind == 'bound':
+                    self.idx += 1
+                    time_lim = int(text[1:-1])
+                return node_class(self.parse_unary(), time_lim)
+        if self.accept('('):
+            formula = self.parse_formula()
+            if not self.accept(')'):
+                self.fail('Expected )')
+            return formula
+        self.fail('Expected a formula')
+
+
+def _parse_atom(text, parser):
+    parts = [part.strip() for part in text[1:-1].split(',')]
+    if len(parts) != 3 or not parts[0]:
+        parser.fail('Invalid atom %s' % text)
+    try:
+        lb, ub = (_to_number(part) for part in parts[1:])
+    except ValueError:
+        parser.fail('Invalid bounds in %s' % text)
+    return Atomic(parts[0], lb, ub)
+
+
+def _to_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+_parsed_formulas = LRUCache(max_size=1024)
+
+
+def parse_formula(formula_str):
+    """Return the syntax tree of a formula, parsing it only once.
+
+    Parameters
+    ----------
+    formula_str : str
+        The formula, e.g. 'FG[X,1,1]'.
+
+    Returns
+    -------
+    _Formula
+        The root of the syntax tree of the formula.
+    """
+    formula = _parsed_formulas.get(formula_str)
+    if formula is None:
+        formula = _Parser(formula_str).parse()
+        _parsed_formulas.put(formula_str, formula)
+    return formula
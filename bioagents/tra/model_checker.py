@@ -1,4 +1,21 @@
+"""Check whether simulation traces satisfy LTL formulas.
+
+A formula can be checked on a whole trace at once: the truth of each of
+its subformulas is then computed at every time point of the trace with
+array operations, working back from the end of the trace for the temporal
+operators. Alternatively, states can be given one at a time to update,
+which evaluates a chain of formula trees built as the trace goes on.
+
+BatchChecker checks several formulas on a set of traces in one pass,
+computing each subformula the formulas share (e.g. [X,1,1]) only once.
+
+Formulas are parsed once into syntax trees shared by all checkers (see
+bioagents.tra.ltl_parser).
+"""
+import numpy
 from .ltl_nodes import build_tree
+from .ltl_parser import parse_formula, Atomic, Not, And, Or, Eventually, \
+    Always
 
 
 class ModelChecker(object):
@@ -7,18 +24,12 @@ class ModelChecker(object):
         self.roots = []
         self.time = 0
 
-        root = build_tree(self.formula_str)
-        self.roots.append(root)
-
         if states is not None:
-            # Downsample here for speed
-            states = states[::5]
-            for t, s in enumerate(states):
-                tf = self.update(s, (t == (len(states)-1)))
-                if tf is not None:
-                    break
-            self.truth = tf
+            truths = get_truths(parse_formula(self.formula_str), states)
+            self.truth = bool(truths[0]) if len(truths) else None
         else:
+            # The nodes evaluating the formula state by state in update
+            self.roots.append(build_tree(self.formula_str))
             self.truth = None
 
     def update(self, x, is_last=False):
@@ -32,6 +43,155 @@ class ModelChecker(object):
         return self.truth
 
 
+class BatchChecker(object):
+    """Check a list of formulas on a set of traces at once.
+
+    The traces are stacked into 2-dimensional arrays, so each subformula is
+    evaluated on all of them with one array operation, and subformulas that
+    appear in several formulas are evaluated only once. Traces can have
+    different numbers of time points (e.g. when a simulation stops early),
+    in which case the traces of each length are stacked separately.
+
+    Parameters
+    ----------
+    formula_strs : list[str]
+        The formulas to check.
+    """
+    def __init__(self, formula_strs):
+        self.formula_strs = formula_strs
+        self.roots = [parse_formula(fstr) for fstr in formula_strs]
+
+    def check(self, traces):
+        """Return whether each trace satisfies each formula.
+
+        Parameters
+        ----------
+        traces : list[numpy.ndarray]
+            The traces, e.g. the structured arrays of the observables of
+            simulations.
+
+        Returns
+        -------
+        numpy.ndarray
+            A boolean array with a row for each formula and a column for
+            each trace.
+        """
+        if not len(traces):
+            return numpy.zeros((len(self.roots), 0), dtype=bool)
+        var_ids = set()
+        for root in self.roots:
+            var_ids |= _get_var_ids(root)
+        by_length = {}
+        for idx, trace in enumerate(traces):
+            by_length.setdefault(len(trace), []).append(idx)
+        sats = numpy.zeros((len(self.roots), len(traces)), dtype=bool)
+        for idxs in by_length.values():
+            states = {var_id: numpy.vstack([traces[idx][var_id]
+                                            for idx in idxs])
+                      for var_id in var_ids}
+            memo = {}
+            for row, root in enumerate(self.roots):
+                sats[row, idxs] = get_truths(root, states, memo)[:, 0]
+        return sats
+
+    def get_sat_rates(self, traces):
+        """Return the fraction of the traces satisfying each formula."""
+        return numpy.mean(self.check(traces), axis=1)
+
+
+def get_truths(node, states, memo=None):
+    """Return the truth of a formula at each time point of a trace.
+
+    Parameters
+    ----------
+    node : tuple
+        The root of the syntax tree of the formula, as returned by
+        bioagents.tra.ltl_parser.parse_formula.
+    states : numpy.ndarray or dict
+        The values of the variables at each time point, looked up by the
+        name of the variable, e.g. a structured array of observables. The
+        values of a variable can also be a 2-dimensional array with a trace
+        in each row.
+    memo : Optional[dict]
+        The truths of the subformulas evaluated on the same states so far,
+        keyed by subformula, which are reused and added to.
+
+    Returns
+    -------
+    numpy.ndarray
+        A boolean array, of the shape of the values of the variables, with
+        the truth of the formula from each time point to the end of the
+        trace.
+    """
+    if memo is None:
+        return _get_truths(node, states)
+    truths = memo.get(node)
+    if truths is None:
+        truths = _get_truths(node, states, memo)
+        memo[node] = truths
+    return truths
+
+
+def _get_truths(node, states, memo=None):
+    if isinstance(node, Atomic):
+        values = numpy.asarray(states[node.var_id])
+        truths = numpy.ones(values.shape, dtype=bool)
+        if node.lb is not None:
+            truths &= (values >= node.lb)
+        if node.ub is not None:
+            truths &= (values <= node.ub)
+        return truths
+    elif isinstance(node, Not):
+        return ~get_truths(node.child, states, memo)
+    elif isinstance(node, And):
+        return get_truths(node.left, states, memo) & \
+            get_truths(node.right, states, memo)
+    elif isinstance(node, Or):
+        return get_truths(node.left, states, memo) | \
+            get_truths(node.right, states, memo)
+    elif isinstance(node, (Eventually, Always)):
+        child_truths = get_truths(node.child, states, memo)
+        if node.time_lim is not None:
+            return _reduce_window(child_truths, node.time_lim,
+                                  isinstance(node, Always))
+        # F holds where its child holds at that time or at any later time,
+        # G where its child holds at that time and at all later times
+        ufunc = numpy.logical_and if isinstance(node, Always) else \
+            numpy.logical_or
+        return _accumulate_suffix(ufunc, child_truths)
+    raise ValueError('Cannot evaluate %s.' % (node,))
+
+
+def _get_var_ids(node):
+    """Return the variables a formula refers to."""
+    if isinstance(node, Atomic):
+        return {node.var_id}
+    elif isinstance(node, (And, Or)):
+        return _get_var_ids(node.left) | _get_var_ids(node.right)
+    return _get_var_ids(node.child)
+
+
+def _accumulate_suffix(ufunc, truths):
+    """Reduce each suffix of the traces (along the last axis) with ufunc."""
+    return ufunc.accumulate(truths[..., ::-1], axis=-1)[..., ::-1]
+
+
+def _reduce_window(truths, time_lim, require_all):
+    """Return whether any (or all) of the next time_lim + 1 points hold.
+
+    The windows are cut short at the end of the traces.
+    """
+    num_times = truths.shape[-1]
+    counts = numpy.zeros(truths.shape[:-1] + (num_times + 1,), dtype=int)
+    numpy.cumsum(truths, axis=-1, out=counts[..., 1:])
+    starts = numpy.arange(num_times)
+    ends = numpy.minimum(starts + time_lim + 1, num_times)
+    num_true = counts[..., ends] - counts[..., starts]
+    if require_all:
+        return num_true == ends - starts
+    return num_true > 0
+
+
 def transient_formula(var_id):
     fstr = 'F[%s,1,1] & FG([%s,0,0])' % (var_id, var_id)
     return fstr
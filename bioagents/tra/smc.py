@@ -0,0 +1,115 @@
+"""Statistical model checking of temporal properties from simulations.
+
+Whether a stochastic model satisfies a property is estimated from the
+fraction of its simulations that satisfy it. Rather than running a fixed
+number of simulations, SequentialTest decides, one simulation at a time,
+whether the probability of satisfying the property is above or below a
+threshold, using Wald's sequential probability ratio test (SPRT). When the
+answer is clear, few simulations are needed, and more are run only when the
+probability is close to the threshold.
+
+The estimate of the probability is given with a Wilson score interval.
+"""
+import math
+from bioagents.lazy import lazy_import
+
+
+stats = lazy_import('scipy.stats')
+
+
+class SequentialTest(object):
+    """Decide if the probability of satisfying a property reaches a threshold.
+
+    The test is between the hypotheses that the probability is at least
+    threshold + indifference and that it is at most threshold -
+    indifference. Probabilities in between may be decided either way.
+
+    Parameters
+    ----------
+    threshold : float
+        The probability the test is about.
+    indifference : Optional[float]
+        The half-width of the region around the threshold within which
+        either decision is acceptable. Default: 0.1
+    alpha : Optional[float]
+        The probability of deciding that the probability is below the
+        threshold when it is above it. Default: 0.05
+    beta : Optional[float]
+        The probability of deciding that the probability is above the
+        threshold when it is below it. Default: 0.05
+    """
+    def __init__(self, threshold, indifference=0.1, alpha=0.05, beta=0.05):
+        self.threshold = threshold
+        # The probabilities of the two hypotheses are kept strictly between
+        # 0 and 1 so that a single outcome can't decide the test.
+        self.p_above = min(threshold + indifference, 1 - 1e-6)
+        self.p_below = max(threshold - indifference, 1e-6)
+        self.log_below_bound = math.log((1 - beta) / alpha)
+        self.log_above_bound = math.log(beta / (1 - alpha))
+        self.num_samples = 0
+        self.num_satisfied = 0
+        self.log_ratio = 0.0
+        self.decision = None
+
+    def add(self, satisfied):
+        """Add the outcome of a simulation and return the decision.
+
+        Returns
+        -------
+        bool or None
+            True if the probability was decided to be at least the
+            threshold, False if it was decided to be below it and None if
+            more simulations are needed.
+        """
+        self.num_samples += 1
+        if satisfied:
+            self.num_satisfied += 1
+            self.log_ratio += math.log(self.p_below / self.p_above)
+        else:
+            self.log_ratio += math.log((1 - self.p_below) /
+                                       (1 - self.p_above))
+        if self.decision is None:
+            if self.log_ratio >= self.log_below_bound:
+                self.decision = False
+            elif self.log_ratio <= self.log_above_bound:
+                self.decision = True
+        return self.decision
+
+    @property
+    def rate(self):
+        if not self.num_samples:
+            return None
+        return self.num_satisfied / (1.0 * self.num_samples)
+
+
+def get_confidence_interval(num_satisfied, num_samples, confidence=0.95):
+    """Return the Wilson score interval of a probability.
+
+    Parameters
+    ----------
+    num_satisfied : int
+        The number of simulations satisfying the property.
+    num_samples : int
+        The number of simulations.
+    confidence : Optional[float]
+        The confidence level of the interval. Default: 0.95
+
+    Returns
+    -------
+    tuple(float, float)
+        The lower and upper bounds of the interval.
+    """
+    if not num_samples:
+        return 0.0, 1.0
+    z = float(stats.norm.ppf(0.5 + confidence / 2.0))
+    rate = num_satisfied / (1.0 * num_samples)
+    denominator = 1 + z**2 / num_samples
+    center = (rate + z**2 / (2.0 * num_samples)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / num_samples +
+                               z**2 / (4.0 * num_samples**2)) / denominator
+    # The interval reaches 0 or 1 exactly when none or all of the
+    # simulations satisfy the property, which rounding can miss.
+    low = 0.0 if num_satisfied == 0 else max(center - half_width, 0.0)
+    high = 1.0 if num_satisfied == num_samples else \
+        min(center + half_width, 1.0)
+    return low, high
@@ -9,37 +9,69 @@ __all__ = ['TRA', 'get_ltl_from_pattern', 'apply_condition',
            'InvalidMolecularQuantityRefError', 'SimulatorError']
 import os
 import numpy
+import hashlib
 import logging
+import threading
 from time import sleep
 from copy import deepcopy
-import sympy.physics.units as units
 import indra.statements as ist
 import indra.assemblers.pysb.assembler as pa
-from indra.assemblers.english import assembler as english_assembler
-from pysb import Observable
-from pysb.integrate import Solver
-from pysb.export.kappa import KappaExporter
+from pysb import Observable, Parameter
 import bioagents.tra.model_checker as mc
-import matplotlib
 from bioagents import BioagentException
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from bioagents.cache import LRUCache
+from bioagents.deadline import DeadlineExceeded, check_deadline, \
+    deadline_reached
+from bioagents.lazy import lazy_import
+from bioagents.process_pool import map_in_pool, get_process_pool
+from bioagents.tra.smc import SequentialTest, get_confidence_interval
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# These are only needed to simulate and plot, so they are imported when
+# first used rather than when the agent starts.
+units = lazy_import('sympy.physics.units')
+english_assembler = lazy_import('indra.assemblers.english.assembler')
+pysb_integrate = lazy_import('pysb.integrate')
+kappa_export = lazy_import('pysb.export.kappa')
+plt = lazy_import('matplotlib.pyplot', setup=_use_agg)
+patches = lazy_import('matplotlib.patches', setup=_use_agg)
 
 
 logger = logging.getLogger('TRA')
 
 
 class TRA(object):
-    def __init__(self, use_kappa=True, use_kappa_rest=False):
+    """Check temporal properties of models by simulating them.
+
+    The simulations of an ensemble run in the shared process pool, if it
+    has been started (see bioagents.process_pool), each with a seed of its
+    own drawn from a random number generator seeded with `seed`.
+
+    A property is checked on `num_sim` simulations, unless a confidence is
+    asked for, in which case up to `max_sim` simulations are run to decide
+    whether the property holds with a probability of at least
+    `suggestion_threshold`. Below that, another pattern is suggested.
+    """
+    num_sim = 2
+    max_sim = 50
+    suggestion_threshold = 0.3
+
+    def __init__(self, use_kappa=True, use_kappa_rest=False, seed=None):
         kappa_mode_label = 'rest' if use_kappa_rest else 'standard'
+        self.use_kappa_rest = use_kappa_rest
+        self.random_state = numpy.random.RandomState(seed)
         if not use_kappa:
             self.ode_mode = True
             logger.info('Using ODE mode in TRA.')
         else:
             self.ode_mode = False
             try:
-                self.kappa = kappa_client.KappaRuntime('TRA_simulations',
-                                                       use_rest=use_kappa_rest)
+                self.kappa = get_kappa_runtime(use_kappa_rest)
                 logger.info('Using kappa %s.' % kappa_mode_label)
             except Exception as e:
                 logger.error('Could not use kappa %s.' % kappa_mode_label)
@@ -47,10 +79,29 @@ class TRA(object):
                 self.ode_mode = True
         return
 
-    def check_property(self, model, pattern, conditions=None):
+    def check_property(self, model, pattern, conditions=None,
+                       confidence=None, max_sim=None):
+        """Check how often simulations of a model satisfy a pattern.
+
+        By default, `num_sim` simulations are run. If a confidence is
+        given, simulations are instead run until a sequential test decides
+        at that confidence whether the probability of satisfying the
+        pattern is at least `suggestion_threshold`, or until max_sim
+        simulations have been run (see bioagents.tra.smc). If the pattern
+        is unlikely to be satisfied, or no pattern is given, a pattern
+        that the simulations do satisfy is suggested.
+
+        Returns
+        -------
+        tuple
+            The rate at which the simulations satisfy the pattern, the
+            number of simulations, the suggested pattern (or None), the
+            path of the plot of the simulations and the confidence
+            interval of the rate, as a tuple of its bounds.
+        """
         # TODO: handle multiple entities (observables) in pattern
         # TODO: set max_time based on some model property if not given
-        # TODO: make number of simulations and number of time points adaptive
+        # TODO: make the number of time points adaptive
 
         # Make an observable for the simulations
         logger.info('Trying to make an observable for: %s',
@@ -76,33 +127,81 @@ class TRA(object):
         else:
             min_time_idx = 0
 
-        # The number of independent simulations to perform
-        num_sim = 2
-        # Run simulations
-        results = self.run_simulations(model, conditions, num_sim,
-                                       min_time_idx, max_time,
-                                       plot_period)
-
-        results_copy = deepcopy(results)
-        yobs_list = [yobs for _, yobs in results]
+        def run(num_sim):
+            return self.run_simulations(model, conditions, num_sim,
+                                        min_time_idx, max_time, plot_period)
 
-        # Discretize observations
-        # WARNING: yobs is changed by discretize_obs in place
-        thresholds = [self.discretize_obs(model, yobs, obs.name)
-                      for yobs in yobs_list]
-
-        fig_path = self.plot_results(results_copy, pattern.entities[0],
+        if confidence is not None and given_pattern:
+            test = SequentialTest(self.suggestion_threshold,
+                                  alpha=1 - confidence, beta=1 - confidence)
+            results = []
+        else:
+            test = None
+            results = run(self.num_sim)
+        if confidence is None:
+            confidence = 0.95
+        # The discretized observables, which the patterns are checked on
+        yobs_list = []
+        thresholds = []
+        for _, yobs in results:
+            yobs_list.append(deepcopy(yobs))
+            thresholds.append(self.discretize_obs(model, yobs_list[-1],
+                                                  obs.name))
+        if test is not None:
+            # ODE simulations are deterministic so one is enough
+            max_sim = 1 if self.ode_mode else (max_sim or self.max_sim)
+            pool = get_process_pool()
+            batch_size = pool.num_workers if pool is not None else 1
+            while test.decision is None and len(results) < max_sim:
+                # If the request is out of time, we go on with the
+                # simulations that are done
+                if results and deadline_reached():
+                    break
+                # All the simulations of a batch are used, even if the test
+                # is decided before the last one
+                for result in run(min(batch_size, max_sim - len(results))):
+                    results.append(result)
+                    yobs_list.append(deepcopy(result[1]))
+                    thresholds.append(self.discretize_obs(
+                        model, yobs_list[-1], obs.name))
+                    MC = mc.ModelChecker(fstr, yobs_list[-1])
+                    logger.info('Main property %s' % MC.truth)
+                    test.add(MC.truth)
+            logger.info('Sequential test %s after %d simulations.' %
+                        ('undecided' if test.decision is None else
+                         'decided %s' % test.decision, test.num_samples))
+        # Fewer simulations are run if the request runs out of time
+        num_sim = len(results)
+
+        def get_interval(num_satisfied):
+            # The outcome of deterministic simulations is certain
+            if self.ode_mode:
+                rate = num_satisfied / (1.0*num_sim)
+                return rate, rate
+            return get_confidence_interval(num_satisfied, num_sim,
+                                           confidence)
+
+        fig_path = self.plot_results(results, pattern.entities[0],
                                      obs.name, thresholds[0])
         # We check for the given pattern
         if given_pattern:
-            truths = []
-            for yobs in yobs_list:
-                # Run model checker on the given pattern
-                MC = mc.ModelChecker(fstr, yobs)
-                logger.info('Main property %s' % MC.truth)
-                truths.append(MC.truth)
-            sat_rate = numpy.count_nonzero(truths) / (1.0*num_sim)
-            make_suggestion = (sat_rate < 0.3)
+            if test is not None:
+                num_satisfied = test.num_satisfied
+                make_suggestion = test.decision is False or \
+                    (test.decision is None and
+                     test.rate < self.suggestion_threshold)
+            else:
+                truths = []
+                for yobs in yobs_list:
+                    # Run model checker on the given pattern
+                    MC = mc.ModelChecker(fstr, yobs)
+                    logger.info('Main property %s' % MC.truth)
+                    truths.append(MC.truth)
+                num_satisfied = numpy.count_nonzero(truths)
+                make_suggestion = (num_satisfied / (1.0*num_sim) <
+                                   self.suggestion_threshold)
+            sat_rate = num_satisfied / (1.0*num_sim)
+            interval = get_interval(num_satisfied)
             if make_suggestion:
                 logger.info('MAKING SUGGESTION with sat rate %.2f.' % sat_rate)
         else:
@@ -110,39 +209,45 @@ class TRA(object):
 
         # If no suggestion is to be made, we return
         if not make_suggestion:
-            return sat_rate, num_sim, None, fig_path
+            return sat_rate, num_sim, None, fig_path, interval
 
-        # Run model checker on all patterns
+        # If the request is out of time, we return without a suggestion
+        if given_pattern and deadline_reached():
+            return sat_rate, num_sim, None, fig_path, interval
+        check_deadline()
+        # Run model checker on all patterns and simulations at once
         all_patterns = get_all_patterns(obs.name)
-        for fs, pat in all_patterns:
-            logger.info('Testing pattern: %s' % pat)
-            truths = []
-            for yobs in yobs_list:
-                MC = mc.ModelChecker(fs, yobs)
-                logger.info('Property %s' % MC.truth)
-                truths.append(MC.truth)
-            sat_rate_new = numpy.count_nonzero(truths) / (1.0*num_sim)
+        checker = mc.BatchChecker([fs for fs, _ in all_patterns])
+        all_truths = checker.check(yobs_list)
+        for (fs, pat), truths in zip(all_patterns, all_truths):
+            num_satisfied_new = numpy.count_nonzero(truths)
+            sat_rate_new = num_satisfied_new / (1.0*num_sim)
+            logger.info('Pattern %s satisfied at rate %.2f' %
+                        (pat, sat_rate_new))
             if sat_rate_new > 0.5:
                 if not given_pattern:
-                    return sat_rate_new, num_sim, pat, fig_path
+                    return sat_rate_new, num_sim, pat, fig_path, \
+                        get_interval(num_satisfied_new)
                 else:
-                    return sat_rate, num_sim, pat, fig_path
+                    return sat_rate, num_sim, pat, fig_path, interval
 
     def compare_conditions(self, model, condition_agent, target_agent):
         obs = get_create_observable(model, target_agent)
         cond_quant = MolecularQuantityReference('total', condition_agent)
-        all_results = []
         time_ul = 10000
         nt = 101
         plot_period = time_ul / (nt - 1)
         ts = numpy.linspace(0, time_ul, nt)
         mults = [0.0, 100.0]
+        # The simulations under each condition run in parallel
+        jobs = []
         for mult in mults:
             condition = MolecularCondition('multiple', cond_quant, mult)
-            results = self.run_simulations(model, [condition], 1, 0,
-                                           time_ul, plot_period)
-            obs_values = results[0][1][obs.name]
-            all_results.append(obs_values)
+            model_sim = self._condition_model(model, [condition])
+            jobs += self._get_simulation_jobs(model_sim, 1, time_ul,
+                                              plot_period)
+        results = map_in_pool(simulate_model, jobs)
+        all_results = [yobs[obs.name] for _, yobs in results]
         # Plotting
         fig_path = self.plot_compare_conditions(ts, all_results, target_agent,
                                                 obs.name)
@@ -176,11 +281,10 @@ class TRA(object):
         max_val_lim = max(max(numpy.max(results[0][1][obs_name]), 101.0),
                           thresh)
         max_time = max([result[0][-1] for result in results])
-        lr = matplotlib.patches.Rectangle((0, 0), max_time, thresh, color='red',
-                                          alpha=0.1)
-        hr = matplotlib.patches.Rectangle((0, thresh), max_time,
-                                          max_val_lim-thresh,
-                                          color='green', alpha=0.1)
+        lr = patches.Rectangle((0, 0), max_time, thresh, color='red',
+                               alpha=0.1)
+        hr = patches.Rectangle((0, thresh), max_time, max_val_lim-thresh,
+                               color='green', alpha=0.1)
         ax = plt.gca()
         ax.add_patch(lr)
         ax.add_patch(hr)
@@ -202,37 +306,47 @@ class TRA(object):
 
     def run_simulations(self, model, conditions, num_sim, min_time_idx,
                         max_time, plot_period):
-        self.sol = None
+        """Run an ensemble of simulations of a model under given conditions.
+
+        The model is conditioned once for the whole ensemble. Stochastic
+        simulations run in parallel in the process pool if it is started,
+        and their results are returned in the order of their seeds. If the
+        request runs out of time, the simulations done by then are
+        returned. ODE simulations are deterministic, so only one is run
+        and its result is used for the whole ensemble.
+        """
+        model_sim = self._condition_model(model, conditions)
+        jobs = self._get_simulation_jobs(model_sim, num_sim, max_time,
+                                         plot_period)
+        logger.info('Starting %d simulations' % len(jobs))
+        sim_results = map_in_pool(simulate_model, jobs, partial=True)
+        if self.ode_mode:
+            sim_results += [deepcopy(sim_results[0])
+                            for _ in range(num_sim - 1)]
         results = []
-        for i in range(num_sim):
-            # Apply molecular condition to model
-            try:
-                model_sim = self.condition_model(model, conditions)
-            except MissingMonomerError:
-                raise MissingMonomerError
-            except Exception as e:
-                logger.exception(e)
-                msg = 'Applying molecular condition failed.'
-                raise InvalidMolecularConditionError(msg)
-            # Run a simulation
-            logger.info('Starting simulation %d' % (i+1))
-            if not self.ode_mode:
-                try:
-                    tspan, yobs = self.simulate_kappa(model_sim, max_time,
-                                                      plot_period)
-                except Exception as e:
-                    logger.exception(e)
-                    raise SimulatorError('Kappa simulation failed.')
-            else:
-                tspan, yobs = self.simulate_odes(model_sim, max_time,
-                                                 plot_period)
-            # Get and plot observable
+        for tspan, yobs in sim_results:
             start_idx = min(min_time_idx, len(yobs))
-            yobs_from_min = yobs[start_idx:]
-            tspan = tspan[start_idx:]
-            results.append((tspan, yobs_from_min))
+            results.append((tspan[start_idx:], yobs[start_idx:]))
         return results
 
+    def _get_simulation_jobs(self, model_sim, num_sim, max_time, plot_period):
+        """Return the arguments of simulate_model for an ensemble."""
+        if self.ode_mode:
+            return [(model_sim, max_time, plot_period)]
+        seeds = self.random_state.randint(1, 2**31 - 1, size=num_sim)
+        return [(model_sim, max_time, plot_period, int(seed), True,
+                 self.use_kappa_rest) for seed in seeds]
+
+    def _condition_model(self, model, conditions):
+        try:
+            return self.condition_model(model, conditions)
+        except MissingMonomerError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+            msg = 'Applying molecular condition failed.'
+            raise InvalidMolecularConditionError(msg)
+
     def discretize_obs(self, model, yobs, obs_name):
         # TODO: This needs to be done in a model/observable-dependent way
         default_total_val = 100
@@ -260,35 +374,122 @@ class TRA(object):
             model_sim = model
         return model_sim
 
-    def simulate_kappa(self, model_sim, max_time, plot_period):
-        # Export kappa model
-        kappa_model = pysb_to_kappa(model_sim)
-        # Start simulation
-        self.kappa.compile(code_list=[kappa_model])
-        self.kappa.start_sim(plot_period=plot_period,
-                         pause_condition="[T] > %d" % max_time)
-        while True:
-            sleep(0.2)
-            status_json = self.kappa.sim_status()
-            is_running = status_json.get('simulation_progress_is_running')
-            if not is_running:
-                break
-            else:
-                if status_json.get('time_percentage') is not None:
-                    logger.info(
-                        'Sim time percentage: %d' %
-                        status_json.get('simulation_progress_time_percentage')
-                        )
-        tspan, yobs = get_sim_result(self.kappa.sim_plot())
-        self.kappa.reset_project()
-        return tspan, yobs
-
-    def simulate_odes(self, model_sim, max_time, plot_period):
-        ts = numpy.linspace(0, max_time, int(1.0*max_time/plot_period) + 1)
-        if self.sol is None:
-            self.sol = Solver(model_sim, ts)
-        self.sol.run()
-        return ts, self.sol.yobs
+
+def simulate_model(model_sim, max_time, plot_period, seed=None,
+                   use_kappa=False, use_kappa_rest=False):
+    """Run a simulation of a model and return its time points and observables.
+
+    This is called in the workers of the process pool if it is started.
+    Each process keeps the simulators of the models it simulated last, so
+    that the simulations of an ensemble only compile their model once per
+    process.
+
+    Parameters
+    ----------
+    model_sim : pysb.Model
+        The model to simulate, with its conditions applied.
+    max_time : float
+        The number of seconds to simulate.
+    plot_period : float
+        The number of seconds between time points.
+    seed : Optional[int]
+        The seed of a stochastic simulation.
+    use_kappa : Optional[bool]
+        If True, the model is simulated stochastically with Kappa, otherwise
+        its ODEs are integrated. Default: False
+    use_kappa_rest : Optional[bool]
+        If True, the Kappa simulation runs on a Kappa REST service.
+        Default: False
+    """
+    if not use_kappa:
+        return simulate_odes(model_sim, max_time, plot_period)
+    try:
+        return simulate_kappa(model_sim, max_time, plot_period, seed,
+                              use_kappa_rest)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise SimulatorError('Kappa simulation failed.')
+
+
+# The Kappa runtimes of this process and the Kappa model compiled in each
+_kappa_runtimes = {}
+_kappa_models = {}
+_kappa_lock = threading.RLock()
+
+
+def get_kappa_runtime(use_rest=False):
+    """Return the Kappa runtime of this process, creating it if needed."""
+    with _kappa_lock:
+        kappa = _kappa_runtimes.get(use_rest)
+        if kappa is None:
+            kappa = kappa_client.KappaRuntime('TRA_simulations_%d' %
+                                              os.getpid(), use_rest=use_rest)
+            _kappa_runtimes[use_rest] = kappa
+        return kappa
+
+
+def simulate_kappa(model_sim, max_time, plot_period, seed=None,
+                   use_rest=False):
+    kappa_model = pysb_to_kappa(model_sim)
+    # A Kappa runtime runs one simulation at a time
+    with _kappa_lock:
+        kappa = get_kappa_runtime(use_rest)
+        if _kappa_models.get(use_rest) != kappa_model:
+            if _kappa_models.pop(use_rest, None) is not None:
+                kappa.reset_project()
+            kappa.compile(code_list=[kappa_model])
+            _kappa_models[use_rest] = kappa_model
+        try:
+            kappa.start_sim(plot_period=plot_period,
+                            pause_condition="[T] > %d" % max_time,
+                            seed=seed)
+            while True:
+                sleep(0.2)
+                check_deadline()
+                status_json = kappa.sim_status()
+                is_running = status_json.get('simulation_progress_is_running')
+                if not is_running:
+                    break
+                else:
+                    if status_json.get('time_percentage') is not None:
+                        logger.info(
+                            'Sim time percentage: %d' %
+                            status_json.get(
+                                'simulation_progress_time_percentage')
+                            )
+            return get_sim_result(kappa.sim_plot())
+        finally:
+            # The compiled model is kept for the next simulation
+            kappa.delete_sim()
+
+
+# The ODE solvers of this process, keyed by the structure of their model
+# and their time points, which can be reused for any parameter values
+_ode_solvers = LRUCache(max_size=8)
+_ode_lock = threading.Lock()
+
+
+def simulate_odes(model_sim, max_time, plot_period):
+    ts = numpy.linspace(0, max_time, int(1.0*max_time/plot_period) + 1)
+    key = (_get_model_structure_key(model_sim), max_time, len(ts))
+    with _ode_lock:
+        solver = _ode_solvers.get(key)
+        if solver is None:
+            solver = pysb_integrate.Solver(model_sim, ts)
+            _ode_solvers.put(key, solver)
+        solver.run(param_values=[p.value for p in model_sim.parameters])
+        return ts, solver.yobs.copy()
+
+
+def _get_model_structure_key(model):
+    """Return a key for a model which doesn't depend on parameter values."""
+    parts = [repr(component) for component in model.all_components()
+             if not isinstance(component, Parameter)]
+    parts += [repr(initial) for initial in model.initials]
+    parts += [parameter.name for parameter in model.parameters]
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
 
 
 def get_ltl_from_pattern(pattern, obs):
@@ -399,7 +600,7 @@ def get_create_observable(model, agent):
 
 
 def pysb_to_kappa(model):
-    ke = KappaExporter(model)
+    ke = kappa_export.KappaExporter(model)
     kappa_model = ke.export()
     return kappa_model
 
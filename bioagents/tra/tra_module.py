@@ -6,9 +6,13 @@ from indra.assemblers.pysb import assembler as pysb_assembler
 from indra.assemblers.pysb import PysbAssembler
 from indra.statements import stmts_from_json, Activation, Inhibition, \
     ActiveForm
-from indra.sources.trips import processor as trips_processor
 from bioagents.tra import tra
 from bioagents import Bioagent, BioagentException
+from bioagents.deadline import DeadlineExceeded
+from bioagents.ekb import resolve_ekb
+from bioagents.process_pool import run_in_pool
+from bioagents.model_registry import get_model_registry
+from bioagents.warmup import ekb_kstring, stmts_kstring
 
 # This version of logging is coming from tra...
 logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
@@ -30,6 +34,9 @@ def get_bool_arg(arg_name, kwargs, default=True):
 class TRA_Module(Bioagent):
     name = "TRA"
     tasks = ['SATISFIES-PATTERN', 'MODEL-COMPARE-CONDITIONS']
+    # Simulations are stochastic so they aren't cached, but duplicate
+    # requests can share the results of one
+    coalesced_tasks = tasks
 
     def __init__(self, **kwargs):
         use_kappa = get_bool_arg('use_kappa', kwargs, default=False)
@@ -42,15 +49,34 @@ class TRA_Module(Bioagent):
         self.tra = tra.TRA(use_kappa, use_kappa_rest)
         return super(TRA_Module, self).__init__(**kwargs)
 
+    def get_warmup_requests(self):
+        entity = ekb_kstring('ERK that is phosphorylated')
+        pattern = KQMLList()
+        pattern.set('entities', KQMLList([KQMLList([':description',
+                                                     entity])]))
+        pattern.sets('type', 'eventual_value')
+        value = KQMLList()
+        value.sets('type', 'qualitative')
+        value.sets('value', 'high')
+        pattern.set('value', value)
+        content = KQMLList('SATISFIES-PATTERN')
+        content.set('pattern', pattern)
+        content.set('model', stmts_kstring('MEK phosphorylates ERK'))
+        return [content]
+
     def respond_satisfies_pattern(self, content):
         """Return response content to satisfies-pattern request."""
-        model_indra_str = content.gets('model')
         pattern_lst = content.get('pattern')
         conditions_lst = content.get('conditions')
 
         try:
-            stmts = decode_indra_stmts(model_indra_str)
-            model = assemble_model(stmts)
+            model = get_model(content)
+        except UnknownModelError as e:
+            logger.exception(e)
+            reply_content = self.make_failure('UNKNOWN_MODEL')
+            return reply_content
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception(e)
             reply_content = self.make_failure('INVALID_MODEL')
@@ -79,14 +105,34 @@ class TRA_Module(Bioagent):
                 for condition_lst in conditions_lst:
                     condition = get_molecular_condition(condition_lst)
                     conditions.append(condition)
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.exception(e)
                 reply_content = self.make_failure('INVALID_CONDITIONS')
                 return reply_content
 
+        # With a confidence, simulations are run until it is reached
         try:
-            sat_rate, num_sim, suggestion, fig_path = \
-                self.tra.check_property(model, pattern, conditions)
+            confidence = content.gets('confidence')
+            if confidence is not None:
+                confidence = float(confidence)
+                if not 0.5 <= confidence < 1:
+                    raise ValueError('Confidence not in [0.5, 1).')
+            max_sim = content.gets('max-simulations')
+            if max_sim is not None:
+                max_sim = int(max_sim)
+                if max_sim < 1:
+                    raise ValueError('No simulations allowed.')
+        except ValueError as e:
+            logger.exception(e)
+            reply_content = self.make_failure('INVALID_CONFIDENCE')
+            return reply_content
+
+        try:
+            sat_rate, num_sim, suggestion, fig_path, interval = \
+                self.tra.check_property(model, pattern, conditions,
+                                        confidence, max_sim)
         except tra.MissingMonomerError as e:
             logger.exception(e)
             reply_content = self.make_failure('MODEL_MISSING_MONOMER')
@@ -99,6 +145,8 @@ class TRA_Module(Bioagent):
             logger.exception(e)
             reply_content = self.make_failure('KAPPA_FAILURE')
             return reply_content
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception(e)
             reply_content = self.make_failure('INVALID_PATTERN')
@@ -110,6 +158,9 @@ class TRA_Module(Bioagent):
         content = KQMLList()
         content.set('satisfies-rate', '%.1f' % sat_rate)
         content.set('num-sim', '%d' % num_sim)
+        content.set('confidence-interval',
+                    KQMLList(['%.2f' % bound for bound in interval]))
+        content.set('confidence', '%.2f' % (confidence or 0.95))
         if suggestion:
             sugg = KQMLList.from_string(suggestion)
             content.set('suggestion', sugg)
@@ -119,10 +170,14 @@ class TRA_Module(Bioagent):
     def respond_model_compare_conditions(self, content):
         condition_agent_ekb = content.gets('agent')
         target_agent_ekb = content.gets('affected')
-        model_indra_str = content.gets('model')
         try:
-            stmts = decode_indra_stmts(model_indra_str)
-            model = assemble_model(stmts)
+            model = get_model(content)
+        except UnknownModelError as e:
+            logger.exception(e)
+            reply_content = self.make_failure('UNKNOWN_MODEL')
+            return reply_content
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception(e)
             reply_content = self.make_failure('INVALID_MODEL')
@@ -130,6 +185,8 @@ class TRA_Module(Bioagent):
         try:
             condition_agent = get_single_molecular_entity(condition_agent_ekb)
             target_agent = get_single_molecular_entity(target_agent_ekb)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception(e)
             reply_content = self.make_failure('INVALID_PATTERN')
@@ -173,6 +230,30 @@ def decode_indra_stmts(stmts_json_str):
     return stmts
 
 
+def get_model(content):
+    """Return the PySB model a request is about.
+
+    The model is given either as INDRA JSON in :model, or by its hash in
+    :model-hash if it is in the model registry. Models are only assembled
+    the first time they are seen.
+    """
+    registry = get_model_registry()
+    model_hash = content.gets('model-hash')
+    if model_hash is None or not registry.has_model(model_hash):
+        model_indra_str = content.gets('model')
+        if model_indra_str is None:
+            raise UnknownModelError('Model %s is not registered.' %
+                                    model_hash)
+        stmts_json = json.loads(model_indra_str)
+        stmts = stmts_from_json(stmts_json)
+        model_hash = registry.register(stmts, stmts_json, model_indra_str)
+    return registry.get_assembled(model_hash, 'tra', _assemble_in_pool)
+
+
+def _assemble_in_pool(stmts):
+    return run_in_pool(assemble_model, stmts)
+
+
 def assemble_model(stmts):
     pa = PysbAssembler(policies='one_step')
     pa.add_statements(stmts)
@@ -259,26 +340,18 @@ def get_molecular_entity(lst):
 
 def get_single_molecular_entity(description_str):
     try:
-        tp = trips_processor.TripsProcessor(description_str)
-        terms = tp.tree.findall('TERM')
-        def find_complex(terms):
-            cplx = None
-            for term in terms:
-                term_type = term.find('type')
-                if term_type is not None and \
-                    term_type.text == 'ONT::MACROMOLECULAR-COMPLEX':
-                    cplx = term.attrib.get('id')
-                    break
-            return cplx
-        cplx_id = find_complex(terms)
+        ekb = resolve_ekb(description_str)
+        cplx_id = ekb.get_complex_id()
         if not cplx_id:
-            term_id = terms[0].attrib['id']
+            term_id = ekb.term_ids[0]
             logger.info('Using ID of term: %s' % term_id)
         else:
             logger.info('Using ID of complex: %s' % cplx_id)
             term_id = cplx_id
-        agent = tp._get_agent_by_id(term_id, None)
+        agent = ekb.get_agent(term_id)
         return agent
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise tra.InvalidMolecularEntityError(e)
 
@@ -360,5 +433,9 @@ class InvalidModelDescriptionError(BioagentException):
     pass
 
 
+class UnknownModelError(BioagentException):
+    pass
+
+
 if __name__ == "__main__":
     m = TRA_Module(argv=sys.argv[1:])
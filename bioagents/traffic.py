@@ -0,0 +1,182 @@
+"""Record the requests an agent handles and replay them as a load test.
+
+Traffic is recorded in the format of the integration test scripts in
+integration/*.in: each request content is on a line of its own, followed by
+a line with the content of the reply, with newlines escaped as \\n. Recorded
+files and the integration scripts can be replayed against any Bioagent
+subclass running in testing mode, so no Facilitator or TRIPS system is
+needed. Requests are sent from a number of threads at a given rate, and the
+latency and throughput of each task are reported.
+
+Example:
+
+    python scripts/replay_traffic.py DTDA integration/test_dtda.in \\
+        --concurrency 4 --rate 20 --repeats 10
+"""
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from kqml import KQMLPerformative, KQMLList
+from bioagents.stats import RollingHistogram
+
+
+logger = logging.getLogger('Bioagents')
+
+
+class TrafficRecorder(object):
+    """Append request and reply contents to a file as they are handled.
+
+    Parameters
+    ----------
+    fname : str
+        The path of the file to append the traffic to.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+
+    def record(self, request_content, reply_content):
+        if request_content is None:
+            return
+        lines = [_to_line(request_content), _to_line(reply_content)]
+        with self._lock:
+            with open(self.fname, 'a') as fh:
+                fh.write('\n'.join(lines) + '\n')
+
+
+def _to_line(content):
+    return content.to_string().replace('\n', '\\n')
+
+
+def read_traffic(fname):
+    """Return a list of (request, expected reply) content strings.
+
+    Parameters
+    ----------
+    fname : str
+        The path of a recorded traffic file or an integration test script.
+    """
+    with open(fname, 'r') as fh:
+        lines = [line.strip() for line in fh if line.strip()]
+    requests = [line.replace('\\n', '\n') for line in lines[0::2]]
+    return list(zip(requests, lines[1::2]))
+
+
+def replay(agent, requests, concurrency=1, rate=None, repeats=1):
+    """Send requests to an agent and measure how long each takes.
+
+    Parameters
+    ----------
+    agent : bioagents.Bioagent
+        An agent in testing mode. Requests go through its dispatcher, so
+        they are handled as they would be from the Facilitator: requests
+        sent at the same time are only handled in parallel by an agent with
+        worker pools (see bioagents.executor).
+    requests : list[str]
+        The contents of the requests to send.
+    concurrency : Optional[int]
+        The number of requests sent at the same time. Default: 1
+    rate : Optional[float]
+        The number of requests started per second. If None, a request is
+        started as soon as a thread is available. Default: None
+    repeats : Optional[int]
+        The number of times the list of requests is sent. Default: 1
+
+    Returns
+    -------
+    dict
+        The latency histogram (bioagents.stats.RollingHistogram) of each
+        task, with the key 'TOTAL' for all requests, and the duration of the
+        replay in seconds under the key 'duration'.
+    """
+    all_requests = list(requests) * repeats
+    histograms = {'TOTAL': RollingHistogram(len(all_requests))}
+    lock = threading.Lock()
+
+    def send_request(msg_id, content_str):
+        msg = KQMLPerformative.from_string(
+            '(request :reply-with IO-%d :content %s)' % (msg_id, content_str))
+        # Addressed to the agent, so that it also answers built-in tasks
+        msg.set('receiver', agent.name)
+        content = msg.get('content')
+        task = content.head().upper() if isinstance(content, KQMLList) \
+            else 'UNKNOWN'
+        start = time.time()
+        try:
+            handled = agent.dispatcher.dispatch_message(msg)
+            # A RequestDispatcher hands the request to a worker thread
+            if isinstance(handled, Future):
+                handled.result()
+        except Exception as e:
+            logger.error('Request %d raised an exception.' % msg_id)
+            logger.exception(e)
+        latency = time.time() - start
+        with lock:
+            hist = histograms.get(task)
+            if hist is None:
+                hist = RollingHistogram(len(all_requests))
+                histograms[task] = hist
+            hist.add(latency)
+            histograms['TOTAL'].add(latency)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for idx, content_str in enumerate(all_requests):
+            if rate:
+                delay = start_time + idx / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send_request, idx + 1, content_str)
+    histograms['duration'] = time.time() - start_time
+    return histograms
+
+
+def format_report(results):
+    """Return the results of a replay as a table."""
+    duration = results['duration']
+    lines = ['%-32s %6s %8s %8s %8s %8s %8s' %
+             ('task', 'count', 'req/s', 'mean', 'p50', 'p95', 'p99')]
+    tasks = sorted(k for k in results if k not in ('TOTAL', 'duration'))
+    for task in tasks + ['TOTAL']:
+        summary = results[task].summary()
+        if not summary['count']:
+            continue
+        lines.append('%-32s %6d %8.2f %8.3f %8.3f %8.3f %8.3f' %
+                     (task, summary['count'], summary['count'] / duration,
+                      summary['mean'], summary['p50'], summary['p95'],
+                      summary['p99']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from bioagents.host import AGENT_CLASSES, get_agent_class
+    parser = argparse.ArgumentParser(
+        description='Replay recorded requests against a bioagent.')
+    parser.add_argument('agent', help='The agent to send requests to, out '
+                                      'of %s.' %
+                                      ', '.join(sorted(AGENT_CLASSES)))
+    parser.add_argument('files', nargs='+',
+                        help='Recorded traffic files or integration test '
+                             'scripts.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='The number of requests sent at the same time.')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='The number of requests started per second.')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='The number of times the requests are sent.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='The number of threads the agent handles '
+                             'requests on (default: that of the agent).')
+    args = parser.parse_args(argv)
+
+    requests = []
+    for fname in args.files:
+        requests += [request for request, _ in read_traffic(fname)]
+    agent_class = get_agent_class(args.agent)
+    kwargs = {'num_workers': args.workers} if args.workers else {}
+    agent = agent_class(testing=True, **kwargs)
+    results = replay(agent, requests, args.concurrency, args.rate,
+                     args.repeats)
+    print(format_report(results))
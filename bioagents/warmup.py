@@ -0,0 +1,69 @@
+"""Build the canned requests agents handle to warm up before they start.
+
+The first request an agent handles pays for initializing what it uses
+lazily: INDRA's hierarchies, the TRIPS processor, PySB and BioNetGen,
+matplotlib's font cache and so on. To keep that cost off the first user
+utterance, an agent started with `warmup` set handles the requests returned
+by its `get_warmup_requests` method before it declares itself ready.
+
+These requests are made from the EKBs the tests use (kept in
+bioagents/tests/ekb_cache.json), so that warming up doesn't need TRIPS.
+Requests that would reach out to web services are best left out.
+
+Messages sent while warming up are dropped, the statistics are reset
+afterwards and agents keeping state should reset it in `end_warmup`. The
+time taken is logged and reported by AGENT-STATS.
+"""
+import os
+import json
+import logging
+from kqml import KQMLString
+from bioagents import BioagentException
+from bioagents.lazy import lazy_resource
+
+
+logger = logging.getLogger('Bioagents')
+
+
+fixture_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tests', 'ekb_cache.json')
+
+
+class MissingFixtureError(BioagentException):
+    pass
+
+
+@lazy_resource
+def get_fixture_ekbs():
+    """Return the EKBs of the test fixtures, keyed by their text."""
+    if not os.path.exists(fixture_file):
+        logger.warning('Could not find the warm-up fixtures in %s.' %
+                       fixture_file)
+        return {}
+    with open(fixture_file, 'r') as fh:
+        return json.load(fh)
+
+
+def get_fixture_ekb(text):
+    """Return the EKB XML of a text from the test fixtures."""
+    ekb_xml = get_fixture_ekbs().get(text)
+    if ekb_xml is None:
+        raise MissingFixtureError('No EKB for "%s" in the fixtures.' % text)
+    return ekb_xml
+
+
+def ekb_kstring(text):
+    """Return the EKB of a text from the fixtures as a KQMLString."""
+    return KQMLString(get_fixture_ekb(text))
+
+
+def stmts_kstring(text):
+    """Return the INDRA JSON of the statements in a text as a KQMLString.
+
+    The statements are extracted from the fixture EKB of the text with the
+    TRIPS processor, which warms it up as well.
+    """
+    from indra.sources import trips
+    from indra.statements import stmts_to_json
+    tp = trips.process_xml(get_fixture_ekb(text))
+    return KQMLString(json.dumps(stmts_to_json(tp.statements)))
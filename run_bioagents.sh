@@ -3,6 +3,11 @@
 #
 export PYTHONPATH=.:$HOME/Dropbox/postdoc/darpa/src/indra
 
+# To run the agents in a single process, sharing the resources they load, use
+#   python -m bioagents.host DTDA MRA
+# instead, or to fork them as separate processes after loading the resources
+#   python -m bioagents.launcher DTDA MRA
+
 trap cleanup 0 1 2 3 15
 
 python bioagents/dtda/dtda_module.py &
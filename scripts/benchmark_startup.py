@@ -0,0 +1,125 @@
+"""Measure the cold-start time and first-request latency of the bioagents.
+
+Each agent is started in a fresh Python process so that nothing is imported
+or loaded in advance. Three durations are measured: importing the agent's
+module, constructing the agent (in testing mode, so no connection to the
+Facilitator is needed) and handling the first request, taken from the
+agent's integration test file if there is one.
+
+Example:
+
+    python scripts/benchmark_startup.py --repeats 3 TRA MRA
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from bioagents.host import AGENT_CLASSES, get_agent_class
+from bioagents.traffic import read_traffic
+
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+_integration_dir = os.path.join(_root, 'integration')
+
+
+def get_first_request(agent_name):
+    """Return the first request in the agent's integration test file, if any.
+    """
+    path = os.path.join(_integration_dir, 'test_%s.in' % agent_name.lower())
+    if not os.path.exists(path):
+        return None
+    requests = read_traffic(path)
+    return requests[0][0] if requests else None
+
+
+def run_child(agent_name):
+    """Start the given agent, handle one request and print the timings."""
+    timings = {'agent': agent_name}
+
+    ts = time.time()
+    agent_class = get_agent_class(agent_name)
+    timings['import'] = time.time() - ts
+
+    ts = time.time()
+    agent = agent_class(testing=True)
+    timings['construct'] = time.time() - ts
+
+    content = get_first_request(agent_name)
+    if content is not None:
+        from kqml import KQMLPerformative, KQMLList
+        msg = KQMLPerformative.from_string(
+            '(request :reply-with IO-1 :content %s)' % content)
+        ts = time.time()
+        agent.receive_request(msg, KQMLList.from_string(content))
+        timings['first-request'] = time.time() - ts
+        reply_lines = agent.out.getvalue().strip().splitlines()
+        timings['reply'] = reply_lines[-1][:80].decode('utf-8') \
+            if reply_lines else ''
+    print(json.dumps(timings))
+
+
+def run_agent(agent_name):
+    """Run the benchmark for one agent in a new process."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([_root, env.get('PYTHONPATH', '')])
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                           '--child', agent_name], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = proc.stdout.decode('utf-8').strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        err = proc.stderr.decode('utf-8').strip().splitlines()
+        return {'agent': agent_name,
+                'error': err[-1] if err else 'exit code %d' % proc.returncode}
+    return json.loads(lines[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+
+def format_seconds(value):
+    return '%8.2f' % value if value is not None else '%8s' % '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the cold-start time and first-request latency '
+                    'of the bioagents.')
+    parser.add_argument('agents', nargs='*',
+                        help='The agents to benchmark, out of %s (default: '
+                             'all).' % ', '.join(sorted(AGENT_CLASSES)))
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='The number of times each agent is started.')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    agents = [name.upper() for name in args.agents] if args.agents \
+        else sorted(AGENT_CLASSES)
+    unknown = set(agents) - set(AGENT_CLASSES)
+    if unknown:
+        parser.error('unknown agents: %s' % ', '.join(sorted(unknown)))
+    print('%-10s %8s %8s %8s %8s' % ('agent', 'import', 'construct',
+                                      'request', 'total'))
+    for agent_name in agents:
+        runs = [run_agent(agent_name) for _ in range(args.repeats)]
+        errors = [r['error'] for r in runs if 'error' in r]
+        runs = [r for r in runs if 'error' not in r]
+        if not runs:
+            print('%-10s failed: %s' % (agent_name, errors[-1]))
+            continue
+        cols = [median([r[k] for r in runs if k in r])
+                for k in ('import', 'construct', 'first-request')]
+        total = sum(c for c in cols if c is not None)
+        print('%-10s %s' % (agent_name, ' '.join(format_seconds(c)
+                                                 for c in cols + [total])))
+
+
+if __name__ == '__main__':
+    main()
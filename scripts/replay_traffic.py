@@ -0,0 +1,10 @@
+"""Replay recorded requests against a bioagent and report their latency.
+
+See bioagents.traffic for the format of the files and the options.
+"""
+import sys
+from bioagents.traffic import main
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])